@@ -0,0 +1,90 @@
+"""
+adb.py — Fachada async de database.py.
+
+database.py es síncrono (sqlite3). Llamarlo directo desde código async
+bloquea el único event loop que comparten el bot y FastAPI mientras dura
+el I/O de disco. Aquí cada llamada corre en un executor dedicado y acotado
+(DB_WORKERS threads), así el loop sigue atendiendo otros updates:
+
+    semana, dia = await adb.get_estado(uid)
+    await adb.save_peso(uid, eid, semana, dia, 45)
+    txt, kb = await adb.run(ren.render_ejercicio, uid, semana, dia, idx)
+
+Cualquier función pública de database.py está disponible con el mismo
+nombre y firma. Para lógica síncrona que mezcla varias lecturas
+(renderer, gamification, science) usar adb.run().
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import database as db
+
+logger     = logging.getLogger(__name__)
+DB_WORKERS = int(os.environ.get("DB_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="adb")
+
+# No tiene sentido await-ear un context manager desde otro thread
+_NO_EXPORTAR = {"get_db"}
+
+
+async def run(fn, *args, **kwargs):
+    """Corre fn(*args, **kwargs) en el executor de DB y espera el resultado."""
+    loop = asyncio.get_running_loop()
+    ctx  = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+def __getattr__(name: str):
+    fn = getattr(db, name, None)
+    if name.startswith("_") or name in _NO_EXPORTAR or not callable(fn):
+        raise AttributeError(f"module 'adb' has no attribute '{name}'")
+
+    @functools.wraps(fn)
+    async def _async(*args, **kwargs):
+        return await run(getattr(db, name), *args, **kwargs)
+
+    globals()[name] = _async
+    return _async
+
+
+def shutdown() -> None:
+    _executor.shutdown(wait=True)
+
+
+# ── LAG DEL EVENT LOOP ────────────────────────────────────────────────────────
+# Mide cuánto tarda el loop en despertar una tarea que pidió dormir N segundos.
+# Si algo bloquea el loop (I/O síncrono, CPU), el retraso aparece aquí.
+
+_LAG = {"ultimo_ms": 0.0, "max_ms": 0.0, "total_ms": 0.0, "muestras": 0}
+
+
+async def vigilar_lag(intervalo: float = 0.5) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        t0 = loop.time()
+        await asyncio.sleep(intervalo)
+        lag_ms = max(0.0, (loop.time() - t0 - intervalo) * 1000)
+        _LAG["ultimo_ms"]  = lag_ms
+        _LAG["max_ms"]     = max(_LAG["max_ms"], lag_ms)
+        _LAG["total_ms"]  += lag_ms
+        _LAG["muestras"]  += 1
+        if lag_ms > 250:
+            logger.warning("Event loop bloqueado %.0f ms", lag_ms)
+
+
+def lag_stats() -> dict:
+    n = _LAG["muestras"]
+    return {
+        "ultimo_ms":   round(_LAG["ultimo_ms"], 2),
+        "max_ms":      round(_LAG["max_ms"], 2),
+        "promedio_ms": round(_LAG["total_ms"] / n, 2) if n else 0.0,
+        "muestras":    n,
+    }
@@ -4,6 +4,7 @@ api.py — FastAPI backend para la web app de GymCoach.
 Endpoints:
   POST /auth/login          → token JWT
   GET  /rutina/hoy          → rutina del día con pesos sugeridos
+  GET  /dashboard           → rutina de hoy + macros + racha/XP + avance de la semana
   GET  /plan                → plan completo 4 semanas
   GET  /progreso            → lista ejercicios con historial
   GET  /progreso/{eid}      → historial semana a semana de un ejercicio
@@ -11,24 +12,46 @@ Endpoints:
   GET  /resumen             → resumen semanal
   POST /pesos               → guardar peso de un ejercicio
   POST /sesion/completar    → marcar sesión como completada
+  POST /events/token        → token corto para abrir GET /events (SSE)
+  POST /telegram/webhook/{secret} → updates del bot (solo con TELEGRAM_WEBHOOK_URL)
 
 Auth: JWT simple. El user_id se guarda en el token.
+Caché: /plan, /progreso, /stats y /cuerpo/historial mandan ETag (304 si no cambió).
 CORS: abierto para Vercel.
 """
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import hmac
+import math
 import os
 import logging
+import time
 from datetime import datetime, timedelta, timezone
+from functools import cached_property
 from typing import Any
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from jose import JWTError, jwt
 
+try:
+    import orjson          # opcional: RespuestaJSON cae a json estándar sin él
+except ImportError:
+    orjson = None
+
+import adb
 import database as db
+import envios
+import eventos
+import limitador
+import metricas
+from cache import CacheLRU
 import catalog as cat
 import gamification as gam
 import progreso as prog
@@ -42,6 +65,37 @@ logger = logging.getLogger(__name__)
 SECRET_KEY  = os.environ.get("JWT_SECRET", "gymcoach-dev-secret-change-in-prod")
 ALGORITHM   = "HS256"
 TOKEN_HOURS = 24 * 30   # 30 días
+ALLOWED_RELOAD_SEG = int(os.environ.get("ALLOWED_RELOAD_SEG", "300"))
+ADMIN_ID    = int(os.environ.get("ADMIN_TELEGRAM_ID", "1557254587"))
+# Respuestas más chicas que esto no se comprimen (no vale el CPU)
+GZIP_MIN_BYTES = int(os.environ.get("GZIP_MIN_BYTES", "1024"))
+# /metrics: con METRICS_TOKEN exige "Authorization: Bearer <METRICS_TOKEN>";
+# sin él solo responde a localhost. METRICS_PUBLICO=1 lo abre a cualquiera
+# (opt-in explícito: muestra tráfico por ruta, pool, caches y límites).
+METRICS_TOKEN   = os.environ.get("METRICS_TOKEN", "")
+METRICS_PUBLICO = os.environ.get("METRICS_PUBLICO", "0") == "1"
+# /events manda un comentario cada tanto para que proxies no corten la conexión
+SSE_PING_SEG   = float(os.environ.get("SSE_PING_SEG", "20"))
+# Vida del token de /events (va en la query: queda en logs e historial)
+SSE_TOKEN_SEG  = int(os.environ.get("SSE_TOKEN_SEG", "60"))
+
+# Con TELEGRAM_WEBHOOK_URL (URL pública de esta API) el bot recibe updates
+# por webhook en vez de long polling. TELEGRAM_API_URL apunta el bot a otro
+# servidor de la Bot API (uno local propio, o uno falso en pruebas).
+TELEGRAM_WEBHOOK_URL    = os.environ.get("TELEGRAM_WEBHOOK_URL", "").rstrip("/")
+TELEGRAM_WEBHOOK_SECRET = os.environ.get("TELEGRAM_WEBHOOK_SECRET", "")
+TELEGRAM_API_URL        = os.environ.get("TELEGRAM_API_URL", "").rstrip("/")
+# Jobs que no se pueden repetir por worker (recordatorios, compactar):
+# "auto" = los programa el worker que toma un flock sobre DB_PATH.jobs.lock
+# (uno por host; los demás reintentan cada minuto por si ese muere),
+# "1" = siempre, "0" = nunca (otro proceso los corre).
+BOT_JOBS = os.environ.get("BOT_JOBS", "auto")
+
+# Application y procesador.ProcesadorPorUsuario del bot, si _run_bot arrancó
+_bot_app        = None
+_bot_procesador = None
+_webhook_secret = ""
+_jobs_lock_fd   = None
 
 app = FastAPI(title="GymCoach API", version="1.0")
 
@@ -51,7 +105,38 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Retry-After"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_BYTES)
+
+
+@app.middleware("http")
+async def medir_peticion(request: Request, call_next):
+    """Cuenta y cronometra cada petición por plantilla de ruta (/progreso/{ejercicio_id})."""
+    t0     = time.perf_counter()
+    status_code = 500
+    with metricas.peticion() as req:
+        try:
+            resp = await call_next(request)
+            status_code = resp.status_code
+            return resp
+        finally:
+            ruta = getattr(request.scope.get("route"), "path", "<sin_ruta>")
+            metricas.registrar_peticion(
+                ruta, request.method, status_code, time.perf_counter() - t0, req)
+
+
+class RespuestaJSON(JSONResponse):
+    """
+    JSONResponse serializada con orjson si está instalado. Devolverla
+    directo desde el endpoint también evita el paso por jsonable_encoder:
+    solo para contenido que ya es JSON nativo (dict/list/str/num/None).
+    """
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
 
 
 
@@ -60,20 +145,89 @@ bearer = HTTPBearer()
 
 # ── AUTH ──────────────────────────────────────────────────────────────────────
 
-def create_token(user_id: int) -> str:
-    exp = datetime.now(timezone.utc) + timedelta(hours=TOKEN_HOURS)
-    return jwt.encode({"sub": str(user_id), "exp": exp}, SECRET_KEY, algorithm=ALGORITHM)
+def create_token(user_id: int, uso: str | None = None, segundos: int | None = None) -> str:
+    """
+    JWT de login (30 días), o con uso= uno de vida corta que solo sirve
+    para ese endpoint (uso="events": /events, segundos=SSE_TOKEN_SEG).
+    """
+    vida = timedelta(seconds=segundos) if segundos else timedelta(hours=TOKEN_HOURS)
+    claims = {"sub": str(user_id), "exp": datetime.now(timezone.utc) + vida}
+    if uso:
+        claims["uso"] = uso
+    return jwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+
+
+# Tokens ya verificados → uid. Cada entrada vive hasta el exp del token, así
+# que un token vencido nunca sale de aquí: vuelve a jwt.decode y da 401.
+_tokens_verificados = CacheLRU(
+    maxsize=int(os.environ.get("TOKEN_CACHE_SIZE", "1024")), ttl=TOKEN_HOURS * 3600)
 
 
 def get_current_user(creds: HTTPAuthorizationCredentials = Depends(bearer)) -> int:
+    return _uid_de_token(creds.credentials)
+
+
+def _uid_de_token(token: str, uso: str | None = None) -> int:
+    """uid del token; uso tiene que coincidir (None = token de login)."""
+    if uso is None:
+        uid = _tokens_verificados.get(token)
+        if uid is not None:
+            return uid
     try:
-        payload = jwt.decode(creds.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         uid = int(payload["sub"])
     except (JWTError, KeyError, ValueError):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
+    if payload.get("uso") != uso:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
+    restante = float(payload.get("exp", 0)) - time.time()
+    if uso is None and restante > 0:
+        _tokens_verificados.set(token, uid, ttl=restante)
     return uid
 
 
+def exigir_cupo(regla: str, uid: int) -> None:
+    """Gasta un token de (regla, uid) o responde 429 + Retry-After."""
+    espera = limitador.consumir(regla, uid)
+    if espera:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=f"Demasiadas solicitudes, intenta en {limitador.texto_espera(espera)}",
+            headers={"Retry-After": str(math.ceil(espera))},
+        )
+
+
+def limitado(regla: str):
+    """Dependencia: el uid autenticado, o 429 + Retry-After si agotó su bucket."""
+    def _dep(uid: int = Depends(get_current_user)) -> int:
+        exigir_cupo(regla, uid)
+        return uid
+    return _dep
+
+
+# ── ETAG ──────────────────────────────────────────────────────────────────────
+# Los GET pesados (/plan, /progreso, /stats, /cuerpo/historial) mandan un ETag
+# armado con db.version_datos() — contadores que suben triggers en cada
+# escritura — y responden 304 sin reconstruir el JSON si el cliente ya lo
+# tiene. _ARRANQUE invalida todo al desplegar (el formato pudo cambiar).
+
+_ARRANQUE = format(int(time.time()), "x")
+
+
+def _etag(uid: int, *scopes: str, extra: str = "") -> str:
+    versiones = ".".join(str(v) for v in db.version_datos(uid, *scopes))
+    return f'W/"{_ARRANQUE}-{uid}-{versiones}{extra}"'
+
+
+def respuesta_con_etag(request: Request, etag: str, construir) -> Response:
+    """304 si If-None-Match coincide; si no, construir() → JSON con ETag."""
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none = request.headers.get("if-none-match", "")
+    if etag in (t.strip() for t in if_none.split(",")):
+        return Response(status_code=304, headers=headers)
+    return RespuestaJSON(construir(), headers=headers)
+
+
 class LoginRequest(BaseModel):
     user_id: int
     pin:     str   # pin de 4 dígitos configurado en el bot con /setpin
@@ -122,12 +276,10 @@ def login_telegram(req: TelegramAuthRequest):
         INSERT OR IGNORE INTO usuarios (user_id, nombre)
         VALUES (?, ?)
     """, (uid, req.first_name))
+    db.invalidar_usuario(uid)
 
     # Agregar a allowed_users si no está
-    db.execute("""
-        INSERT OR IGNORE INTO allowed_users (user_id, activo)
-        VALUES (?, 1)
-    """, (uid,))
+    db.add_allowed_user(uid)
 
     token  = create_token(uid)
     perfil = db.get_perfil(uid)
@@ -169,10 +321,41 @@ def login(req: LoginRequest):
 
 # ── RUTINA HOY ────────────────────────────────────────────────────────────────
 
+class ContextoUsuario:
+    """
+    Lecturas de un request, cada una hecha a lo sumo una vez. Los
+    constructores de respuesta reciben el contexto en vez del uid, así
+    /dashboard arma varias secciones sin releer estado, día o racha.
+    """
+
+    def __init__(self, uid: int):
+        self.uid = uid
+
+    @cached_property
+    def estado(self) -> tuple:
+        return db.get_estado(self.uid)
+
+    @cached_property
+    def ejercicios_dia(self) -> list:
+        return db.get_day_snapshot(self.uid, *self.estado)
+
+    @cached_property
+    def racha_xp(self) -> tuple:
+        return gam.get_racha_xp(self.uid)
+
+    @cached_property
+    def dias_semana(self) -> list:
+        return db.get_completado_semana(self.uid, self.estado[0])
+
+
 @app.get("/rutina/hoy")
 def rutina_hoy(uid: int = Depends(get_current_user)) -> dict:
-    semana, dia = db.get_estado(uid)
-    ejercicios  = db.get_ejercicios_dia(uid, semana, dia)
+    return _construir_rutina_hoy(ContextoUsuario(uid))
+
+
+def _construir_rutina_hoy(ctx: ContextoUsuario) -> dict:
+    semana, dia = ctx.estado
+    ejercicios  = ctx.ejercicios_dia
 
     if not ejercicios:
         # Día libre → recovery activo
@@ -191,9 +374,8 @@ def rutina_hoy(uid: int = Depends(get_current_user)) -> dict:
 
     ejs_out = []
     for e in ejercicios:
-        ej_obj   = cat.BY_ID.get(e["ejercicio_id"])
-        ultimo   = db.get_ultimo_peso(uid, e["ejercicio_id"])
-        sug      = db.get_peso_sugerido(uid, e["ejercicio_id"])
+        ultimo   = e["ultimo"]
+        sug      = e["peso_sugerido"]
         ejs_out.append({
             "ejercicio_id": e["ejercicio_id"],
             "nombre":       e["ejercicio"],
@@ -209,8 +391,7 @@ def rutina_hoy(uid: int = Depends(get_current_user)) -> dict:
             "peso_sugerido": float(sug) if sug else None,
         })
 
-    racha    = gam.get_racha(uid)
-    xp_total = gam.get_xp(uid)
+    racha, xp_total = ctx.racha_xp
     nivel_gam = gam.get_nivel(xp_total)
 
     return {
@@ -227,6 +408,34 @@ def rutina_hoy(uid: int = Depends(get_current_user)) -> dict:
     }
 
 
+@app.get("/dashboard")
+def dashboard(uid: int = Depends(get_current_user)) -> Response:
+    """Todo lo que pinta la pantalla Hoy en un solo request."""
+    ctx = ContextoUsuario(uid)
+    racha, xp_total = ctx.racha_xp
+    _, xp_en, xp_para = gam.get_siguiente_nivel(xp_total)
+    dias  = ctx.dias_semana
+    hechos = sum(1 for d in dias if d["completado"])
+    return RespuestaJSON({
+        "rutina": _construir_rutina_hoy(ctx),
+        "macros": _construir_macros(),
+        "gamificacion": {
+            "racha":         racha,
+            "xp":            xp_total,
+            "nivel":         gam.get_nivel(xp_total),
+            "xp_en_nivel":   xp_en,
+            "xp_para_nivel": xp_para,
+        },
+        "semana": {
+            "semana":      ctx.estado[0],
+            "dias":        dias,
+            "completados": hechos,
+            "total":       len(dias),
+            "porcentaje":  round(100 * hechos / len(dias)) if dias else 0,
+        },
+    })
+
+
 def _estimar_duracion(ejercicios: list) -> int:
     from catalog import COMPUESTOS
     minutos = 0
@@ -251,7 +460,11 @@ def _estimar_duracion(ejercicios: list) -> int:
 # ── PLAN COMPLETO ─────────────────────────────────────────────────────────────
 
 @app.get("/plan")
-def get_plan(uid: int = Depends(get_current_user)) -> dict:
+def get_plan(request: Request, uid: int = Depends(get_current_user)) -> Response:
+    return respuesta_con_etag(request, _etag(uid, "plan"), lambda: _construir_plan(uid))
+
+
+def _construir_plan(uid: int) -> dict:
     semana_actual, dia_actual = db.get_estado(uid)
     rows = db.fetchall("""
         SELECT semana, dia, grupo, ejercicio_id, ejercicio,
@@ -300,7 +513,11 @@ def get_plan(uid: int = Depends(get_current_user)) -> dict:
 # ── PROGRESO ──────────────────────────────────────────────────────────────────
 
 @app.get("/progreso")
-def get_progreso(uid: int = Depends(get_current_user)) -> dict:
+def get_progreso(request: Request, uid: int = Depends(get_current_user)) -> Response:
+    return respuesta_con_etag(request, _etag(uid, "progreso"), lambda: _construir_progreso(uid))
+
+
+def _construir_progreso(uid: int) -> dict:
     ejercicios = db.get_ejercicios_con_historial(uid)
     resumen    = db.get_resumen_progresion(uid)
 
@@ -323,12 +540,30 @@ def get_progreso(uid: int = Depends(get_current_user)) -> dict:
 
 
 @app.get("/progreso/{ejercicio_id}")
-def get_historial(ejercicio_id: str, uid: int = Depends(get_current_user)) -> dict:
+def get_historial(
+    request: Request,
+    ejercicio_id: str,
+    semana_desde: int | None = Query(None, ge=1, description="Semana del plan inicial (no es fecha)"),
+    semana_hasta: int | None = Query(None, ge=1, description="Semana del plan final (no es fecha)"),
+    limit:  int        = Query(db.HISTORIAL_LIMITE_MAX, ge=1, le=db.HISTORIAL_LIMITE_MAX),
+    cursor: int | None = Query(None, description="Última semana recibida"),
+    uid: int = Depends(get_current_user),
+) -> dict:
+    """
+    Historial semana a semana, paginado por número de semana del plan.
+    ganancia_total es sobre todo el historial (como siempre);
+    ganancia_pagina, sobre las semanas devueltas.
+    """
+    # from/to son fechas en las otras rutas paginadas: acá no se ignoran en silencio
+    if "from" in request.query_params or "to" in request.query_params:
+        raise HTTPException(status_code=400,
+                            detail="Esta ruta filtra por semana: usa semana_desde/semana_hasta")
     ej_obj = cat.BY_ID.get(ejercicio_id)
     if not ej_obj:
         raise HTTPException(status_code=404, detail="Ejercicio no encontrado")
 
-    historial = db.get_progresion_ejercicio(uid, ejercicio_id)
+    historial, siguiente = db.get_progresion_pagina(
+        uid, ejercicio_id, desde=semana_desde, hasta=semana_hasta, limite=limit, cursor=cursor)
     sug       = db.get_peso_sugerido(uid, ejercicio_id)
 
     semanas_out = []
@@ -341,26 +576,34 @@ def get_historial(ejercicio_id: str, uid: int = Depends(get_current_user)) -> di
             "reps":        row["reps_hechas"],
         })
 
-    ganancia = 0.0
+    ganancia_pagina = 0.0
     if len(pesos) >= 2:
-        ganancia = round(pesos[-1] - pesos[0], 1)
+        ganancia_pagina = round(pesos[-1] - pesos[0], 1)
+    pagina_completa = semana_desde is None and semana_hasta is None and cursor is None and siguiente is None
+    ganancia = ganancia_pagina if pagina_completa else db.get_ganancia_ejercicio(uid, ejercicio_id)
 
     return {
-        "ejercicio_id":   ejercicio_id,
-        "nombre":         ej_obj.nombre,
-        "grupo":          ej_obj.grupo,
-        "emg_score":      ej_obj.emg_score,
-        "historial":      semanas_out,
-        "ganancia_total": ganancia,
-        "peso_sugerido":  float(sug) if sug else None,
-        "tendencia":      "up" if ganancia > 0 else ("down" if ganancia < 0 else "flat"),
+        "ejercicio_id":    ejercicio_id,
+        "nombre":          ej_obj.nombre,
+        "grupo":           ej_obj.grupo,
+        "emg_score":       ej_obj.emg_score,
+        "historial":       semanas_out,
+        "siguiente":       siguiente,
+        "ganancia_total":  ganancia,
+        "ganancia_pagina": ganancia_pagina,
+        "peso_sugerido":   float(sug) if sug else None,
+        "tendencia":       "up" if ganancia > 0 else ("down" if ganancia < 0 else "flat"),
     }
 
 
 # ── STATS ─────────────────────────────────────────────────────────────────────
 
 @app.get("/stats")
-def get_stats(uid: int = Depends(get_current_user)) -> dict:
+def get_stats(request: Request, uid: int = Depends(get_current_user)) -> Response:
+    return respuesta_con_etag(request, _etag(uid, "stats"), lambda: _construir_stats(uid))
+
+
+def _construir_stats(uid: int) -> dict:
     stats     = db.get_stats(uid)
     racha     = gam.get_racha(uid)
     xp_total  = gam.get_xp(uid)
@@ -375,11 +618,7 @@ def get_stats(uid: int = Depends(get_current_user)) -> dict:
     _, xp_en, xp_para = gam.get_siguiente_nivel(xp_total)
 
     # Progresiones totales
-    row_prog = db.fetchone(
-        "SELECT COUNT(*) as n FROM progreso WHERE user_id=? AND progreso_reportado='si'",
-        (uid,)
-    )
-    progresiones = int(row_prog["n"]) if row_prog else 0
+    progresiones = db.contar_progresiones(uid)
 
     badges_out = []
     for key in badges:
@@ -482,21 +721,61 @@ def guardar_peso(req: PesoRequest, uid: int = Depends(get_current_user)) -> dict
 
 # ── COMPLETAR SESIÓN ──────────────────────────────────────────────────────────
 
+class PesoSesion(BaseModel):
+    ejercicio_id: str
+    peso_lbs:     float
+    series:       int   = None
+    reps:         str   = None
+
+
 class SesionRequest(BaseModel):
     semana:  int
     dia:     str
     rir:     int   = 2
     fatiga:  int   = 2
+    pesos:   list[PesoSesion] = []
 
 
 @app.post("/sesion/completar")
 def completar_sesion(req: SesionRequest, uid: int = Depends(get_current_user)) -> dict:
+    """
+    Cierra la sesión: pesos (opcional, en el mismo request), día completado,
+    ajuste de ciencia, XP/badges y avance de día — todo en una transacción.
+    Si algo falla no queda nada guardado y responde 500.
+    Devuelve el peso sugerido nuevo de cada ejercicio del día.
+    """
+    for p in req.pesos:
+        if not cat.is_valid(p.ejercicio_id):
+            raise HTTPException(status_code=400, detail=f"ejercicio_id inválido: {p.ejercicio_id}")
+        if p.peso_lbs < 0 or p.peso_lbs > 2000:
+            raise HTTPException(status_code=400, detail="Peso fuera de rango")
+
+    try:
+        with db.transaccion():
+            resultado = _completar_sesion(req, uid)
+    except Exception:
+        logger.exception("Cierre de sesión uid=%s S%s %s", uid, req.semana, req.dia)
+        raise HTTPException(status_code=500, detail="No se pudo cerrar la sesión; no se guardó nada")
+
+    nueva_sem = resultado["siguiente_dia"]["semana"]
+    if nueva_sem > req.semana:
+        try:
+            sci.aplicar_prioridad_muscular(uid, nueva_sem)
+        except Exception as e:
+            logger.warning("Prioridad muscular: %s", e)
+
+    resultado["pesos_sugeridos"] = {e["ejercicio_id"]: e["peso_sugerido"]
+                                    for e in db.get_day_snapshot(uid, req.semana, req.dia)}
+    return resultado
+
+
+def _completar_sesion(req: SesionRequest, uid: int) -> dict:
+    for p in req.pesos:
+        db.save_peso(uid, p.ejercicio_id, req.semana, req.dia,
+                     peso_lbs=p.peso_lbs, series=p.series, reps=p.reps)
+
     # Marcar todos los ejercicios como completados
-    with db.get_db() as conn:
-        conn.execute(
-            "UPDATE rutinas SET completado=1 WHERE user_id=? AND semana=? AND dia=?",
-            (uid, req.semana, req.dia),
-        )
+    db.marcar_dia_completado(uid, req.semana, req.dia)
 
     db.save_progreso_sesion(uid, req.semana, req.dia,
                             rir=req.rir, progresion="si", fatiga=req.fatiga)
@@ -515,12 +794,6 @@ def completar_sesion(req: SesionRequest, uid: int = Depends(get_current_user)) -
     nueva_sem, nuevo_dia = db.avanzar_dia(uid, req.semana, req.dia, max_semana=max_s)
     db.upsert_estado(uid, nueva_sem, nuevo_dia)
 
-    if nueva_sem > req.semana:
-        try:
-            sci.aplicar_prioridad_muscular(uid, nueva_sem)
-        except Exception as e:
-            logger.warning("Prioridad muscular: %s", e)
-
     return {
         "ok":            True,
         "xp_ganado":     resultado_gam["xp_ganado"],
@@ -572,16 +845,8 @@ def swap_ejercicio(req: SwapRequest, uid: int = Depends(get_current_user)) -> di
         raise HTTPException(status_code=400, detail="ID inválido")
     ej_orig = cat.BY_ID[req.ejercicio_id_original]
     ej_new  = cat.BY_ID[req.ejercicio_id_nuevo]
-    with db.get_db() as conn:
-        conn.execute(
-            "UPDATE rutinas SET ejercicio_id=?, ejercicio=?, patron=? "
-            "WHERE user_id=? AND ejercicio_id=?",
-            (ej_new.id, ej_new.nombre, ej_new.patron, uid, ej_orig.id),
-        )
-        conn.execute(
-            "DELETE FROM progreso WHERE user_id=? AND ejercicio_id=?",
-            (uid, ej_orig.id),
-        )
+    db.reemplazar_ejercicio(uid, ej_orig.id, ej_new.id, ej_new.nombre, ej_new.patron,
+                            borrar_progreso=True)
     db.save_swap(uid, ej_orig.id, ej_new.id, ej_orig.grupo, ej_orig.rol)
     return {"ok": True, "nuevo_ejercicio": {"id": ej_new.id, "nombre": ej_new.nombre}}
 
@@ -602,6 +867,7 @@ def set_pin(req: PinRequest) -> dict:
     if len(req.pin) != 4 or not req.pin.isdigit():
         raise HTTPException(status_code=400, detail="PIN debe ser 4 dígitos")
     db.execute("UPDATE usuarios SET pin=? WHERE user_id=?", (req.pin, req.user_id))
+    db.invalidar_usuario(req.user_id)
     return {"ok": True}
 
 
@@ -621,7 +887,8 @@ def auth_token(token: str):
         )
     # Asegurar que el usuario existe
     db.execute("INSERT OR IGNORE INTO usuarios (user_id) VALUES (?)", (uid,))
-    db.execute("INSERT OR IGNORE INTO allowed_users (user_id, activo) VALUES (?,1)", (uid,))
+    db.add_allowed_user(uid)
+    db.invalidar_usuario(uid)
 
     jwt_token = create_token(uid)
     perfil    = db.get_perfil(uid)
@@ -636,30 +903,72 @@ def auth_token(token: str):
 
 
 @app.get("/analisis/historial")
-def get_analisis_historial(uid: int = Depends(get_current_user)) -> dict:
-    """Historial de análisis guardados."""
-    rows = db.fetchall("""
-        SELECT fecha, texto, tipo FROM analisis_historial
-        WHERE user_id=? ORDER BY fecha DESC LIMIT 14
-    """, (uid,))
-    return {"historial": [dict(r) for r in rows] if rows else []}
+def get_analisis_historial(
+    desde:  str | None = Query(None, alias="from", description="YYYY-MM-DD"),
+    hasta:  str | None = Query(None, alias="to",   description="YYYY-MM-DD"),
+    limit:  int        = Query(14, ge=1, le=db.HISTORIAL_LIMITE_MAX),
+    cursor: str | None = None,
+    uid: int = Depends(get_current_user),
+) -> dict:
+    """Historial de análisis guardados, más nuevos primero."""
+    try:
+        filas, siguiente = db.get_analisis_pagina(
+            uid, desde=desde, hasta=hasta, limite=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"historial": [{k: f[k] for k in ("fecha", "texto", "tipo")} for f in filas],
+            "siguiente": siguiente}
+
+
+# Un análisis por usuario y día mientras no cambien sus pesos: la huella es
+# el hash del prompt, así que cualquier dato nuevo genera texto nuevo.
+ANALISIS_TIMEOUT_SEG = float(os.environ.get("ANALISIS_TIMEOUT_SEG", "20"))
+_gemini_client = None
+_analisis_en_curso: dict[tuple[int, str], asyncio.Task] = {}
+
+
+def _cliente_gemini(api_key: str):
+    global _gemini_client
+    if _gemini_client is None:
+        from google import genai as gai
+        _gemini_client = gai.Client(api_key=api_key)
+    return _gemini_client
+
+
+async def _generar_analisis(uid: int, prompt: str, huella: str, api_key: str) -> str | None:
+    try:
+        with metricas.medir_llm("analisis"):
+            resp = await asyncio.wait_for(
+                _cliente_gemini(api_key).aio.models.generate_content(
+                    model="gemini-2.0-flash", contents=prompt),
+                timeout=ANALISIS_TIMEOUT_SEG,
+            )
+        texto = resp.text.strip()
+    except asyncio.TimeoutError:
+        logger.warning("Gemini analisis: timeout tras %.0f s", ANALISIS_TIMEOUT_SEG)
+        return None
+    except Exception as e:
+        logger.warning("Gemini analisis: %s", e)
+        return None
+    await adb.save_analisis(uid, texto, "semanal", huella)
+    return texto
 
 
 @app.get("/analisis")
 async def get_analisis(uid: int = Depends(get_current_user)) -> dict:
-    """Análisis con Gemini de la semana actual."""
-    import os
-    from google import genai as gai
-
-    semana, dia = db.get_estado(uid)
-    perfil      = db.get_perfil(uid)
+    """
+    Análisis con Gemini de la semana actual (uno por día y datos). El límite
+    "analisis" solo cuenta cuando hay que llamar a Gemini: servir el texto
+    guardado o sumarse a una llamada en curso no gasta cupo.
+    """
+    perfil      = await adb.get_perfil(uid)
 
     # Recopilar datos de la semana
-    rows = db.fetchall("""
+    rows = await adb.fetchall("""
         SELECT p.ejercicio_id, r.ejercicio, r.grupo,
                MAX(p.peso_lbs) as peso_max,
                LAG(MAX(p.peso_lbs)) OVER (PARTITION BY p.ejercicio_id ORDER BY p.semana) as peso_ant
-        FROM pesos p
+        FROM pesos_todos p
         JOIN rutinas r ON r.user_id=p.user_id AND r.ejercicio_id=p.ejercicio_id
         WHERE p.user_id=? AND p.peso_lbs IS NOT NULL
         GROUP BY p.ejercicio_id, p.semana
@@ -676,15 +985,7 @@ async def get_analisis(uid: int = Depends(get_current_user)) -> dict:
         for r in rows[:8]
     )
 
-    gemini_key = os.environ.get("GEMINI_API_KEY", "")
-    if not gemini_key:
-        return {"texto": None, "tiene_datos": True}
-
-    try:
-        client = gai.Client(api_key=gemini_key)
-        resp   = client.models.generate_content(
-            model    = "gemini-2.0-flash",
-            contents = f"""Eres un coach de gym. Analiza estos datos en 2-3 líneas cortas y directas.
+    prompt = f"""Eres un coach de gym. Analiza estos datos en 2-3 líneas cortas y directas.
 Sin frases motivacionales genéricas. Solo observaciones específicas con números.
 
 Datos de entrenamiento:
@@ -693,12 +994,26 @@ Datos de entrenamiento:
 Nivel: {perfil.get('nivel','intermedio')} | Objetivo: {perfil.get('objetivo','general')}
 
 Responde en español. Máximo 3 líneas. Sin bullets, en párrafo."""
-        )
-        return {"texto": resp.text.strip(), "tiene_datos": True}
-    except Exception as e:
-        logger.warning("Gemini analisis: %s", e)
+    huella = hashlib.sha1(prompt.encode()).hexdigest()
+
+    texto = await adb.get_analisis_del_dia(uid, "semanal", huella)
+    if texto:
+        return {"texto": texto, "tiene_datos": True}
+
+    gemini_key = os.environ.get("GEMINI_API_KEY", "")
+    if not gemini_key:
         return {"texto": None, "tiene_datos": True}
 
+    # Dos pestañas abiertas a la vez esperan la misma llamada a Gemini
+    clave = (uid, huella)
+    tarea = _analisis_en_curso.get(clave)
+    if tarea is None:
+        exigir_cupo("analisis", uid)
+        tarea = asyncio.create_task(_generar_analisis(uid, prompt, huella, gemini_key))
+        _analisis_en_curso[clave] = tarea
+        tarea.add_done_callback(lambda _t: _analisis_en_curso.pop(clave, None))
+    return {"texto": await asyncio.shield(tarea), "tiene_datos": True}
+
 
 # ── CUERPO ────────────────────────────────────────────────────────────────────
 
@@ -713,10 +1028,33 @@ def get_cuerpo(uid: int = Depends(get_current_user)) -> dict:
 
 
 @app.get("/cuerpo/historial")
-def get_cuerpo_historial(uid: int = Depends(get_current_user)) -> dict:
-    """Historial de pesajes para la gráfica de tendencia."""
-    historial = db.get_historial_pesajes(dias=90)
-    return {"historial": [dict(r) for r in historial]}
+def get_cuerpo_historial(
+    request: Request,
+    desde:  str | None = Query(None, alias="from", description="YYYY-MM-DD"),
+    hasta:  str | None = Query(None, alias="to",   description="YYYY-MM-DD"),
+    limit:  int        = Query(db.HISTORIAL_LIMITE_MAX, ge=1, le=db.HISTORIAL_LIMITE_MAX),
+    cursor: str | None = Query(None, description="Fecha del último pesaje recibido"),
+    campos: str | None = Query(None, description="Columnas separadas por coma, ej. Fecha,Peso_kg"),
+    uid: int = Depends(get_current_user),
+) -> Response:
+    """Historial de pesajes para la gráfica de tendencia (últimos 90 días por defecto)."""
+    if not (desde or hasta or cursor):
+        desde = f"{datetime.now() - timedelta(days=90):%Y-%m-%d}"
+    columnas = [c.strip() for c in campos.split(",") if c.strip()] if campos else None
+
+    def construir() -> dict:
+        try:
+            filas, siguiente = db.get_pesajes_pagina(
+                desde=desde, hasta=hasta, limite=limit, cursor=cursor, campos=columnas)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"historial": filas, "siguiente": siguiente}
+
+    # La ventana por defecto se mueve sola: la fecha va en el ETag, y los
+    # parámetros también porque cada combinación es otra respuesta
+    consulta = hashlib.sha1(request.url.query.encode()).hexdigest()[:12]
+    etag = _etag(uid, "cuerpo", extra=f"-{datetime.now():%Y%m%d}-{consulta}")
+    return respuesta_con_etag(request, etag, construir)
 
 
 # ── NUTRICIÓN ─────────────────────────────────────────────────────────────────
@@ -734,6 +1072,10 @@ def get_plan_nutricion(uid: int = Depends(get_current_user)) -> dict:
 @app.get("/nutricion/macros")
 def get_macros(uid: int = Depends(get_current_user)) -> dict:
     """Macros del día según último pesaje y multiplicador actual."""
+    return _construir_macros()
+
+
+def _construir_macros() -> dict:
     import nutricion as nut
     macros = nut.get_macros_hoy()
     if not macros:
@@ -742,14 +1084,13 @@ def get_macros(uid: int = Depends(get_current_user)) -> dict:
 
 
 @app.post("/nutricion/generar")
-async def generar_plan_manual(uid: int = Depends(get_current_user)) -> dict:
+async def generar_plan_manual(uid: int = Depends(limitado("nutricion"))) -> dict:
     """Genera el plan de nutrición manualmente (no esperar al domingo)."""
     import nutricion as nut
     # Obtener datos gym para el análisis cruzado
     racha = 0
     try:
-        import gamification as gam
-        racha = gam.get_racha(uid)
+        racha = await adb.run(gam.get_racha, uid)
     except Exception:
         pass
     datos_gym = {"racha": racha, "sesiones": 0, "grupos": []}
@@ -757,66 +1098,205 @@ async def generar_plan_manual(uid: int = Depends(get_current_user)) -> dict:
     return {"generado": ok}
 
 
+@app.post("/events/token")
+def token_eventos(uid: int = Depends(get_current_user)) -> dict:
+    """Token de SSE_TOKEN_SEG segundos para abrir /events (uno por conexión)."""
+    return {"token": create_token(uid, uso="events", segundos=SSE_TOKEN_SEG),
+            "expira_en": SSE_TOKEN_SEG}
+
+
+@app.get("/events", include_in_schema=False)
+async def stream_eventos(request: Request, token: str = Query(...)) -> StreamingResponse:
+    """
+    Server-sent events con los cambios del usuario (peso, sesion,
+    dia_completado, estado, plan, error_guardado), vengan de la web o del
+    bot. EventSource no deja mandar headers, así que el token va en la
+    query: solo se acepta el de POST /events/token (vida corta), nunca el
+    JWT de login. El token se valida al conectar; el stream sigue abierto
+    aunque venza.
+    """
+    uid = _uid_de_token(token, uso="events")
+
+    async def stream():
+        with eventos.suscribir(uid) as sub:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                evento = await sub.siguiente(timeout=SSE_PING_SEG)
+                yield eventos.formato_sse(evento) if evento else ": ping\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control":     "no-cache",
+        "X-Accel-Buffering": "no",        # nginx: no juntar el stream en buffer
+        "Content-Encoding":  "identity",  # GZipMiddleware lo deja pasar sin comprimir
+    })
+
+
 @app.get("/health")
 def health():
     return {"status": "ok", "version": "1.0"}
 
 
+@app.get("/debug/db")
+def debug_db(top: int = 30, reset: bool = False, uid: int = Depends(get_current_user)) -> dict:
+    """Statements más caros, estado del pool, caches, tokens y límites. Solo admin."""
+    if uid != ADMIN_ID:
+        raise HTTPException(status_code=403, detail="No autorizado")
+    out = {
+        "queries": db.query_stats(top),
+        "pool":    db.pool_stats(),
+        "cache":   db.cache_stats(),
+        "write_behind": db.write_behind_stats(),
+        "tokens":  _tokens_verificados.stats(),
+        "limites": limitador.stats(),
+        "eventos": eventos.stats(),
+        "bot":     _bot_procesador.stats() if _bot_procesador else None,
+        "envios":  envios.stats(),
+    }
+    if reset:
+        db.reset_query_stats()
+    return out
+
+
+_HOSTS_LOCALES = {"127.0.0.1", "::1", "localhost"}
+
+
+def _exigir_acceso_metricas(request: Request) -> None:
+    if METRICS_TOKEN:
+        header = request.headers.get("authorization", "")
+        if not hmac.compare_digest(header, f"Bearer {METRICS_TOKEN}"):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="No autorizado")
+        return
+    if METRICS_PUBLICO:
+        return
+    host = request.client.host if request.client else ""
+    if host not in _HOSTS_LOCALES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN,
+                            detail="/metrics solo desde localhost (definí METRICS_TOKEN)")
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics(request: Request) -> Response:
+    """Métricas en formato de texto Prometheus."""
+    _exigir_acceso_metricas(request)
+    lag    = adb.lag_stats()
+    pool   = db.pool_stats()
+    wb     = db.write_behind_stats()
+    gauges = {
+        "gymcoach_event_loop_lag_ms":     ("Último retraso medido del event loop.", lag["ultimo_ms"]),
+        "gymcoach_event_loop_lag_max_ms": ("Mayor retraso del event loop desde el arranque.", lag["max_ms"]),
+        "gymcoach_db_pool_idle":          ("Conexiones SQLite ociosas en el pool.", pool["ociosas"]),
+        "gymcoach_db_write_queue":        ("Escrituras en la cola write-behind.", wb["en_cola"]),
+        "gymcoach_token_cache_hit_ratio": ("Aciertos de la cache de JWT verificados.",
+                                           _tokens_verificados.stats()["hit_rate"]),
+        "gymcoach_sse_connections":       ("Conexiones abiertas a /events.",
+                                           eventos.stats()["conexiones"]),
+    }
+    if _bot_procesador:
+        bot = _bot_procesador.stats()
+        gauges["gymcoach_bot_updates_queued"]   = ("Updates del bot esperando turno (usuario o concurrencia).",
+                                                   bot["en_espera"])
+        gauges["gymcoach_bot_updates_inflight"] = ("Updates del bot procesándose ahora.", bot["en_curso"])
+    env = envios.stats()
+    gauges["gymcoach_outbox_queued"]         = ("Mensajes salientes en la cola de envios.py.", env["en_cola"])
+    gauges["gymcoach_outbox_lag_seconds"]    = ("Espera en cola del último mensaje enviado.", env["lag_ultimo_s"])
+    gauges["gymcoach_outbox_paused_seconds"] = ("Pausa restante por RetryAfter de Telegram.", env["pausa_s"])
+    texto = metricas.exponer(gauges)
+    return PlainTextResponse(texto, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ── TELEGRAM WEBHOOK ──────────────────────────────────────────────────────────
+
+def _secret_webhook(token: str) -> str:
+    """TELEGRAM_WEBHOOK_SECRET, o uno derivado del token (igual en todos los workers)."""
+    if TELEGRAM_WEBHOOK_SECRET:
+        return TELEGRAM_WEBHOOK_SECRET
+    return hashlib.sha256(f"webhook:{token}".encode()).hexdigest()[:48]
+
+
+@app.post("/telegram/webhook/{secret}", include_in_schema=False)
+async def telegram_webhook(secret: str, request: Request) -> Response:
+    """
+    Telegram postea cada update acá. Se verifica el secret del path y el
+    header X-Telegram-Bot-Api-Secret-Token (set_webhook manda el mismo), y
+    el update entra a la update_queue del Application: se responde 200 sin
+    esperar al handler, así Telegram no reintenta por timeout.
+    """
+    if not _webhook_secret or not hmac.compare_digest(secret, _webhook_secret):
+        raise HTTPException(status_code=404, detail="Not Found")
+    header = request.headers.get("x-telegram-bot-api-secret-token", "")
+    if not hmac.compare_digest(header, _webhook_secret):
+        raise HTTPException(status_code=403, detail="No autorizado")
+    if _bot_app is None or not _bot_app.running:
+        raise HTTPException(status_code=503, detail="Bot iniciando")
+
+    from telegram import Update
+    try:
+        update = Update.de_json(await request.json(), _bot_app.bot)
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Update inválido")
+    if update is None:
+        raise HTTPException(status_code=400, detail="Update inválido")
+    await _bot_app.update_queue.put(update)
+    return Response(status_code=200)
+
+
 # ── STARTUP ───────────────────────────────────────────────────────────────────
 
 @app.on_event("startup")  # noqa
 async def startup():
     db.init_db()
-    for sql in [
-        "ALTER TABLE usuarios ADD COLUMN pin TEXT",
-        "ALTER TABLE usuarios ADD COLUMN hora_recordatorio TEXT",
-        """CREATE TABLE IF NOT EXISTS login_tokens (
-            token TEXT PRIMARY KEY, user_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, used INTEGER DEFAULT 0)""",
-        """CREATE TABLE IF NOT EXISTS pesajes (
-            Fecha TEXT PRIMARY KEY, Timestamp INTEGER UNIQUE,
-            Peso_kg REAL, Grasa_Porcentaje REAL, Agua REAL,
-            Musculo_Pct REAL, Musculo_kg REAL, BMR INTEGER, VisFat REAL,
-            BMI REAL, EdadMetabolica INTEGER, FatFreeWeight REAL,
-            Proteina REAL, MasaOsea REAL)""",
-        """CREATE TABLE IF NOT EXISTS historico_dietas (
-            fecha TEXT PRIMARY KEY, score_comp INTEGER, estado_mimo TEXT,
-            kcal_mult REAL, calorias INTEGER, proteina INTEGER,
-            carbs INTEGER, grasas INTEGER, dieta_html TEXT, delta_peso REAL)""",
-        "CREATE TABLE IF NOT EXISTS config_nutricion (clave TEXT PRIMARY KEY, valor TEXT)",
-        "INSERT OR IGNORE INTO config_nutricion (clave, valor) VALUES ('kcal_mult','1.0')",
-        "CREATE TABLE IF NOT EXISTS analisis_historial (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, fecha TEXT NOT NULL, texto TEXT NOT NULL, tipo TEXT DEFAULT 'nocturno')",
-        """CREATE TABLE IF NOT EXISTS sesion_activa (
-            user_id INTEGER PRIMARY KEY, semana INTEGER, dia TEXT,
-            ej_idx INTEGER DEFAULT 0, fase TEXT DEFAULT 'ejercicio',
-            updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
-        """CREATE TABLE IF NOT EXISTS peso_flow (
-            user_id INTEGER PRIMARY KEY, semana INTEGER, dia TEXT,
-            ejercicios TEXT, idx INTEGER DEFAULT 0,
-            updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""",
-    ]:
-        try:
-            db.execute(sql)
-        except Exception:
-            pass
+    asyncio.create_task(adb.vigilar_lag())
     logger.info("GymCoach API lista")
 
     # Arrancar el bot de Telegram como tarea asyncio en el mismo event loop
     token = os.environ.get("TELEGRAM_TOKEN")
     if token:
-        import asyncio
         asyncio.create_task(_run_bot(token))
         logger.info("Bot de Telegram arrancado como tarea asyncio")
     else:
         logger.warning("TELEGRAM_TOKEN no encontrado — bot no arrancado")
 
 
+@app.on_event("shutdown")  # noqa
+async def shutdown():
+    adb.shutdown()
+    db.flush_escrituras()
+    db.close_pool()
+
+
+def _tomar_jobs() -> bool:
+    """True si este worker es el que corre los jobs únicos (ver BOT_JOBS)."""
+    global _jobs_lock_fd
+    if BOT_JOBS != "auto":
+        return BOT_JOBS == "1"
+    if _jobs_lock_fd is not None:
+        return True
+    import fcntl
+    fd = os.open(f"{db.DB_PATH}.jobs.lock", os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    _jobs_lock_fd = fd   # se libera solo cuando muere el proceso
+    return True
+
+
 async def _run_bot(token: str) -> None:
     """Corre el bot de Telegram en el mismo event loop que FastAPI."""
+    global _bot_app, _bot_procesador, _webhook_secret
     import handlers as h
+    import procesador
+    from telegram import Update
     from telegram.ext import Application
 
-    bot_app = Application.builder().token(token).build()
+    _bot_procesador = procesador.ProcesadorPorUsuario()
+    builder = Application.builder().token(token).concurrent_updates(_bot_procesador)
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    if TELEGRAM_WEBHOOK_URL:
+        builder = builder.updater(None)   # los updates llegan por /telegram/webhook
+    bot_app = _bot_app = builder.build()
     h.register(bot_app)
 
     import notificaciones as notif
@@ -839,8 +1319,8 @@ async def _run_bot(token: str) -> None:
             try:
                 # Obtener datos gym para análisis cruzado
                 from gamification import get_racha
-                uid_principal = int(os.environ.get("ADMIN_TELEGRAM_ID", "1557254587"))
-                racha = get_racha(uid_principal)
+                uid_principal = ADMIN_ID
+                racha = await adb.run(get_racha, uid_principal)
                 datos_gym = {"racha": racha}
                 await corp.ejecutar_diario(
                     bot=bot_app.bot,
@@ -854,7 +1334,7 @@ async def _run_bot(token: str) -> None:
         import pytz as _tz
         if datetime.now(_tz.timezone("America/Phoenix")).weekday() == 6:
             try:
-                uid_principal = int(os.environ.get("ADMIN_TELEGRAM_ID", "1557254587"))
+                uid_principal = ADMIN_ID
                 await nut.ejecutar_dominical(
                     bot=bot_app.bot,
                     chat_id=uid_principal,
@@ -862,17 +1342,52 @@ async def _run_bot(token: str) -> None:
             except Exception as e:
                 logger.warning("Job dominical: %s", e)
 
+    async def recargar_allowed(ctx) -> None:
+        await adb.recargar_allowed_users()
+
+    async def compactar(ctx) -> None:
+        try:
+            await adb.compactar_historial()
+        except Exception as e:
+            logger.warning("Compactar historial: %s", e)
+
     jq = bot_app.job_queue
     if jq:
-        jq.run_repeating(recordatorios, interval=60, first=10)
-
-    # Usar initialize/start/run en lugar de run_polling()
-    # run_polling() intenta manejar signals — no funciona fuera del main thread
+        import pytz
+        from datetime import time as dtime
+
+        def programar_jobs() -> None:
+            jq.run_repeating(recordatorios, interval=60, first=10)
+            jq.run_daily(compactar, time=dtime(3, 30, tzinfo=pytz.timezone("America/Phoenix")))
+            logger.info("Jobs de recordatorios/compactar en este worker (pid %d)", os.getpid())
+
+        async def reintentar_jobs(ctx) -> None:
+            if _tomar_jobs():
+                ctx.job.schedule_removal()
+                programar_jobs()
+
+        # La allow-list es una copia en memoria por worker: se recarga en todos
+        jq.run_repeating(recargar_allowed, interval=ALLOWED_RELOAD_SEG, first=ALLOWED_RELOAD_SEG)
+        if _tomar_jobs():
+            programar_jobs()
+        elif BOT_JOBS == "auto":
+            jq.run_repeating(reintentar_jobs, interval=60, first=60)
+
+    # Usar initialize/start/run en lugar de run_polling()/run_webhook()
+    # ambos intentan manejar signals — no funcionan fuera del main thread
     await bot_app.initialize()
     await bot_app.start()
-    await bot_app.updater.start_polling(drop_pending_updates=True)
-    logger.info("Bot polling activo")
+    if TELEGRAM_WEBHOOK_URL:
+        _webhook_secret = _secret_webhook(token)
+        await bot_app.bot.set_webhook(
+            url             = f"{TELEGRAM_WEBHOOK_URL}/telegram/webhook/{_webhook_secret}",
+            secret_token    = _webhook_secret,
+            allowed_updates = Update.ALL_TYPES,
+        )
+        logger.info("Bot webhook activo en %s/telegram/webhook/…", TELEGRAM_WEBHOOK_URL)
+    else:
+        await bot_app.updater.start_polling(drop_pending_updates=True)
+        logger.info("Bot polling activo")
     # Mantener corriendo indefinidamente
-    import asyncio
     while True:
         await asyncio.sleep(3600)
@@ -0,0 +1,104 @@
+"""
+cache.py — Cache LRU en memoria con TTL, segura entre threads.
+
+La API y el bot corren en el mismo proceso y leen la DB desde varios
+threads (executor de adb, threadpool de FastAPI), así que todas las
+operaciones toman un lock.
+
+    _perfiles = CacheLRU(maxsize=512, ttl=300)
+    gen = _perfiles.generacion()
+    valor = _perfiles.get(uid)
+    if valor is None:
+        valor = leer_de_db(uid)
+        _perfiles.set(uid, valor, generacion=gen)
+
+set() con generacion= descarta el valor si hubo una invalidación mientras
+se leía la DB: evita que un lector lento vuelva a meter un dato viejo
+justo después de que un writer lo invalidó.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    def __init__(self, maxsize: int = 512, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self._datos: OrderedDict = OrderedDict()   # key -> (expira, valor)
+        self._lock   = threading.Lock()
+        self._gen    = 0
+        self.hits    = 0
+        self.misses  = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._datos.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expira, valor = item
+            if expira < time.monotonic():
+                del self._datos[key]
+                self.misses += 1
+                return default
+            self._datos.move_to_end(key)
+            self.hits += 1
+            return valor
+
+    def set(self, key, valor, ttl: float | None = None, generacion: int | None = None) -> None:
+        with self._lock:
+            if generacion is not None and generacion != self._gen:
+                return
+            self._guardar(key, valor, ttl)
+
+    def _guardar(self, key, valor, ttl: float | None) -> None:
+        # Con el lock tomado
+        expira = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._datos[key] = (expira, valor)
+        self._datos.move_to_end(key)
+        while len(self._datos) > self.maxsize:
+            self._datos.popitem(last=False)
+
+    def generacion(self) -> int:
+        with self._lock:
+            return self._gen
+
+    def invalidar(self, key) -> None:
+        with self._lock:
+            self._gen += 1
+            self._datos.pop(key, None)
+
+    def actualizar(self, key, valor, ttl: float | None = None, generacion: int | None = None) -> None:
+        """
+        Write-through: invalida lecturas en vuelo y guarda el valor nuevo.
+        Con generacion= (parche sobre un valor leído de la cache) y una
+        invalidación de por medio, descarta la entrada en vez de guardarla.
+        """
+        with self._lock:
+            self._gen += 1
+            if generacion is not None and generacion != self._gen - 1:
+                self._datos.pop(key, None)
+                return
+            # En el mismo lock: un writer posterior no puede quedar pisado
+            self._guardar(key, valor, ttl)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._gen += 1
+            self._datos.clear()
+
+    def __len__(self) -> int:
+        return len(self._datos)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entradas": len(self._datos),
+                "hits":     self.hits,
+                "misses":   self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
@@ -2,27 +2,201 @@
 database.py — DB unificada Coach.
 Tablas gym:    usuarios, rutinas, pesos, sesion_activa, peso_flow,
                gamificacion, badges, progreso, swaps, estado,
-               allowed_users, login_tokens, analisis_historial
+               allowed_users, login_tokens, analisis_historial,
+               pesos_historial, progreso_historial (vista pesos_todos),
+               mesociclos
 Tablas cuerpo: pesajes, historico_dietas, config_nutricion
 """
 from __future__ import annotations
+import atexit
+import functools
 import logging
 import os
+import re
 import sqlite3
+import threading
+import time
+from collections import deque
 from contextlib import contextmanager
 
+import eventos
+import metricas
+from cache import CacheLRU
+
 logger  = logging.getLogger(__name__)
 DB_PATH = os.environ.get("DB_PATH", "coach.db")
-
-@contextmanager
-def get_db():
-    _dir = os.path.dirname(DB_PATH)
-    if _dir:
-        os.makedirs(_dir, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH, timeout=10)
+# Conexiones ociosas que se conservan abiertas para reutilizar
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "8"))
+
+# ── MEDICIÓN DE QUERIES ───────────────────────────────────────────────────────
+# Registro por statement normalizado (literales → ?, listas IN → (...)):
+# cantidad, tiempo total, p50/p95 sobre las últimas muestras y filas
+# devueltas/afectadas. Lo llenan execute/fetchone/fetchall, cualquier
+# conn.execute/executemany dentro de get_db() y los COMMIT. Se ve en
+# /debug/db, y el tiempo acumulado en /metrics. DB_SLOW_MS > 0 además
+# loguea cada query que lo supere.
+
+DB_STATS   = os.environ.get("DB_STATS", "1") != "0"
+DB_SLOW_MS = float(os.environ.get("DB_SLOW_MS", "0"))
+_MUESTRAS  = 256
+
+_STATS: dict[str, dict] = {}
+_stats_lock = threading.Lock()
+
+_RE_STR = re.compile(r"'(?:[^']|'')*'")
+_RE_NUM = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_IN  = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_RE_WS  = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=1024)
+def _normalizar(sql: str) -> str:
+    sql = _RE_NUM.sub("?", _RE_STR.sub("?", sql))
+    return _RE_WS.sub(" ", _RE_IN.sub("(...)", sql)).strip()
+
+
+def _registrar(sql: str, ms: float, filas: int) -> None:
+    clave = _normalizar(sql)
+    with _stats_lock:
+        st = _STATS.get(clave)
+        if st is None:
+            st = _STATS[clave] = {"n": 0, "total_ms": 0.0, "max_ms": 0.0, "filas": 0,
+                                  "muestras": deque(maxlen=_MUESTRAS)}
+        st["n"]        += 1
+        st["total_ms"] += ms
+        st["max_ms"]    = max(st["max_ms"], ms)
+        st["filas"]    += filas
+        st["muestras"].append(ms)
+    metricas.sumar_db(ms)
+    if DB_SLOW_MS and ms >= DB_SLOW_MS:
+        logger.warning("Query lenta %.1f ms (%d filas): %s", ms, filas, clave[:300])
+
+
+class _ConexionMedida(sqlite3.Connection):
+    def execute(self, sql, params=()):
+        t0  = time.perf_counter()
+        cur = super().execute(sql, params)
+        _registrar(sql, (time.perf_counter() - t0) * 1000, max(cur.rowcount, 0))
+        return cur
+
+    def executemany(self, sql, seq):
+        t0  = time.perf_counter()
+        cur = super().executemany(sql, seq)
+        _registrar(sql, (time.perf_counter() - t0) * 1000, max(cur.rowcount, 0))
+        return cur
+
+    def commit(self):
+        if not self.in_transaction:
+            return super().commit()
+        t0 = time.perf_counter()
+        super().commit()
+        _registrar("COMMIT", (time.perf_counter() - t0) * 1000, 0)
+
+
+def _percentil(ordenadas, q):
+    return ordenadas[min(len(ordenadas) - 1, int(q * len(ordenadas)))]
+
+
+def query_stats(top: int | None = None) -> list[dict]:
+    """Statements ordenados por tiempo total, el más caro primero."""
+    with _stats_lock:
+        items = [(sql, dict(st, muestras=sorted(st["muestras"]))) for sql, st in _STATS.items()]
+    out = []
+    for sql, st in items:
+        m = st["muestras"]
+        out.append({
+            "sql":         sql,
+            "n":           st["n"],
+            "total_ms":    round(st["total_ms"], 2),
+            "promedio_ms": round(st["total_ms"] / st["n"], 3),
+            "p50_ms":      round(_percentil(m, 0.50), 3),
+            "p95_ms":      round(_percentil(m, 0.95), 3),
+            "max_ms":      round(st["max_ms"], 3),
+            "filas":       st["filas"],
+        })
+    out.sort(key=lambda r: r["total_ms"], reverse=True)
+    return out[:top] if top else out
+
+
+def reset_query_stats() -> None:
+    with _stats_lock:
+        _STATS.clear()
+
+# ── POOL DE CONEXIONES ────────────────────────────────────────────────────────
+# Abrir una conexión por query (makedirs + connect + 2 PRAGMAs) domina el costo
+# de las lecturas cortas. El pool entrega conexiones ya configuradas a
+# cualquier thread (threadpool de FastAPI, event loop del bot, executors):
+# cada conexión la usa un solo dueño a la vez, así que check_same_thread=False
+# es seguro. Si el pool está vacío se abre una nueva en vez de bloquear —
+# get_db() anidados nunca se quedan esperando.
+
+_pool: list[sqlite3.Connection] = []
+_pool_lock  = threading.Lock()
+_pool_path  = None
+_POOL_STATS = {"entregadas": 0, "reutilizadas": 0, "creadas": 0, "cerradas": 0}
+
+
+def _nueva_conexion() -> sqlite3.Connection:
+    global _pool_path
+    if _pool_path != DB_PATH:
+        _dir = os.path.dirname(DB_PATH)
+        if _dir:
+            os.makedirs(_dir, exist_ok=True)
+        _pool_path = DB_PATH
+    conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False,
+                           factory=_ConexionMedida if DB_STATS else sqlite3.Connection)
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL")
     conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+
+def _checkout() -> sqlite3.Connection:
+    with _pool_lock:
+        _POOL_STATS["entregadas"] += 1
+        # DB_PATH puede cambiar en caliente (tests, scripts) — descartar el pool viejo
+        if _pool_path != DB_PATH:
+            _cerrar_ociosas()
+        if _pool:
+            _POOL_STATS["reutilizadas"] += 1
+            return _pool.pop()
+        _POOL_STATS["creadas"] += 1
+    return _nueva_conexion()
+
+
+def _checkin(conn: sqlite3.Connection) -> None:
+    with _pool_lock:
+        if _pool_path == DB_PATH and len(_pool) < DB_POOL_SIZE and not conn.in_transaction:
+            _pool.append(conn)
+            return
+        _POOL_STATS["cerradas"] += 1
+    conn.close()
+
+
+def _cerrar_ociosas() -> None:
+    while _pool:
+        _pool.pop().close()
+        _POOL_STATS["cerradas"] += 1
+
+
+def close_pool() -> None:
+    """Cierra las conexiones ociosas. Llamar al apagar el proceso."""
+    with _pool_lock:
+        _cerrar_ociosas()
+
+
+def pool_stats() -> dict:
+    with _pool_lock:
+        return {**_POOL_STATS, "ociosas": len(_pool), "max_ociosas": DB_POOL_SIZE}
+
+
+@contextmanager
+def _conexion():
+    conn = getattr(_tx, "conn", None)
+    if conn is not None:
+        yield conn   # dentro de transaccion(): el commit/rollback lo hace ella
+        return
+    conn = _checkout()
     try:
         yield conn
         conn.commit()
@@ -30,182 +204,632 @@ def get_db():
         conn.rollback()
         raise
     finally:
-        conn.close()
+        _checkin(conn)
+
+@contextmanager
+def get_db(user_id=None):
+    """
+    Conexión para SQL crudo (science.py y los helpers de este módulo).
+    Con user_id espera antes las escrituras encoladas de ese usuario
+    (write-behind), así el SQL crudo lee lo último que guardó.
+    """
+    if user_id is not None:
+        esperar_escrituras(user_id)
+    with _conexion() as conn:
+        yield conn
 
 def execute(sql, params=()):
-    with get_db() as conn:
+    if _wb_pendientes and _toca_cola(sql):
+        esperar_escrituras()
+    with _conexion() as conn:
         conn.execute(sql, params)
 
+def _consultar(sql, params, uno):
+    if _wb_pendientes and _toca_cola(sql):
+        esperar_escrituras()
+    with _conexion() as conn:
+        if not DB_STATS:
+            cur = conn.execute(sql, params)
+            return cur.fetchone() if uno else cur.fetchall()
+        # Medir execute + fetch juntos: en SELECTs simples el costo está en el fetch
+        t0  = time.perf_counter()
+        cur = sqlite3.Connection.execute(conn, sql, params)
+        res = cur.fetchone() if uno else cur.fetchall()
+        _registrar(sql, (time.perf_counter() - t0) * 1000,
+                   int(res is not None) if uno else len(res))
+        return res
+
 def fetchone(sql, params=()):
-    with get_db() as conn:
-        return conn.execute(sql, params).fetchone()
+    return _consultar(sql, params, uno=True)
 
 def fetchall(sql, params=()):
-    with get_db() as conn:
-        return conn.execute(sql, params).fetchall()
+    return _consultar(sql, params, uno=False)
 
-def init_db():
-    with get_db() as conn:
-        conn.executescript("""
-        CREATE TABLE IF NOT EXISTS allowed_users (
-            user_id INTEGER PRIMARY KEY, activo INTEGER DEFAULT 1);
-
-        CREATE TABLE IF NOT EXISTS usuarios (
-            user_id INTEGER PRIMARY KEY, nombre TEXT, genero TEXT,
-            nivel TEXT, objetivo TEXT, limitaciones TEXT DEFAULT 'ninguna',
-            dias INTEGER DEFAULT 4, duracion_min INTEGER DEFAULT 60,
-            ambiente_preferido TEXT DEFAULT 'gym', hora_recordatorio TEXT,
-            anos_entrenando INTEGER DEFAULT 0, pin TEXT,
-            tipo_dieta TEXT DEFAULT 'omnivoro', alergias TEXT DEFAULT 'ninguna',
-            objetivo_vida TEXT,
-            edad INTEGER,
-            sexo TEXT DEFAULT 'hombre',
-            peso_kg_estimado REAL,
-            bmr_estimado INTEGER,
-            tdee_estimado INTEGER,
-            actividad_nivel TEXT DEFAULT 'sedentario',
-            sueño_horas REAL DEFAULT 7.0,
-            cocina_preferida TEXT DEFAULT 'variada');
-
-        CREATE TABLE IF NOT EXISTS estado (
-            user_id INTEGER PRIMARY KEY, semana INTEGER DEFAULT 1,
-            dia TEXT DEFAULT 'lunes', objetivo TEXT);
-
-        CREATE TABLE IF NOT EXISTS rutinas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
-            semana INTEGER, dia TEXT, orden INTEGER DEFAULT 0,
-            ejercicio_id TEXT, ejercicio TEXT, patron TEXT, grupo TEXT,
-            rol TEXT, series INTEGER, reps TEXT, notas TEXT,
-            emg_score INTEGER DEFAULT 1, completado INTEGER DEFAULT 0);
-
-        CREATE TABLE IF NOT EXISTS pesos (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
-            ejercicio_id TEXT, semana INTEGER, dia TEXT, peso_lbs REAL,
+# ── TRANSACCIONES ─────────────────────────────────────────────────────────────
+# transaccion() agrupa varias funciones de este módulo (y de science,
+# gamification, etc., que usan get_db/execute/fetch*) en un solo BEGIN ...
+# COMMIT: mientras dura el bloque, todo get_db() del mismo thread reutiliza
+# la misma conexión. Si algo falla se deshace todo.
+
+_tx = threading.local()
+
+
+@contextmanager
+def transaccion():
+    if getattr(_tx, "conn", None) is not None:
+        yield _tx.conn   # anidada: se une a la de afuera
+        return
+    esperar_escrituras()
+    conn = _checkout()
+    _tx.conn    = conn
+    _tx.eventos = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        # upsert_*, save_peso y save_sesion_activa pudieron cachear lo que se deshizo
+        _cache_perfil.limpiar()
+        _cache_estado.limpiar()
+        _cache_dia.limpiar()
+        _cache_sesion.limpiar()
+        _tx.eventos = []
+        raise
+    finally:
+        _tx.conn = None
+        _checkin(conn)
+        pendientes, _tx.eventos = _tx.eventos, []
+        for evento in pendientes:
+            eventos.publicar(*evento)
+
+
+def en_transaccion() -> bool:
+    return getattr(_tx, "conn", None) is not None
+
+
+def _publicar(user_id, tipo, **datos) -> None:
+    """Avisa a /events; dentro de transaccion() espera al COMMIT (y un rollback lo descarta)."""
+    if en_transaccion():
+        _tx.eventos.append((user_id, tipo, datos))
+    else:
+        eventos.publicar(user_id, tipo, datos)
+
+# ── WRITE-BEHIND ──────────────────────────────────────────────────────────────
+# Opt-in (DB_WRITE_BEHIND=1). Durante un entreno save_sesion_activa,
+# save_peso_flow y save_peso escriben en cada tap/mensaje, cada uno con su
+# commit + fsync. Con write-behind se encolan y un thread los escribe en
+# lotes: lo que llega dentro de DB_WRITE_BEHIND_MS va en una transacción.
+#
+# Consistencia: cualquier execute/fetch* que toque esas tablas espera a que
+# la cola se vacíe antes de correr (si hay alguien esperando, el lote se
+# escribe sin esperar la ventana), así que se leen las propias escrituras.
+# get_db(user_id) espera solo las de ese usuario; SQL crudo que toque esas
+# tablas para todos llama a esperar_escrituras() antes (compactar_historial).
+# flush_escrituras() al apagar y en atexit.
+#
+# Una escritura que falla no se pierde en silencio: si el error es
+# transitorio (OperationalError: locked, busy, I/O) vuelve al frente de la
+# cola y se reintenta con backoff, y el usuario sigue "pendiente" para los
+# lectores. Si no se puede (otro error, o DB_WRITE_BEHIND_REINTENTOS
+# agotados) queda en write_behind_stats()["fallidas"] con sus parámetros y
+# se publica "error_guardado" al usuario para que la web vuelva a leer.
+
+DB_WRITE_BEHIND    = os.environ.get("DB_WRITE_BEHIND", "0") == "1"
+DB_WRITE_BEHIND_MS = float(os.environ.get("DB_WRITE_BEHIND_MS", "5"))
+DB_WRITE_BEHIND_REINTENTOS = int(os.environ.get("DB_WRITE_BEHIND_REINTENTOS", "5"))
+_WB_MAX_LOTE       = 500
+
+_wb_cond = threading.Condition()
+_wb_cola: list[tuple] = []              # (user_id, sql, params, intentos)
+_wb_pendientes: dict[int, int] = {}     # user_id -> escrituras sin commitear
+_wb_urgente = 0
+_wb_hilo: threading.Thread | None = None
+_wb_fallidas: deque = deque(maxlen=100)   # las que no se pudieron escribir
+_WB_STATS = {"encoladas": 0, "lotes": 0, "escritas": 0, "errores": 0, "reintentos": 0}
+
+_RE_TABLAS_COLA = re.compile(r"\b(pesos|pesos_todos|sesion_activa|peso_flow|datos_version)\b")
+
+
+@functools.lru_cache(maxsize=1024)
+def _toca_cola(sql: str) -> bool:
+    return bool(_RE_TABLAS_COLA.search(sql))
+
+
+def _encolar(user_id, sql, params) -> None:
+    global _wb_hilo
+    with _wb_cond:
+        if _wb_hilo is None:
+            _wb_hilo = threading.Thread(target=_wb_loop, name="db-write-behind", daemon=True)
+            _wb_hilo.start()
+            atexit.register(flush_escrituras)
+        _wb_cola.append((user_id, sql, params, 0))
+        _wb_pendientes[user_id] = _wb_pendientes.get(user_id, 0) + 1
+        _WB_STATS["encoladas"] += 1
+        _wb_cond.notify_all()
+
+
+def _escribir_lote(lote) -> list[tuple]:
+    """Escribe el lote; devuelve las escrituras a reintentar."""
+    try:
+        with _conexion() as conn:
+            for _, sql, params, _ in lote:
+                conn.execute(sql, params)
+        _WB_STATS["escritas"] += len(lote)
+        return []
+    except Exception:
+        logger.exception("Write-behind: falló un lote de %d, reintentando uno por uno", len(lote))
+    reintentar = []
+    for item in lote:
+        user_id, sql, params, intentos = item
+        try:
+            with _conexion() as conn:
+                conn.execute(sql, params)
+            _WB_STATS["escritas"] += 1
+        except sqlite3.OperationalError as e:
+            if intentos + 1 < DB_WRITE_BEHIND_REINTENTOS:
+                logger.warning("Write-behind: %s, reintento %d: %s", e, intentos + 1, sql[:80])
+                reintentar.append((user_id, sql, params, intentos + 1))
+            else:
+                _descartar(item, e)
+        except Exception as e:
+            _descartar(item, e)
+    return reintentar
+
+
+def _descartar(item, error) -> None:
+    user_id, sql, params, intentos = item
+    _WB_STATS["errores"] += 1
+    _wb_fallidas.append({"user_id": user_id, "sql": sql, "params": params,
+                         "intentos": intentos + 1, "error": str(error),
+                         "fecha": time.strftime("%Y-%m-%d %H:%M:%S")})
+    # save_peso/save_sesion_activa ya dejaron el valor en la cache
+    _cache_dia.invalidar(user_id)
+    _cache_sesion.invalidar(user_id)
+    logger.error("Write-behind: escritura NO guardada tras %d intentos (%s): %s %s",
+                 intentos + 1, error, sql[:80], params)
+    tabla = _RE_TABLAS_COLA.search(sql)
+    eventos.publicar(user_id, "error_guardado", {"tabla": tabla.group(1) if tabla else ""})
+
+
+def _wb_loop() -> None:
+    espera = 0.0   # backoff mientras haya reintentos
+    while True:
+        with _wb_cond:
+            while not _wb_cola:
+                _wb_cond.wait()
+            if espera:
+                _wb_cond.wait(espera)
+            limite = time.monotonic() + DB_WRITE_BEHIND_MS / 1000
+            while len(_wb_cola) < _WB_MAX_LOTE and not _wb_urgente:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                _wb_cond.wait(restante)
+            lote = _wb_cola[:_WB_MAX_LOTE]
+            del _wb_cola[:len(lote)]
+        reintentar = []
+        try:
+            reintentar = _escribir_lote(lote)
+        finally:
+            with _wb_cond:
+                _WB_STATS["lotes"] += 1
+                # Al frente, en orden: una escritura vieja no pisa a una nueva.
+                # Sus usuarios siguen pendientes para esperar_escrituras().
+                _wb_cola[:0] = reintentar
+                _WB_STATS["reintentos"] += len(reintentar)
+                for uid, _, _, _ in lote:
+                    _wb_pendientes[uid] -= 1
+                for uid, _, _, _ in reintentar:
+                    _wb_pendientes[uid] += 1
+                for uid in {item[0] for item in lote}:
+                    if not _wb_pendientes[uid]:
+                        del _wb_pendientes[uid]
+                _wb_cond.notify_all()
+        espera = min(0.1 * 2 ** max(i for *_, i in reintentar), 5.0) if reintentar else 0.0
+
+
+def esperar_escrituras(user_id=None, timeout: float | None = None) -> bool:
+    """Bloquea hasta que no haya escrituras encoladas (de user_id, o de nadie)."""
+    global _wb_urgente
+    # El thread escritor y una transaccion() abierta (tiene el lock de
+    # escritura) no pueden esperar a la cola: sería un deadlock.
+    if not _wb_pendientes or threading.current_thread() is _wb_hilo or en_transaccion():
+        return True
+    pendiente = (lambda: user_id in _wb_pendientes) if user_id is not None else (lambda: bool(_wb_pendientes))
+    with _wb_cond:
+        _wb_urgente += 1
+        _wb_cond.notify_all()
+        try:
+            return _wb_cond.wait_for(lambda: not pendiente(), timeout)
+        finally:
+            _wb_urgente -= 1
+
+
+def flush_escrituras(timeout: float | None = 10.0) -> bool:
+    ok = esperar_escrituras(timeout=timeout)
+    if not ok:
+        logger.error("Write-behind: quedaron %d escrituras sin guardar", sum(_wb_pendientes.values()))
+    return ok
+
+
+def write_behind_stats() -> dict:
+    with _wb_cond:
+        return {**_WB_STATS, "activo": DB_WRITE_BEHIND, "en_cola": len(_wb_cola),
+                "fallidas": list(_wb_fallidas)}
+
+
+def _escribir(user_id, sql, params) -> None:
+    if DB_WRITE_BEHIND and not en_transaccion():
+        _encolar(user_id, sql, params)
+    else:
+        execute(sql, params)
+
+# ── ESQUEMA Y MIGRACIONES ─────────────────────────────────────────────────────
+# Cada migración corre una sola vez y queda registrada en schema_version.
+# Deben ser idempotentes (IF NOT EXISTS, _add_column): el DDL de SQLite hace
+# autocommit, así que un arranque interrumpido puede repetir el último paso.
+
+_ESQUEMA_BASE = """
+    CREATE TABLE IF NOT EXISTS allowed_users (
+        user_id INTEGER PRIMARY KEY, activo INTEGER DEFAULT 1);
+
+    CREATE TABLE IF NOT EXISTS usuarios (
+        user_id INTEGER PRIMARY KEY, nombre TEXT, genero TEXT,
+        nivel TEXT, objetivo TEXT, limitaciones TEXT DEFAULT 'ninguna',
+        dias INTEGER DEFAULT 4, duracion_min INTEGER DEFAULT 60,
+        ambiente_preferido TEXT DEFAULT 'gym', hora_recordatorio TEXT,
+        anos_entrenando INTEGER DEFAULT 0, pin TEXT,
+        tipo_dieta TEXT DEFAULT 'omnivoro', alergias TEXT DEFAULT 'ninguna',
+        objetivo_vida TEXT,
+        edad INTEGER,
+        sexo TEXT DEFAULT 'hombre',
+        peso_kg_estimado REAL,
+        bmr_estimado INTEGER,
+        tdee_estimado INTEGER,
+        actividad_nivel TEXT DEFAULT 'sedentario',
+        sueño_horas REAL DEFAULT 7.0,
+        cocina_preferida TEXT DEFAULT 'variada');
+
+    CREATE TABLE IF NOT EXISTS estado (
+        user_id INTEGER PRIMARY KEY, semana INTEGER DEFAULT 1,
+        dia TEXT DEFAULT 'lunes', objetivo TEXT);
+
+    CREATE TABLE IF NOT EXISTS rutinas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+        semana INTEGER, dia TEXT, orden INTEGER DEFAULT 0,
+        ejercicio_id TEXT, ejercicio TEXT, patron TEXT, grupo TEXT,
+        rol TEXT, series INTEGER, reps TEXT, notas TEXT,
+        emg_score INTEGER DEFAULT 1, completado INTEGER DEFAULT 0);
+
+    CREATE TABLE IF NOT EXISTS pesos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+        ejercicio_id TEXT, semana INTEGER, dia TEXT, peso_lbs REAL,
+        series_hechas INTEGER, reps_hechas TEXT,
+        fecha TEXT DEFAULT (date('now')));
+
+    CREATE TABLE IF NOT EXISTS progreso (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+        semana INTEGER, dia TEXT, ejercicio_id TEXT, rir INTEGER,
+        progreso_reportado TEXT, fatiga_reportada INTEGER,
+        fecha TEXT DEFAULT (date('now')));
+
+    CREATE TABLE IF NOT EXISTS swaps (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+        original_id TEXT, nuevo_id TEXT, grupo TEXT, rol TEXT,
+        fecha TEXT DEFAULT (date('now')));
+
+    CREATE TABLE IF NOT EXISTS gamificacion (
+        user_id INTEGER PRIMARY KEY, xp_total INTEGER DEFAULT 0,
+        racha_actual INTEGER DEFAULT 0, racha_maxima INTEGER DEFAULT 0,
+        ultimo_entreno TEXT, nivel TEXT DEFAULT 'Principiante');
+
+    CREATE TABLE IF NOT EXISTS badges (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+        badge TEXT, fecha TEXT DEFAULT (date('now')));
+
+    CREATE TABLE IF NOT EXISTS sesion_activa (
+        user_id INTEGER PRIMARY KEY, semana INTEGER, dia TEXT,
+        ej_idx INTEGER DEFAULT 0, fase TEXT DEFAULT 'ejercicio',
+        updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+
+    CREATE TABLE IF NOT EXISTS peso_flow (
+        user_id INTEGER PRIMARY KEY, semana INTEGER, dia TEXT,
+        ejercicios TEXT, idx INTEGER DEFAULT 0,
+        updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+
+    CREATE TABLE IF NOT EXISTS milestones (
+        user_id INTEGER PRIMARY KEY, semana_max INTEGER DEFAULT 0);
+
+    CREATE TABLE IF NOT EXISTS prioridad_bloques (
+        user_id INTEGER, grupo TEXT, semana INTEGER,
+        prioridad INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, grupo, semana));
+
+    CREATE TABLE IF NOT EXISTS sesion_ambiente (
+        user_id INTEGER PRIMARY KEY, ambiente TEXT DEFAULT 'gym');
+
+    CREATE TABLE IF NOT EXISTS login_tokens (
+        token TEXT PRIMARY KEY, user_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        used INTEGER DEFAULT 0);
+
+    CREATE TABLE IF NOT EXISTS analisis_historial (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
+        fecha TEXT NOT NULL, texto TEXT NOT NULL,
+        tipo TEXT DEFAULT 'nocturno');
+
+    CREATE TABLE IF NOT EXISTS pesajes (
+        Fecha TEXT PRIMARY KEY, Timestamp INTEGER UNIQUE,
+        Peso_kg REAL, Grasa_Porcentaje REAL, Agua REAL,
+        Musculo_Pct REAL, Musculo_kg REAL, BMR INTEGER, VisFat REAL,
+        BMI REAL, EdadMetabolica INTEGER, FatFreeWeight REAL,
+        Proteina REAL, MasaOsea REAL);
+
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_pesajes_ts ON pesajes(Timestamp);
+    CREATE INDEX IF NOT EXISTS idx_pesajes_fecha ON pesajes(Fecha);
+
+    CREATE TABLE IF NOT EXISTS historico_dietas (
+        fecha TEXT PRIMARY KEY, score_comp INTEGER, estado_mimo TEXT,
+        kcal_mult REAL, calorias INTEGER, proteina INTEGER,
+        carbs INTEGER, grasas INTEGER, dieta_html TEXT, delta_peso REAL);
+
+    CREATE TABLE IF NOT EXISTS config_nutricion (
+        clave TEXT PRIMARY KEY, valor TEXT);
+"""
+
+def _add_column(conn, tabla, columna, definicion):
+    cols = {r["name"] for r in conn.execute(f"PRAGMA table_info({tabla})")}
+    if columna not in cols:
+        conn.execute(f"ALTER TABLE {tabla} ADD COLUMN {columna} {definicion}")
+
+def _m001_esquema_base(conn):
+    conn.executescript(_ESQUEMA_BASE)
+    conn.execute("INSERT OR IGNORE INTO config_nutricion (clave, valor) VALUES ('kcal_mult','1.0')")
+
+def _m002_columnas_agregadas(conn):
+    # DBs creadas antes de que estas columnas existieran en el esquema base
+    for tabla, columna, definicion in [
+        ("usuarios", "pin",                "TEXT"),
+        ("usuarios", "hora_recordatorio",  "TEXT"),
+        ("usuarios", "tipo_dieta",         "TEXT DEFAULT 'omnivoro'"),
+        ("usuarios", "alergias",           "TEXT DEFAULT 'ninguna'"),
+        ("usuarios", "objetivo_vida",      "TEXT"),
+        ("usuarios", "edad",               "INTEGER"),
+        ("usuarios", "sexo",               "TEXT DEFAULT 'hombre'"),
+        ("usuarios", "peso_kg_estimado",   "REAL"),
+        ("usuarios", "bmr_estimado",       "INTEGER"),
+        ("usuarios", "tdee_estimado",      "INTEGER"),
+        ("usuarios", "actividad_nivel",    "TEXT DEFAULT 'sedentario'"),
+        ("usuarios", "sueño_horas",        "REAL DEFAULT 7.0"),
+        ("usuarios", "cocina_preferida",   "TEXT DEFAULT 'variada'"),
+        ("rutinas",  "rol",                "TEXT DEFAULT 'principal'"),
+        ("rutinas",  "emg_score",          "INTEGER DEFAULT 1"),
+        ("rutinas",  "patron",             "TEXT DEFAULT ''"),
+        ("swaps",    "nuevo_id",           "TEXT"),
+        ("swaps",    "original_id",        "TEXT"),
+    ]:
+        _add_column(conn, tabla, columna, definicion)
+
+def _m003_indices_compuestos(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_rutinas_dia ON rutinas(user_id, semana, dia, orden)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pesos_ejercicio ON pesos(user_id, ejercicio_id, semana, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_progreso_dia ON progreso(user_id, semana, dia)")
+
+def _m004_historial_compacto(conn):
+    # Resúmenes de filas viejas que compactar_historial() saca de pesos y
+    # progreso. En pesos_historial, periodo = semana calendario ('%Y-%W'):
+    # la 'semana' del plan se repite en cada mesociclo y no alcanza como
+    # clave. progreso se borra con el plan, así que (semana, dia) sí alcanza.
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS pesos_historial (
+            user_id INTEGER NOT NULL, ejercicio_id TEXT NOT NULL,
+            semana INTEGER, periodo TEXT NOT NULL,
+            peso_max REAL, peso_min REAL,
             series_hechas INTEGER, reps_hechas TEXT,
-            fecha TEXT DEFAULT (date('now')));
-
-        CREATE TABLE IF NOT EXISTS progreso (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
-            semana INTEGER, dia TEXT, ejercicio_id TEXT, rir INTEGER,
-            progreso_reportado TEXT, fatiga_reportada INTEGER,
-            fecha TEXT DEFAULT (date('now')));
-
-        CREATE TABLE IF NOT EXISTS swaps (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
-            original_id TEXT, nuevo_id TEXT, grupo TEXT, rol TEXT,
-            fecha TEXT DEFAULT (date('now')));
-
-        CREATE TABLE IF NOT EXISTS gamificacion (
-            user_id INTEGER PRIMARY KEY, xp_total INTEGER DEFAULT 0,
-            racha_actual INTEGER DEFAULT 0, racha_maxima INTEGER DEFAULT 0,
-            ultimo_entreno TEXT, nivel TEXT DEFAULT 'Principiante');
-
-        CREATE TABLE IF NOT EXISTS badges (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
-            badge TEXT, fecha TEXT DEFAULT (date('now')));
-
-        CREATE TABLE IF NOT EXISTS sesion_activa (
-            user_id INTEGER PRIMARY KEY, semana INTEGER, dia TEXT,
-            ej_idx INTEGER DEFAULT 0, fase TEXT DEFAULT 'ejercicio',
-            updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
-
-        CREATE TABLE IF NOT EXISTS peso_flow (
-            user_id INTEGER PRIMARY KEY, semana INTEGER, dia TEXT,
-            ejercicios TEXT, idx INTEGER DEFAULT 0,
-            updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
-
-        CREATE TABLE IF NOT EXISTS milestones (
-            user_id INTEGER PRIMARY KEY, semana_max INTEGER DEFAULT 0);
-
-        CREATE TABLE IF NOT EXISTS prioridad_bloques (
-            user_id INTEGER, grupo TEXT, semana INTEGER,
-            prioridad INTEGER DEFAULT 0,
-            PRIMARY KEY (user_id, grupo, semana));
-
-        CREATE TABLE IF NOT EXISTS sesion_ambiente (
-            user_id INTEGER PRIMARY KEY, ambiente TEXT DEFAULT 'gym');
-
-        CREATE TABLE IF NOT EXISTS login_tokens (
-            token TEXT PRIMARY KEY, user_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            used INTEGER DEFAULT 0);
-
-        CREATE TABLE IF NOT EXISTS analisis_historial (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL,
-            fecha TEXT NOT NULL, texto TEXT NOT NULL,
-            tipo TEXT DEFAULT 'nocturno');
-
-        CREATE TABLE IF NOT EXISTS pesajes (
-            Fecha TEXT PRIMARY KEY, Timestamp INTEGER UNIQUE,
-            Peso_kg REAL, Grasa_Porcentaje REAL, Agua REAL,
-            Musculo_Pct REAL, Musculo_kg REAL, BMR INTEGER, VisFat REAL,
-            BMI REAL, EdadMetabolica INTEGER, FatFreeWeight REAL,
-            Proteina REAL, MasaOsea REAL);
-
-        CREATE UNIQUE INDEX IF NOT EXISTS idx_pesajes_ts ON pesajes(Timestamp);
-        CREATE INDEX IF NOT EXISTS idx_pesajes_fecha ON pesajes(Fecha);
-
-        CREATE TABLE IF NOT EXISTS historico_dietas (
-            fecha TEXT PRIMARY KEY, score_comp INTEGER, estado_mimo TEXT,
-            kcal_mult REAL, calorias INTEGER, proteina INTEGER,
-            carbs INTEGER, grasas INTEGER, dieta_html TEXT, delta_peso REAL);
-
-        CREATE TABLE IF NOT EXISTS config_nutricion (
-            clave TEXT PRIMARY KEY, valor TEXT);
-        """)
-        conn.execute("INSERT OR IGNORE INTO config_nutricion (clave, valor) VALUES ('kcal_mult','1.0')")
-
-    # Migraciones — corren en cada arranque, fallan silenciosamente si la columna ya existe
-    MIGRACIONES = [
-        "ALTER TABLE usuarios ADD COLUMN pin TEXT",
-        "ALTER TABLE usuarios ADD COLUMN hora_recordatorio TEXT",
-        "ALTER TABLE usuarios ADD COLUMN tipo_dieta TEXT DEFAULT 'omnivoro'",
-        "ALTER TABLE usuarios ADD COLUMN alergias TEXT DEFAULT 'ninguna'",
-        "ALTER TABLE usuarios ADD COLUMN objetivo_vida TEXT",
-        "ALTER TABLE usuarios ADD COLUMN edad INTEGER",
-        "ALTER TABLE usuarios ADD COLUMN sexo TEXT DEFAULT 'hombre'",
-        "ALTER TABLE usuarios ADD COLUMN peso_kg_estimado REAL",
-        "ALTER TABLE usuarios ADD COLUMN bmr_estimado INTEGER",
-        "ALTER TABLE usuarios ADD COLUMN tdee_estimado INTEGER",
-        "ALTER TABLE usuarios ADD COLUMN actividad_nivel TEXT DEFAULT 'sedentario'",
-        "ALTER TABLE usuarios ADD COLUMN sueño_horas REAL DEFAULT 7.0",
-        "ALTER TABLE usuarios ADD COLUMN cocina_preferida TEXT DEFAULT 'variada'",
-        "CREATE TABLE IF NOT EXISTS login_tokens (token TEXT PRIMARY KEY, user_id INTEGER NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, used INTEGER DEFAULT 0)",
-        "CREATE TABLE IF NOT EXISTS analisis_historial (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, fecha TEXT NOT NULL, texto TEXT NOT NULL, tipo TEXT DEFAULT 'nocturno')",
-        "CREATE TABLE IF NOT EXISTS pesajes (Fecha TEXT PRIMARY KEY, Timestamp INTEGER UNIQUE, Peso_kg REAL, Grasa_Porcentaje REAL, Agua REAL, Musculo_Pct REAL, Musculo_kg REAL, BMR INTEGER, VisFat REAL, BMI REAL, EdadMetabolica INTEGER, FatFreeWeight REAL, Proteina REAL, MasaOsea REAL)",
-        "CREATE TABLE IF NOT EXISTS historico_dietas (fecha TEXT PRIMARY KEY, score_comp INTEGER, estado_mimo TEXT, kcal_mult REAL, calorias INTEGER, proteina INTEGER, carbs INTEGER, grasas INTEGER, dieta_html TEXT, delta_peso REAL)",
-        "CREATE TABLE IF NOT EXISTS config_nutricion (clave TEXT PRIMARY KEY, valor TEXT)",
-        "INSERT OR IGNORE INTO config_nutricion (clave, valor) VALUES ('kcal_mult','1.0')",
-        "ALTER TABLE rutinas ADD COLUMN rol TEXT DEFAULT 'principal'",
-        "ALTER TABLE rutinas ADD COLUMN emg_score INTEGER DEFAULT 1",
-        "ALTER TABLE rutinas ADD COLUMN patron TEXT DEFAULT ''",
-        """CREATE TABLE IF NOT EXISTS swaps (
-            id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
-            original_id TEXT, nuevo_id TEXT, grupo TEXT, rol TEXT,
-            fecha TEXT DEFAULT (date('now')))""",
-        "ALTER TABLE swaps ADD COLUMN nuevo_id TEXT",
-        "ALTER TABLE swaps ADD COLUMN original_id TEXT",
-    ]
+            registros INTEGER DEFAULT 0, fecha_max TEXT,
+            PRIMARY KEY (user_id, ejercicio_id, semana, periodo));
+
+        CREATE TABLE IF NOT EXISTS progreso_historial (
+            user_id INTEGER NOT NULL, ejercicio_id TEXT NOT NULL DEFAULT '',
+            semana INTEGER, dia TEXT NOT NULL DEFAULT '',
+            registros INTEGER DEFAULT 0, progresiones INTEGER DEFAULT 0,
+            fatiga_suma INTEGER DEFAULT 0, fatiga_n INTEGER DEFAULT 0,
+            fecha_max TEXT,
+            PRIMARY KEY (user_id, ejercicio_id, semana, dia));
+
+        CREATE VIEW IF NOT EXISTS pesos_todos AS
+            SELECT user_id, ejercicio_id, semana, peso_lbs, peso_lbs AS peso_min,
+                   series_hechas, reps_hechas, fecha
+            FROM pesos
+            UNION ALL
+            SELECT user_id, ejercicio_id, semana, peso_max, peso_min,
+                   series_hechas, reps_hechas, fecha_max
+            FROM pesos_historial;
+    """)
+
+# Tabla → scopes de datos_version que invalida. Las lee version_datos() para
+# armar los ETag de /plan, /progreso, /stats y /cuerpo/historial.
+_TABLAS_VERSIONADAS = {
+    "rutinas":            ("plan", "progreso"),
+    "estado":             ("plan",),
+    "pesos":              ("progreso",),
+    "pesos_historial":    ("progreso",),
+    "progreso":           ("stats",),
+    "progreso_historial": ("stats",),
+    "gamificacion":       ("stats",),
+    "badges":             ("stats",),
+    "pesajes":            ("cuerpo",),   # global: user_id 0
+}
+
+def _m005_versiones_datos(conn):
+    # Un contador por (scope, usuario) que suben triggers en cada escritura,
+    # venga de donde venga (database.py, science.py, SQL suelto en api.py).
+    conn.execute("""CREATE TABLE IF NOT EXISTS datos_version (
+        scope TEXT NOT NULL, user_id INTEGER NOT NULL, version INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (scope, user_id))""")
+    for tabla, scopes in _TABLAS_VERSIONADAS.items():
+        for evento, fila in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            uid = "0" if tabla == "pesajes" else f"{fila}.user_id"
+            upserts = "".join(
+                f"INSERT INTO datos_version (scope, user_id, version) VALUES ('{scope}', {uid}, 1) "
+                f"ON CONFLICT (scope, user_id) DO UPDATE SET version=version+1; "
+                for scope in scopes)
+            conn.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_version_{tabla}_{evento.lower()}
+                AFTER {evento} ON {tabla} BEGIN {upserts}END""")
+
+def _m006_huella_analisis(conn):
+    # huella = hash de los datos que vio el LLM. /analisis reutiliza el texto
+    # del día si los datos no cambiaron, en vez de volver a llamar a Gemini.
+    _add_column(conn, "analisis_historial", "huella", "TEXT")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_analisis_user_tipo_fecha
+        ON analisis_historial (user_id, tipo, fecha)""")
+
+def _m007_indice_analisis_fecha(conn):
+    # /analisis/historial pagina por (fecha, id) sin filtrar tipo
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_analisis_user_fecha
+        ON analisis_historial (user_id, fecha)""")
+
+def _m008_columnas_gamificacion(conn):
+    # gamification.py escribe la racha en ultima_sesion y los badges en
+    # badge_key; el esquema base las creó como ultimo_entreno/badge
+    _add_column(conn, "gamificacion", "ultima_sesion", "TEXT")
+    _add_column(conn, "badges",       "badge_key",     "TEXT")
+    conn.execute("UPDATE gamificacion SET ultima_sesion=ultimo_entreno WHERE ultima_sesion IS NULL")
+    conn.execute("UPDATE badges SET badge_key=badge WHERE badge_key IS NULL")
+
+def _m009_mesociclos(conn):
+    # Un mesociclo dura lo que dura un plan: _clear_plan() cierra el actual
+    # y anota desde qué id de pesos empieza el siguiente. Lo anterior a ese
+    # id es de mesociclos cerrados y compactar_historial() lo puede archivar.
+    # Usuarios que ya tenían plan no tienen fila: no se archiva nada suyo
+    # hasta que generen el próximo.
+    conn.execute("""CREATE TABLE IF NOT EXISTS mesociclos (
+        user_id INTEGER NOT NULL, numero INTEGER NOT NULL,
+        pesos_desde INTEGER NOT NULL, inicio TEXT DEFAULT (datetime('now')),
+        PRIMARY KEY (user_id, numero))""")
+
+def _m010_columnas_prioridad(conn):
+    # science.aplicar_prioridad_muscular guarda un bloque por fila
+    # (bloque, semana_inicio, grupo_prioritario/secundario); el esquema base
+    # tenía (grupo, semana, prioridad). grupo/semana quedan NULL en esas
+    # filas: SQLite admite NULL en una PRIMARY KEY que no es INTEGER.
+    for col, tipo in (("bloque", "INTEGER"), ("semana_inicio", "INTEGER"),
+                      ("grupo_prioritario", "TEXT"), ("grupo_secundario", "TEXT")):
+        _add_column(conn, "prioridad_bloques", col, tipo)
+
+MIGRACIONES = [
+    (1, "esquema base",                             _m001_esquema_base),
+    (2, "columnas agregadas después del esquema",   _m002_columnas_agregadas),
+    (3, "índices compuestos rutinas/pesos/progreso", _m003_indices_compuestos),
+    (4, "historial compacto de pesos/progreso",     _m004_historial_compacto),
+    (5, "versiones de datos para ETag",             _m005_versiones_datos),
+    (6, "huella de datos en analisis_historial",     _m006_huella_analisis),
+    (7, "índice analisis_historial por fecha",       _m007_indice_analisis_fecha),
+    (8, "columnas que usa gamification.py",          _m008_columnas_gamificacion),
+    (9, "límites de mesociclo para el historial",    _m009_mesociclos),
+    (10, "columnas que usa la prioridad muscular",   _m010_columnas_prioridad),
+]
+SCHEMA_VERSION = MIGRACIONES[-1][0]
+
+def _schema_version(conn):
+    try:
+        row = conn.execute("SELECT MAX(version) AS v FROM schema_version").fetchone()
+    except sqlite3.OperationalError:
+        return 0  # DB nueva o anterior al control de versiones
+    return row["v"] or 0
+
+def init_db():
     with get_db() as conn:
-        for sql in MIGRACIONES:
-            try:
-                conn.execute(sql)
-            except Exception:
-                pass  # columna ya existe — ignorar
+        version = _schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        logger.info("DB al día (schema v%d): %s", version, DB_PATH)
+        return
 
-    logger.info("DB inicializada: %s", DB_PATH)
+    with get_db() as conn:
+        conn.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY, descripcion TEXT,
+            aplicada TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    for num, descripcion, migrar in MIGRACIONES:
+        if num <= version:
+            continue
+        with get_db() as conn:
+            migrar(conn)
+            conn.execute("INSERT OR IGNORE INTO schema_version (version, descripcion) VALUES (?,?)",
+                         (num, descripcion))
+        logger.info("Migración %d aplicada: %s", num, descripcion)
+
+    logger.info("DB inicializada (schema v%d): %s", SCHEMA_VERSION, DB_PATH)
 
 # ── GYM ───────────────────────────────────────────────────────────────────────
 
 def get_allowed_users():
     return {r["user_id"] for r in fetchall("SELECT user_id FROM allowed_users WHERE activo=1")}
 
+# Allow-list en memoria: check_auth y callback_router la consultan en cada
+# update. Se carga al arrancar, add_allowed_user la actualiza al momento y
+# un job la recarga cada tanto para ver filas escritas por otros procesos.
+_allowed: frozenset = frozenset()
+_allowed_cargada = False
+_allowed_gen     = 0
+_allowed_lock    = threading.Lock()
+
+def recargar_allowed_users():
+    global _allowed, _allowed_cargada
+    while True:
+        gen   = _allowed_gen
+        nuevo = frozenset(get_allowed_users())
+        with _allowed_lock:
+            # Si hubo un add_allowed_user mientras leíamos, releer
+            if gen == _allowed_gen:
+                _allowed, _allowed_cargada = nuevo, True
+                return nuevo
+
+def is_allowed(user_id):
+    if not _allowed_cargada:
+        recargar_allowed_users()
+    return user_id in _allowed
+
 def add_allowed_user(user_id):
+    global _allowed, _allowed_gen
     execute("INSERT OR IGNORE INTO allowed_users (user_id, activo) VALUES (?,1)", (user_id,))
+    with _allowed_lock:
+        _allowed      = _allowed | {user_id}
+        _allowed_gen += 1
+
+# ── CACHE DE PERFIL Y ESTADO ──────────────────────────────────────────────────
+# Se leen en casi cada callback/request y solo cambian en upsert_perfil,
+# upsert_estado, clear_plan y un par de UPDATE sueltos (que llaman a
+# invalidar_usuario). El TTL es la red de seguridad para cualquier otro writer.
+
+DB_CACHE_USUARIOS = int(os.environ.get("DB_CACHE_USUARIOS", "512"))
+DB_CACHE_TTL      = float(os.environ.get("DB_CACHE_TTL", "300"))
+
+_cache_perfil = CacheLRU(maxsize=DB_CACHE_USUARIOS, ttl=DB_CACHE_TTL)
+_cache_estado = CacheLRU(maxsize=DB_CACHE_USUARIOS, ttl=DB_CACHE_TTL)
+
+def invalidar_usuario(user_id):
+    """Llamar después de escribir usuarios/estado con SQL directo."""
+    _cache_perfil.invalidar(user_id)
+    _cache_estado.invalidar(user_id)
+    _cache_dia.invalidar(user_id)
+    _cache_sesion.invalidar(user_id)
+
+def cache_stats() -> dict:
+    return {"perfil": _cache_perfil.stats(), "estado": _cache_estado.stats(),
+            "dia_sesion": _cache_dia.stats(), "sesion": _cache_sesion.stats()}
 
 def get_perfil(user_id):
-    row = fetchone("SELECT * FROM usuarios WHERE user_id=?", (user_id,))
-    return dict(row) if row else {}
+    perfil = _cache_perfil.get(user_id)
+    if perfil is None:
+        gen = _cache_perfil.generacion()
+        row = fetchone("SELECT * FROM usuarios WHERE user_id=?", (user_id,))
+        if not row:
+            return {}
+        perfil = dict(row)
+        _cache_perfil.set(user_id, perfil, generacion=gen)
+    # Copia: los callers mutan el dict (perfil.update, etc.)
+    return dict(perfil)
 
 def upsert_perfil(user_id, **kwargs):
     # Columnas válidas — filtrar kwargs desconocidos para evitar errores de schema
@@ -224,74 +848,132 @@ def upsert_perfil(user_id, **kwargs):
     cols   = ", ".join(perfil.keys())
     pholds = ", ".join(["?"] * len(perfil))
     sets   = ", ".join(f"{k}=excluded.{k}" for k in perfil if k != "user_id")
-    execute(f"INSERT INTO usuarios ({cols}) VALUES ({pholds}) ON CONFLICT(user_id) DO UPDATE SET {sets}",
-            tuple(perfil.values()))
+    try:
+        execute(f"INSERT INTO usuarios ({cols}) VALUES ({pholds}) ON CONFLICT(user_id) DO UPDATE SET {sets}",
+                tuple(perfil.values()))
+    finally:
+        _cache_perfil.invalidar(user_id)
 
 def get_estado(user_id):
-    row = fetchone("SELECT semana, dia FROM estado WHERE user_id=?", (user_id,))
-    return (row["semana"], row["dia"]) if row else (1, "lunes")
+    estado = _cache_estado.get(user_id)
+    if estado is None:
+        gen = _cache_estado.generacion()
+        row = fetchone("SELECT semana, dia FROM estado WHERE user_id=?", (user_id,))
+        estado = (row["semana"], row["dia"]) if row else (1, "lunes")
+        _cache_estado.set(user_id, estado, generacion=gen)
+    return estado
 
 def upsert_estado(user_id, semana, dia):
-    execute("INSERT INTO estado (user_id,semana,dia) VALUES (?,?,?) ON CONFLICT(user_id) DO UPDATE SET semana=?,dia=?",
-            (user_id, semana, dia, semana, dia))
+    try:
+        execute("INSERT INTO estado (user_id,semana,dia) VALUES (?,?,?) ON CONFLICT(user_id) DO UPDATE SET semana=?,dia=?",
+                (user_id, semana, dia, semana, dia))
+    except Exception:
+        _cache_estado.invalidar(user_id)
+        raise
+    _cache_estado.actualizar(user_id, (semana, dia))
+    _publicar(user_id, "estado", semana=semana, dia=dia)
 
 def has_plan(user_id):
     row = fetchone("SELECT COUNT(*) as n FROM rutinas WHERE user_id=?", (user_id,))
     return bool(row and row["n"] > 0)
 
+_TABLAS_PLAN = ("rutinas", "progreso", "progreso_historial", "estado", "sesion_activa", "peso_flow")
+
+def _clear_plan(conn, user_id):
+    for tbl in _TABLAS_PLAN:
+        conn.execute(f"DELETE FROM {tbl} WHERE user_id=?", (user_id,))
+    # Cierra el mesociclo: los pesos ya guardados quedan archivables
+    conn.execute("""INSERT INTO mesociclos (user_id, numero, pesos_desde)
+        VALUES (?, (SELECT COALESCE(MAX(numero), 0) + 1 FROM mesociclos WHERE user_id=?),
+                (SELECT COALESCE(MAX(id), 0) + 1 FROM pesos))""", (user_id, user_id))
+
 def clear_plan(user_id, keep_swaps=True):
-    for tbl in ["rutinas","progreso","estado","sesion_activa","peso_flow"]:
-        execute(f"DELETE FROM {tbl} WHERE user_id=?", (user_id,))
+    try:
+        with get_db(user_id) as conn:
+            _clear_plan(conn, user_id)
+    finally:
+        _cache_estado.invalidar(user_id)
+        _cache_dia.invalidar(user_id)
+        _cache_sesion.invalidar(user_id)
+    _publicar(user_id, "plan")
+
+def _filas_plan(user_id, semanas, swaps, by_id=None):
+    """Construye las tuplas de rutinas para executemany — sin tocar la DB."""
+    swap_map = {s["original_id"]: s["nuevo_id"] for s in swaps if s.get("nuevo_id")}
+    filas = []
+    for sem in semanas:
+        for dia_obj in sem["dias"]:
+            dia = dia_obj["dia"]
+            for orden, ej in enumerate(dia_obj["ejercicios"]):
+                # Soporte para ambos formatos
+                eid = ej.get("ejercicio_id") or ej.get("id", "")
+                eid = swap_map.get(eid, eid)
+
+                # Grupo puede estar en el ejercicio o en el dia
+                grupo = ej.get("grupo") or dia_obj.get("grupo", "")
+                # Si el ejercicio ya tiene todos los datos — usar directo
+                if ej.get("ejercicio") and grupo:
+                    filas.append((user_id, sem["semana"], dia, orden,
+                                  eid,
+                                  ej.get("ejercicio",""),
+                                  ej.get("patron",""),
+                                  grupo,
+                                  ej.get("rol","principal"),
+                                  ej.get("series", 3),
+                                  ej.get("reps","8-10"),
+                                  ej.get("notas",""),
+                                  ej.get("emg_score", 3)))
+                elif by_id:
+                    # Formato legacy — buscar en catálogo
+                    obj = by_id.get(eid)
+                    if not obj:
+                        continue
+                    filas.append((user_id, sem["semana"], dia, orden,
+                                  obj.id, obj.nombre, obj.patron, obj.grupo, obj.rol,
+                                  ej.get("series",3), ej.get("reps","8-10"), obj.cue, obj.emg_score))
+    return filas
 
 def insert_plan(user_id, semanas, swaps, by_id=None):
     """
-    Inserta el plan completo en rutinas.
+    Reemplaza el plan completo en rutinas.
     Acepta ejercicios con todos los campos (nuevo formato del planner)
     o solo con ejercicio_id para buscar en by_id (formato legacy).
+    Borrado + inserción van en una sola transacción: o queda el plan
+    nuevo completo o sigue el anterior, nunca un plan a medias.
     """
-    clear_plan(user_id)
-    swap_map = {s["original_id"]: s["nuevo_id"] for s in swaps if s.get("nuevo_id")}
-    n = 0
-    with get_db() as conn:
-        for sem in semanas:
-            for dia_obj in sem["dias"]:
-                dia = dia_obj["dia"]
-                for orden, ej in enumerate(dia_obj["ejercicios"]):
-                    # Soporte para ambos formatos
-                    eid = ej.get("ejercicio_id") or ej.get("id", "")
-                    eid = swap_map.get(eid, eid)
-
-                    # Grupo puede estar en el ejercicio o en el dia
-                    grupo = ej.get("grupo") or dia_obj.get("grupo", "")
-                    # Si el ejercicio ya tiene todos los datos — usar directo
-                    if ej.get("ejercicio") and grupo:
-                        conn.execute("""INSERT INTO rutinas
-                            (user_id,semana,dia,orden,ejercicio_id,ejercicio,patron,grupo,rol,series,reps,notas,emg_score,completado)
-                            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,0)""",
-                            (user_id, sem["semana"], dia, orden,
-                             eid,
-                             ej.get("ejercicio",""),
-                             ej.get("patron",""),
-                             grupo,
-                             ej.get("rol","principal"),
-                             ej.get("series", 3),
-                             ej.get("reps","8-10"),
-                             ej.get("notas",""),
-                             ej.get("emg_score", 3)))
-                        n += 1
-                    elif by_id:
-                        # Formato legacy — buscar en catálogo
-                        obj = by_id.get(eid)
-                        if not obj:
-                            continue
-                        conn.execute("""INSERT INTO rutinas
-                            (user_id,semana,dia,orden,ejercicio_id,ejercicio,patron,grupo,rol,series,reps,notas,emg_score,completado)
-                            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,0)""",
-                            (user_id, sem["semana"], dia, orden,
-                             obj.id, obj.nombre, obj.patron, obj.grupo, obj.rol,
-                             ej.get("series",3), ej.get("reps","8-10"), obj.cue, obj.emg_score))
-                        n += 1
-    return n
+    filas = _filas_plan(user_id, semanas, swaps, by_id)
+    try:
+        with get_db(user_id) as conn:
+            _clear_plan(conn, user_id)
+            conn.executemany("""INSERT INTO rutinas
+                (user_id,semana,dia,orden,ejercicio_id,ejercicio,patron,grupo,rol,series,reps,notas,emg_score,completado)
+                VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,0)""", filas)
+    finally:
+        _cache_estado.invalidar(user_id)
+        _cache_dia.invalidar(user_id)
+        _cache_sesion.invalidar(user_id)
+    _publicar(user_id, "plan")
+    return len(filas)
+
+def marcar_dia_completado(user_id, semana, dia):
+    try:
+        execute("UPDATE rutinas SET completado=1 WHERE user_id=? AND semana=? AND dia=?",
+                (user_id, semana, dia))
+    finally:
+        _cache_dia.invalidar(user_id)
+    _publicar(user_id, "dia_completado", semana=semana, dia=dia)
+
+def reemplazar_ejercicio(user_id, original_id, nuevo_id, nombre, patron, borrar_progreso=False):
+    try:
+        with get_db(user_id) as conn:
+            conn.execute("UPDATE rutinas SET ejercicio_id=?, ejercicio=?, patron=? WHERE user_id=? AND ejercicio_id=?",
+                         (nuevo_id, nombre, patron, user_id, original_id))
+            if borrar_progreso:
+                conn.execute("DELETE FROM progreso WHERE user_id=? AND ejercicio_id=?", (user_id, original_id))
+                conn.execute("DELETE FROM progreso_historial WHERE user_id=? AND ejercicio_id=?", (user_id, original_id))
+    finally:
+        _cache_dia.invalidar(user_id)
+    _publicar(user_id, "plan")
 
 def get_ejercicios_dia(user_id, semana, dia):
     return [dict(r) for r in fetchall(
@@ -308,6 +990,27 @@ def rutina_completa(user_id, semana, dia):
                     (user_id, semana, dia))
     return bool(rows) and all(r["completado"] for r in rows)
 
+def get_completado_semana(user_id, semana):
+    """[{dia, completado}] de la semana en orden — get_dias_semana + rutina_completa en una query."""
+    return [{"dia": r["dia"], "completado": bool(r["completado"])} for r in fetchall(
+        "SELECT dia, MIN(completado) AS completado FROM rutinas WHERE user_id=? AND semana=? "
+        "GROUP BY dia ORDER BY MIN(id)", (user_id, semana))]
+
+def semana_completa(user_id, semana):
+    row = fetchone("SELECT COUNT(*) AS n, MIN(completado) AS todo FROM rutinas WHERE user_id=? AND semana=?",
+                   (user_id, semana))
+    return bool(row and row["n"] and row["todo"])
+
+def adjust_series(user_id, semana, dia, delta=-1, solo_accesorios=False):
+    """Suma delta series (mínimo 1) a los ejercicios del día; solo_accesorios deja los principales."""
+    sql = "UPDATE rutinas SET series=MAX(1, series+?) WHERE user_id=? AND semana=? AND dia=?"
+    if solo_accesorios:
+        sql += " AND rol<>'principal'"
+    try:
+        execute(sql, (delta, user_id, semana, dia))
+    finally:
+        _cache_dia.invalidar(user_id)
+
 def avanzar_dia(user_id, semana, dia_actual, max_semana=4):
     dias = get_dias_semana(user_id, semana)
     if dia_actual in dias:
@@ -326,43 +1029,88 @@ def get_ultimo_peso(user_id, ejercicio_id):
                    (user_id, ejercicio_id))
     return dict(row) if row else None
 
+def _sugerir_peso(ultimo):
+    if not ultimo or not ultimo.get("peso_lbs"): return None
+    return round(float(ultimo["peso_lbs"]) + 5.0, 1)
+
 def get_peso_sugerido(user_id, ejercicio_id):
-    u = get_ultimo_peso(user_id, ejercicio_id)
-    if not u or not u.get("peso_lbs"): return None
-    return round(float(u["peso_lbs"]) + 5.0, 1)
+    return _sugerir_peso(get_ultimo_peso(user_id, ejercicio_id))
+
+def get_day_snapshot(user_id, semana, dia):
+    """
+    Ejercicios del día con el último peso de cada uno — una sola query.
+    Cada fila trae las columnas de rutinas más 'ultimo' (mismo dict que
+    get_ultimo_peso más 'semana', o None), 'peso_sugerido' y 'es_cardio'
+    (mismo criterio que la API: ejercicio_id CAR*). El último peso
+    sale de un seek por idx_pesos_ejercicio por ejercicio, sin ordenar todo
+    el historial.
+    """
+    rows = fetchall("""
+        SELECT r.*, p.id AS u_id, p.peso_lbs AS u_peso_lbs, p.series_hechas AS u_series_hechas,
+               p.reps_hechas AS u_reps_hechas, p.fecha AS u_fecha, p.semana AS u_semana
+        FROM rutinas r
+        LEFT JOIN pesos p ON p.id = (
+            SELECT id FROM pesos
+            WHERE user_id=r.user_id AND ejercicio_id=r.ejercicio_id
+            ORDER BY semana DESC, id DESC LIMIT 1)
+        WHERE r.user_id=? AND r.semana=? AND r.dia=?
+        ORDER BY r.orden""", (user_id, semana, dia))
+    out = []
+    for row in rows:
+        d = dict(row)
+        ultimo = {k: d.pop(f"u_{k}") for k in ("peso_lbs", "series_hechas", "reps_hechas", "fecha", "semana")}
+        d["ultimo"] = ultimo if d.pop("u_id") else None
+        d["peso_sugerido"] = _sugerir_peso(d["ultimo"])
+        d["es_cardio"]     = (d["ejercicio_id"] or "").startswith("CAR")
+        out.append(d)
+    return out
 
 def save_peso(user_id, ejercicio_id, semana, dia, peso_lbs, series=None, reps=None):
-    execute("INSERT INTO pesos (user_id,ejercicio_id,semana,dia,peso_lbs,series_hechas,reps_hechas) VALUES (?,?,?,?,?,?,?)",
-            (user_id, ejercicio_id, semana, dia, peso_lbs, series, reps))
+    _escribir(user_id, "INSERT INTO pesos (user_id,ejercicio_id,semana,dia,peso_lbs,series_hechas,reps_hechas) VALUES (?,?,?,?,?,?,?)",
+              (user_id, ejercicio_id, semana, dia, peso_lbs, series, reps))
+    _parchear_dia(user_id, ejercicio_id, semana, peso_lbs, series, reps)
+    _publicar(user_id, "peso", ejercicio_id=ejercicio_id, semana=semana, dia=dia,
+              peso_lbs=peso_lbs, series=series, reps=reps)
 
 def get_progresion_ejercicio(user_id, ejercicio_id):
     return [dict(r) for r in fetchall(
-        "SELECT semana, MAX(peso_lbs) as mejor_peso, series_hechas, reps_hechas FROM pesos WHERE user_id=? AND ejercicio_id=? AND peso_lbs IS NOT NULL GROUP BY semana ORDER BY semana ASC",
+        "SELECT semana, MAX(peso_lbs) as mejor_peso, series_hechas, reps_hechas FROM pesos_todos WHERE user_id=? AND ejercicio_id=? AND peso_lbs IS NOT NULL GROUP BY semana ORDER BY semana ASC",
         (user_id, ejercicio_id))]
 
+def get_ganancia_ejercicio(user_id, ejercicio_id):
+    """Mejor peso de la última semana menos el de la primera, todo el historial (0 con < 2 semanas)."""
+    row = fetchone("""
+        WITH s AS (SELECT semana, MAX(peso_lbs) AS m FROM pesos_todos
+                   WHERE user_id=? AND ejercicio_id=? AND peso_lbs IS NOT NULL GROUP BY semana)
+        SELECT COUNT(*) AS n,
+               (SELECT m FROM s ORDER BY semana DESC LIMIT 1) -
+               (SELECT m FROM s ORDER BY semana ASC  LIMIT 1) AS ganancia
+        FROM s""", (user_id, ejercicio_id))
+    return round(float(row["ganancia"]), 1) if row and row["n"] >= 2 else 0.0
+
 def get_ejercicios_con_historial(user_id):
     return [dict(r) for r in fetchall("""
         SELECT p.ejercicio_id, r.ejercicio, r.grupo,
                COUNT(DISTINCT p.semana) as semanas_registradas,
-               MAX(p.peso_lbs) as peso_maximo, MIN(p.peso_lbs) as peso_minimo
-        FROM pesos p JOIN rutinas r ON r.user_id=p.user_id AND r.ejercicio_id=p.ejercicio_id
+               MAX(p.peso_lbs) as peso_maximo, MIN(p.peso_min) as peso_minimo
+        FROM pesos_todos p JOIN rutinas r ON r.user_id=p.user_id AND r.ejercicio_id=p.ejercicio_id
         WHERE p.user_id=? AND p.peso_lbs IS NOT NULL
         GROUP BY p.ejercicio_id HAVING COUNT(DISTINCT p.semana)>=1
         ORDER BY r.grupo, MAX(p.peso_lbs) DESC""", (user_id,))]
 
 def get_resumen_progresion(user_id):
-    rows = fetchall("""SELECT ejercicio_id, MIN(peso_lbs) as primer_peso, MAX(peso_lbs) as ultimo_peso,
+    rows = fetchall("""SELECT ejercicio_id, MIN(peso_min) as primer_peso, MAX(peso_lbs) as ultimo_peso,
         MAX(semana) as ultima_semana, MIN(semana) as primera_semana
-        FROM pesos WHERE user_id=? AND peso_lbs IS NOT NULL GROUP BY ejercicio_id
-        HAVING MAX(semana)>MIN(semana) ORDER BY (MAX(peso_lbs)-MIN(peso_lbs)) DESC""", (user_id,))
+        FROM pesos_todos WHERE user_id=? AND peso_lbs IS NOT NULL GROUP BY ejercicio_id
+        HAVING MAX(semana)>MIN(semana) ORDER BY (MAX(peso_lbs)-MIN(peso_min)) DESC""", (user_id,))
     return {r["ejercicio_id"]: dict(r) for r in rows}
 
 def get_progresiones_con_peso(user_id, semana):
     return [dict(r) for r in fetchall("""
         SELECT p.ejercicio_id, r.ejercicio, r.grupo,
                MAX(p.peso_lbs) as peso_actual,
-               (SELECT MAX(p2.peso_lbs) FROM pesos p2 WHERE p2.user_id=p.user_id AND p2.ejercicio_id=p.ejercicio_id AND p2.semana<p.semana) as peso_anterior
-        FROM pesos p JOIN rutinas r ON r.user_id=p.user_id AND r.ejercicio_id=p.ejercicio_id
+               (SELECT MAX(p2.peso_lbs) FROM pesos_todos p2 WHERE p2.user_id=p.user_id AND p2.ejercicio_id=p.ejercicio_id AND p2.semana<p.semana) as peso_anterior
+        FROM pesos_todos p JOIN rutinas r ON r.user_id=p.user_id AND r.ejercicio_id=p.ejercicio_id
         WHERE p.user_id=? AND p.semana=? AND p.peso_lbs IS NOT NULL
         GROUP BY p.ejercicio_id HAVING peso_actual>COALESCE(peso_anterior,0)
         ORDER BY (peso_actual-COALESCE(peso_anterior,0)) DESC""", (user_id, semana))]
@@ -371,10 +1119,48 @@ def save_progreso_sesion(user_id, semana, dia, rir=2, progresion="si", fatiga=2)
     execute("INSERT INTO progreso (user_id,semana,dia,rir,progreso_reportado,fatiga_reportada) VALUES (?,?,?,?,?,?)",
             (user_id, semana, dia, rir, progresion, fatiga))
 
+def get_historial_sesiones(user_id, grupo=None, limit=6):
+    """Sesiones reportadas (progreso), la más reciente primero; grupo filtra por el del día."""
+    sql = "SELECT semana, dia, rir, progreso_reportado, fatiga_reportada, fecha FROM progreso p WHERE user_id=?"
+    params = [user_id]
+    if grupo:
+        sql += (" AND EXISTS (SELECT 1 FROM rutinas r WHERE r.user_id=p.user_id"
+                " AND r.semana=p.semana AND r.dia=p.dia AND r.grupo=?)")
+        params.append(grupo)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(limit)
+    return [dict(r) for r in fetchall(sql, tuple(params))]
+
+def version_datos(user_id, *scopes):
+    """Versiones actuales de los scopes pedidos, en el mismo orden (0 si nunca cambió)."""
+    rows = fetchall(f"""SELECT scope, user_id, version FROM datos_version
+        WHERE scope IN ({",".join("?" * len(scopes))}) AND user_id IN (?, 0)""",
+        (*scopes, user_id))
+    vers = {(r["scope"], r["user_id"]): r["version"] for r in rows}
+    return tuple(vers.get((scope, 0 if scope == "cuerpo" else user_id), 0) for scope in scopes)
+
 def get_stats(user_id):
-    row = fetchone("SELECT COUNT(DISTINCT dia||semana) as rutinas_completas FROM progreso WHERE user_id=?", (user_id,))
+    row = fetchone("""SELECT COUNT(DISTINCT dia||semana) as rutinas_completas FROM (
+        SELECT dia, semana FROM progreso WHERE user_id=?
+        UNION ALL
+        SELECT dia, semana FROM progreso_historial WHERE user_id=?)""", (user_id, user_id))
     return {"rutinas_completas": row["rutinas_completas"] if row else 0}
 
+def contar_progresiones(user_id):
+    row = fetchone("""SELECT
+        (SELECT COUNT(*) FROM progreso WHERE user_id=? AND progreso_reportado='si') +
+        (SELECT COALESCE(SUM(progresiones), 0) FROM progreso_historial WHERE user_id=?) AS n""",
+        (user_id, user_id))
+    return int(row["n"]) if row else 0
+
+def get_ultimo_entreno(user_id):
+    """Fecha (YYYY-MM-DD) del último registro en progreso, o None."""
+    row = fetchone("""SELECT MAX(f) AS ultima FROM (
+        SELECT MAX(fecha) AS f FROM progreso WHERE user_id=?
+        UNION ALL
+        SELECT MAX(fecha_max) FROM progreso_historial WHERE user_id=?)""", (user_id, user_id))
+    return row["ultima"] if row else None
+
 def get_swaps(user_id):
     return [dict(r) for r in fetchall("SELECT original_id, nuevo_id FROM swaps WHERE user_id=?", (user_id,))]
 
@@ -383,21 +1169,37 @@ def save_swap(user_id, original_id, nuevo_id, grupo, rol):
             (user_id, original_id, nuevo_id, grupo, rol))
 
 def save_sesion_activa(user_id, semana, dia, ej_idx, fase="ejercicio"):
-    execute("INSERT INTO sesion_activa (user_id,semana,dia,ej_idx,fase) VALUES (?,?,?,?,?) ON CONFLICT(user_id) DO UPDATE SET semana=?,dia=?,ej_idx=?,fase=?,updated=CURRENT_TIMESTAMP",
-            (user_id,semana,dia,ej_idx,fase,semana,dia,ej_idx,fase))
+    _escribir(user_id, "INSERT INTO sesion_activa (user_id,semana,dia,ej_idx,fase) VALUES (?,?,?,?,?) ON CONFLICT(user_id) DO UPDATE SET semana=?,dia=?,ej_idx=?,fase=?,updated=CURRENT_TIMESTAMP",
+              (user_id,semana,dia,ej_idx,fase,semana,dia,ej_idx,fase))
+    _cache_sesion.actualizar(user_id, {
+        "user_id": user_id, "semana": semana, "dia": dia, "ej_idx": ej_idx, "fase": fase,
+        "updated": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())})
+    _publicar(user_id, "sesion", semana=semana, dia=dia, ej_idx=ej_idx, fase=fase)
 
 def get_sesion_activa(user_id):
-    row = fetchone("SELECT * FROM sesion_activa WHERE user_id=?", (user_id,))
-    return dict(row) if row else None
+    sesion = _cache_sesion.get(user_id)
+    if sesion is None:
+        gen    = _cache_sesion.generacion()
+        row    = fetchone("SELECT * FROM sesion_activa WHERE user_id=?", (user_id,))
+        sesion = dict(row) if row else _SIN_SESION
+        _cache_sesion.set(user_id, sesion, generacion=gen)
+    return dict(sesion) if sesion else None
 
 def clear_sesion_activa(user_id):
-    execute("DELETE FROM sesion_activa WHERE user_id=?", (user_id,))
+    _cache_dia.invalidar(user_id)
+    try:
+        execute("DELETE FROM sesion_activa WHERE user_id=?", (user_id,))
+    except Exception:
+        _cache_sesion.invalidar(user_id)
+        raise
+    _cache_sesion.actualizar(user_id, _SIN_SESION)
+    _publicar(user_id, "sesion", ej_idx=None)
 
 def save_peso_flow(user_id, semana, dia, ejercicios, idx):
     import json
     ejs = json.dumps(ejercicios)
-    execute("INSERT INTO peso_flow (user_id,semana,dia,ejercicios,idx) VALUES (?,?,?,?,?) ON CONFLICT(user_id) DO UPDATE SET semana=?,dia=?,ejercicios=?,idx=?,updated=CURRENT_TIMESTAMP",
-            (user_id,semana,dia,ejs,idx,semana,dia,ejs,idx))
+    _escribir(user_id, "INSERT INTO peso_flow (user_id,semana,dia,ejercicios,idx) VALUES (?,?,?,?,?) ON CONFLICT(user_id) DO UPDATE SET semana=?,dia=?,ejercicios=?,idx=?,updated=CURRENT_TIMESTAMP",
+              (user_id,semana,dia,ejs,idx,semana,dia,ejs,idx))
 
 def get_peso_flow(user_id):
     import json
@@ -424,16 +1226,215 @@ def consume_login_token(token):
     execute("UPDATE login_tokens SET used=1 WHERE token=?", (token,))
     return int(row["user_id"])
 
-def save_analisis(user_id, texto, tipo="nocturno"):
+def save_analisis(user_id, texto, tipo="nocturno", huella=None):
+    from datetime import datetime
+    execute("INSERT INTO analisis_historial (user_id,fecha,texto,tipo,huella) VALUES (?,?,?,?,?)",
+            (user_id, datetime.now().strftime("%Y-%m-%d"), texto, tipo, huella))
+
+def get_analisis_del_dia(user_id, tipo, huella):
+    """Texto guardado hoy para los mismos datos de entrada, o None."""
     from datetime import datetime
-    execute("INSERT INTO analisis_historial (user_id,fecha,texto,tipo) VALUES (?,?,?,?)",
-            (user_id, datetime.now().strftime("%Y-%m-%d"), texto, tipo))
+    row = fetchone("""SELECT texto FROM analisis_historial
+        WHERE user_id=? AND tipo=? AND fecha=? AND huella=?
+        ORDER BY id DESC LIMIT 1""",
+        (user_id, tipo, datetime.now().strftime("%Y-%m-%d"), huella))
+    return row["texto"] if row else None
 
 def get_usuarios_con_recordatorio(hora):
     return [r["user_id"] for r in fetchall(
         "SELECT u.user_id FROM usuarios u JOIN allowed_users a ON a.user_id=u.user_id WHERE u.hora_recordatorio=? AND a.activo=1",
         (hora,))]
 
+# ── CACHE DE SESIÓN ───────────────────────────────────────────────────────────
+# Durante un entreno cada "✅ Hecho" o peso tipeado vuelve a pedir el mismo
+# snapshot del día y la misma fila de sesion_activa. Un usuario tiene una
+# sola sesión activa, así que ambas caches van por user_id; la del día
+# guarda (semana, dia, filas) y solo sirve si coinciden semana y día.
+#
+# La carga ej_start (cargar_sesion). La invalidan los que tocan rutinas del
+# usuario: swaps, modo casa/gym (science.py), día completado, clear/insert
+# del plan. save_peso parchea el 'ultimo' del ejercicio en vez de releer y
+# save_sesion_activa es write-through: un paso del entreno es una escritura
+# y cero lecturas. Las filas cacheadas se comparten — no mutarlas.
+
+DB_CACHE_SESION_TTL = float(os.environ.get("DB_CACHE_SESION_TTL", "1800"))
+
+_cache_dia    = CacheLRU(maxsize=DB_CACHE_USUARIOS, ttl=DB_CACHE_SESION_TTL)
+_cache_sesion = CacheLRU(maxsize=DB_CACHE_USUARIOS, ttl=DB_CACHE_SESION_TTL)
+
+_SIN_SESION = {}   # get() de CacheLRU no distingue None cacheado de ausente
+
+def invalidar_sesion(user_id):
+    """Llamar después de cambiar rutinas del usuario con SQL directo."""
+    _cache_dia.invalidar(user_id)
+
+def cargar_sesion(user_id, semana, dia):
+    """Snapshot del día leído de la DB y cacheado para la sesión que arranca."""
+    _cache_dia.invalidar(user_id)
+    return get_snapshot_sesion(user_id, semana, dia)
+
+def get_snapshot_sesion(user_id, semana, dia):
+    """get_day_snapshot() a través de la cache de sesión."""
+    item = _cache_dia.get(user_id)
+    if item is not None and item[0] == semana and item[1] == dia:
+        return item[2]
+    gen   = _cache_dia.generacion()
+    filas = get_day_snapshot(user_id, semana, dia)
+    _cache_dia.set(user_id, (semana, dia, filas), generacion=gen)
+    return filas
+
+def _parchear_dia(user_id, ejercicio_id, semana, peso_lbs, series, reps):
+    # Mismo criterio que la subquery de get_day_snapshot: gana la semana
+    # más alta y, a igual semana, la fila más nueva (esta).
+    gen  = _cache_dia.generacion()
+    item = _cache_dia.get(user_id)
+    if item is None:
+        return
+    filas = []
+    for f in item[2]:
+        u = f["ultimo"]
+        if f["ejercicio_id"] == ejercicio_id and (u is None or (u["semana"] or 0) <= (semana or 0)):
+            ultimo = {"peso_lbs": peso_lbs, "series_hechas": series, "reps_hechas": reps,
+                      "fecha": time.strftime("%Y-%m-%d", time.gmtime()), "semana": semana}
+            f = {**f, "ultimo": ultimo, "peso_sugerido": _sugerir_peso(ultimo)}
+        filas.append(f)
+    _cache_dia.actualizar(user_id, (item[0], item[1], filas), generacion=gen)
+
+# ── HISTORIAL COMPACTO ────────────────────────────────────────────────────────
+# pesos crece para siempre y cada agregado recorre todo el historial del
+# usuario. compactar_historial() (job diario) pasa las filas de mesociclos
+# ya cerrados a pesos_historial, un resumen por semana. Los lectores usan
+# pesos_todos (vista hot + archivo), así que el resultado no cambia.
+#
+# El límite es el de la tabla mesociclos, no la fecha ni el número de
+# semana (que se repite en cada mesociclo): se archiva lo que se guardó
+# antes de que empezara el plan actual. Nunca se archiva la fila más
+# reciente de cada (usuario, ejercicio) — la leen get_ultimo_peso y
+# get_day_snapshot.
+#
+# progreso no se compacta: _clear_plan lo borra con cada plan nuevo, así
+# que solo tiene filas del mesociclo en curso. progreso_historial queda
+# para los lectores (puede tener filas de antes de este criterio) y se
+# vacía con el próximo plan.
+
+_PESOS_ARCHIVABLES = """
+    FROM pesos p
+    WHERE p.id < (SELECT MAX(m.pesos_desde) FROM mesociclos m WHERE m.user_id=p.user_id)
+      AND p.id <> (SELECT id FROM pesos p2
+                   WHERE p2.user_id=p.user_id AND p2.ejercicio_id=p.ejercicio_id
+                   ORDER BY p2.semana DESC, p2.id DESC LIMIT 1)"""
+
+def compactar_historial():
+    """
+    Archiva los pesos de mesociclos cerrados en una sola transacción.
+    Devuelve {"pesos": n} con las filas movidas.
+    """
+    esperar_escrituras()
+    with get_db() as conn:
+        # series/reps del resumen = las de la fila con más peso (FIRST_VALUE:
+        # con varios agregados SQLite no garantiza de qué fila salen las
+        # columnas sueltas).
+        conn.execute(f"""
+            INSERT INTO pesos_historial
+                (user_id, ejercicio_id, semana, periodo, peso_max, peso_min,
+                 series_hechas, reps_hechas, registros, fecha_max)
+            SELECT user_id, ejercicio_id, semana, periodo, MAX(peso_lbs), MIN(peso_lbs),
+                   MAX(series_top), MAX(reps_top), COUNT(*), MAX(fecha)
+            FROM (
+                SELECT p.user_id, p.ejercicio_id, p.semana, p.peso_lbs, p.fecha,
+                       strftime('%Y-%W', p.fecha) AS periodo,
+                       FIRST_VALUE(p.series_hechas) OVER w AS series_top,
+                       FIRST_VALUE(p.reps_hechas)   OVER w AS reps_top
+                {_PESOS_ARCHIVABLES}
+                WINDOW w AS (PARTITION BY p.user_id, p.ejercicio_id, p.semana, strftime('%Y-%W', p.fecha)
+                             ORDER BY p.peso_lbs DESC, p.id DESC)
+            ) WHERE true
+            GROUP BY user_id, ejercicio_id, semana, periodo
+            ON CONFLICT (user_id, ejercicio_id, semana, periodo) DO UPDATE SET
+                series_hechas = CASE WHEN excluded.peso_max > COALESCE(peso_max, -1)
+                                     THEN excluded.series_hechas ELSE series_hechas END,
+                reps_hechas   = CASE WHEN excluded.peso_max > COALESCE(peso_max, -1)
+                                     THEN excluded.reps_hechas ELSE reps_hechas END,
+                peso_max  = MAX(COALESCE(peso_max, excluded.peso_max), COALESCE(excluded.peso_max, peso_max)),
+                peso_min  = MIN(COALESCE(peso_min, excluded.peso_min), COALESCE(excluded.peso_min, peso_min)),
+                registros = registros + excluded.registros,
+                fecha_max = MAX(fecha_max, excluded.fecha_max)""")
+        n_pesos = conn.execute(
+            f"DELETE FROM pesos WHERE id IN (SELECT p.id {_PESOS_ARCHIVABLES})").rowcount
+    if n_pesos:
+        logger.info("Historial compactado: %d pesos", n_pesos)
+    return {"pesos": n_pesos}
+
+# ── HISTORIAL PAGINADO ────────────────────────────────────────────────────────
+# Paginación por cursor (keyset): el cursor es la clave de la última fila que
+# vio el cliente, así cada página es un range scan sobre un índice y no un
+# OFFSET que vuelve a recorrer todo lo anterior. Se pide limite+1 filas para
+# saber si hay otra página sin un COUNT aparte.
+
+HISTORIAL_LIMITE_MAX = 500
+
+COLUMNAS_PESAJES = ("Fecha", "Timestamp", "Peso_kg", "Grasa_Porcentaje", "Agua",
+                    "Musculo_Pct", "Musculo_kg", "BMR", "VisFat", "BMI",
+                    "EdadMetabolica", "FatFreeWeight", "Proteina", "MasaOsea")
+
+def _pagina(filas, limite, clave):
+    """(filas de la página, cursor de la siguiente o None)."""
+    filas = [dict(r) for r in filas]
+    if len(filas) <= limite:
+        return filas, None
+    filas = filas[:limite]
+    return filas, clave(filas[-1])
+
+def get_pesajes_pagina(desde=None, hasta=None, limite=HISTORIAL_LIMITE_MAX, cursor=None, campos=None):
+    """Pesajes por Fecha ascendente. cursor = Fecha de la última fila vista.
+
+    campos limita las columnas (Fecha siempre va: es el cursor). Nombres
+    fuera de COLUMNAS_PESAJES dan ValueError.
+    """
+    campos = list(campos or COLUMNAS_PESAJES)
+    invalidos = [c for c in campos if c not in COLUMNAS_PESAJES]
+    if invalidos:
+        raise ValueError(f"Columnas desconocidas: {', '.join(invalidos)}")
+    if "Fecha" not in campos:
+        campos.insert(0, "Fecha")
+    where, params = ["1=1"], []
+    if desde:  where.append("Fecha >= ?"); params.append(desde)
+    # hasta es inclusivo por día aunque Fecha traiga hora
+    if hasta:  where.append("Fecha < date(?, '+1 day')"); params.append(hasta)
+    if cursor: where.append("Fecha > ?"); params.append(cursor)
+    filas = fetchall(
+        f"SELECT {', '.join(campos)} FROM pesajes WHERE {' AND '.join(where)} "
+        f"ORDER BY Fecha ASC LIMIT ?", (*params, limite + 1))
+    return _pagina(filas, limite, lambda f: f["Fecha"])
+
+def get_progresion_pagina(user_id, ejercicio_id, desde=None, hasta=None,
+                          limite=HISTORIAL_LIMITE_MAX, cursor=None):
+    """Como get_progresion_ejercicio, acotada por semana. cursor = última semana vista."""
+    where, params = ["user_id=?", "ejercicio_id=?", "peso_lbs IS NOT NULL"], [user_id, ejercicio_id]
+    if desde is not None:  where.append("semana >= ?"); params.append(desde)
+    if hasta is not None:  where.append("semana <= ?"); params.append(hasta)
+    if cursor is not None: where.append("semana > ?");  params.append(cursor)
+    filas = fetchall(
+        f"SELECT semana, MAX(peso_lbs) as mejor_peso, series_hechas, reps_hechas "
+        f"FROM pesos_todos WHERE {' AND '.join(where)} "
+        f"GROUP BY semana ORDER BY semana ASC LIMIT ?", (*params, limite + 1))
+    return _pagina(filas, limite, lambda f: f["semana"])
+
+def get_analisis_pagina(user_id, desde=None, hasta=None, limite=14, cursor=None):
+    """Análisis guardados, más nuevos primero. cursor = 'fecha_id' de la última fila vista."""
+    where, params = ["user_id=?"], [user_id]
+    if desde: where.append("fecha >= ?"); params.append(desde)
+    if hasta: where.append("fecha <= ?"); params.append(hasta)
+    if cursor:
+        fecha, _, ultimo_id = cursor.rpartition("_")
+        if not fecha or not ultimo_id.isdigit():
+            raise ValueError("Cursor inválido")
+        where.append("(fecha, id) < (?, ?)"); params += [fecha, int(ultimo_id)]
+    filas = fetchall(
+        f"SELECT id, fecha, texto, tipo FROM analisis_historial WHERE {' AND '.join(where)} "
+        f"ORDER BY fecha DESC, id DESC LIMIT ?", (*params, limite + 1))
+    return _pagina(filas, limite, lambda f: f"{f['fecha']}_{f['id']}")
+
 # ── CUERPO ────────────────────────────────────────────────────────────────────
 
 def guardar_pesaje(m):
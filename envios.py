@@ -0,0 +1,168 @@
+"""
+envios.py — Cola de mensajes salientes del bot, respetando los límites de Telegram.
+
+Telegram corta con 429 (RetryAfter) arriba de ~30 mensajes/s en total y
+~1 mensaje/s por chat. Los jobs que escriben a muchos usuarios (los
+recordatorios y el resumen de las 21:00 de notificaciones.py) no llaman a
+bot.send_message directo, encolan acá:
+
+    msg = await envios.enviar(bot, uid, texto, parse_mode="HTML")
+
+ENVIOS_WORKERS tasks sacan de la cola en paralelo. Antes de cada envío
+pasan por dos token buckets de limitador.py: "telegram" (global, clave 0) y
+"telegram_chat" (por chat_id). Un RetryAfter pausa a todos los workers el
+tiempo que pide Telegram y el mensaje vuelve a la cola; un timeout o error
+de red se reintenta con backoff. Chat bloqueado o request inválido falla
+de una: enviar() levanta la excepción de PTB.
+
+Los límites se ajustan por entorno como cualquier regla de limitador:
+LIMITE_TELEGRAM="5/0.25" (20/s, ráfaga de 5), LIMITE_TELEGRAM_CHAT="1/1".
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+
+import limitador
+
+logger = logging.getLogger(__name__)
+
+ENVIOS_WORKERS    = int(os.environ.get("ENVIOS_WORKERS", "8"))
+ENVIOS_REINTENTOS = int(os.environ.get("ENVIOS_REINTENTOS", "3"))
+
+
+@dataclass
+class _Envio:
+    bot:      object
+    chat_id:  int
+    texto:    str
+    kwargs:   dict
+    futuro:   asyncio.Future
+    encolado: float = field(default_factory=time.monotonic)
+    intentos: int   = 0
+
+
+_cola: asyncio.Queue | None = None
+_workers: list[asyncio.Task] = []
+_pausa_hasta = 0.0   # monotonic; lo fija un RetryAfter
+_STATS = {"encolados": 0, "enviados": 0, "frenados": 0, "reintentos": 0,
+          "fallidos": 0, "lag_ultimo_s": 0.0, "lag_max_s": 0.0}
+
+
+def _iniciar() -> asyncio.Queue:
+    """Cola y workers en el loop actual (el del bot), la primera vez."""
+    global _cola
+    if _cola is None:
+        _cola = asyncio.Queue()
+        _workers.extend(asyncio.create_task(_worker(), name=f"envios-{i}")
+                        for i in range(ENVIOS_WORKERS))
+    return _cola
+
+
+def encolar(bot, chat_id: int, texto: str, **kwargs) -> asyncio.Future:
+    """Encola un send_message; el futuro resuelve con el Message (o la excepción)."""
+    futuro = asyncio.get_running_loop().create_future()
+    _iniciar().put_nowait(_Envio(bot, chat_id, texto, kwargs, futuro))
+    _STATS["encolados"] += 1
+    return futuro
+
+
+async def enviar(bot, chat_id: int, texto: str, **kwargs):
+    return await encolar(bot, chat_id, texto, **kwargs)
+
+
+async def _esperar_bucket(regla: str, clave) -> bool:
+    espera = limitador.consumir(regla, clave)
+    if espera <= 0:
+        return False
+    while espera > 0:
+        await asyncio.sleep(espera)
+        espera = limitador.consumir(regla, clave)
+    return True
+
+
+async def _esperar_turno(chat_id: int) -> None:
+    # El token del chat se gasta una vez. El global se toma después de
+    # cualquier pausa por RetryAfter, y se vuelve a tomar si otro worker
+    # recibió uno mientras tanto: al terminar la pausa no sale de golpe
+    # un mensaje por worker.
+    frenado = await _esperar_bucket("telegram_chat", chat_id)
+    while True:
+        pausa = _pausa_hasta - time.monotonic()
+        if pausa > 0:
+            frenado = True
+            await asyncio.sleep(pausa)
+        frenado = await _esperar_bucket("telegram", 0) or frenado
+        if _pausa_hasta <= time.monotonic():
+            break
+    if frenado:
+        _STATS["frenados"] += 1
+
+
+def _segundos(retry_after) -> float:
+    # PTB 21 da int; versiones nuevas, timedelta
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+async def _worker() -> None:
+    global _pausa_hasta
+    from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+    while True:
+        envio = await _cola.get()
+        try:
+            if envio.futuro.done():   # el que esperaba se canceló
+                continue
+            await _esperar_turno(envio.chat_id)
+            lag = time.monotonic() - envio.encolado
+            try:
+                msg = await envio.bot.send_message(chat_id=envio.chat_id, text=envio.texto, **envio.kwargs)
+            except RetryAfter as e:
+                _pausa_hasta = max(_pausa_hasta, time.monotonic() + _segundos(e.retry_after))
+                _STATS["frenados"] += 1
+                _reintentar(envio, e, inmediato=True)
+            except (BadRequest, Forbidden) as e:
+                _fallar(envio, e)
+            except NetworkError as e:   # incluye TimedOut
+                _reintentar(envio, e)
+            except Exception as e:
+                _fallar(envio, e)
+            else:
+                _STATS["enviados"]    += 1
+                _STATS["lag_ultimo_s"] = lag
+                _STATS["lag_max_s"]    = max(_STATS["lag_max_s"], lag)
+                if not envio.futuro.done():
+                    envio.futuro.set_result(msg)
+        finally:
+            _cola.task_done()
+
+
+def _reintentar(envio: _Envio, error: Exception, inmediato: bool = False) -> None:
+    envio.intentos += 1
+    if envio.intentos > ENVIOS_REINTENTOS:
+        _fallar(envio, error)
+        return
+    _STATS["reintentos"] += 1
+    if inmediato:   # la pausa global ya hace esperar
+        _cola.put_nowait(envio)
+    else:
+        asyncio.get_running_loop().call_later(2 ** envio.intentos, _cola.put_nowait, envio)
+
+
+def _fallar(envio: _Envio, error: Exception) -> None:
+    _STATS["fallidos"] += 1
+    logger.warning("Envío a %s falló (%d intentos): %s", envio.chat_id, envio.intentos + 1, error)
+    if not envio.futuro.done():
+        envio.futuro.set_exception(error)
+
+
+def stats() -> dict:
+    pausa = _pausa_hasta - time.monotonic()
+    return {
+        **_STATS,
+        "en_cola": _cola.qsize() if _cola is not None else 0,
+        "pausa_s": round(pausa, 1) if pausa > 0 else 0.0,
+        "workers": len(_workers),
+    }
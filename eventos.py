@@ -0,0 +1,100 @@
+"""
+eventos.py — Pub/sub en memoria de cambios por usuario, para /events (SSE).
+
+database.py publica deltas chicos desde sus funciones de escritura (peso
+guardado, ejercicio avanzado, día completado, estado nuevo) y cada conexión
+SSE abierta de ese usuario los recibe:
+
+    eventos.publicar(uid, "peso", {"ejercicio_id": "GLU01", "peso_lbs": 95})
+
+    with eventos.suscribir(uid) as sub:
+        evento = await sub.siguiente()     # {"id", "tipo", "data"}
+
+publicar() se llama desde cualquier thread (executor de adb, threadpool de
+FastAPI, bot); la entrega a cada suscriptor pasa a su event loop con
+call_soon_threadsafe. Si nadie escucha a ese usuario no cuesta más que un
+dict lookup. Un suscriptor lento que llena su cola recibe un solo evento
+"resync" en vez de los pendientes: el cliente vuelve a pedir todo.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import threading
+from contextlib import contextmanager
+
+MAX_PENDIENTES = 100
+
+_subs: dict[int, set["Suscripcion"]] = {}
+_lock  = threading.Lock()
+_ids   = itertools.count(1)
+_STATS = {"publicados": 0, "entregados": 0, "resyncs": 0}
+
+
+class Suscripcion:
+    def __init__(self, uid: int):
+        self.uid   = uid
+        self.loop  = asyncio.get_running_loop()
+        self.cola: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDIENTES)
+
+    def _entregar(self, evento: dict) -> None:
+        # Corre en self.loop
+        try:
+            self.cola.put_nowait(evento)
+            _STATS["entregados"] += 1
+        except asyncio.QueueFull:
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.cola.put_nowait({"id": evento["id"], "tipo": "resync", "data": "{}"})
+            _STATS["resyncs"] += 1
+
+    async def siguiente(self, timeout: float | None = None) -> dict | None:
+        """Próximo evento, o None si pasa `timeout` sin ninguno."""
+        try:
+            return await asyncio.wait_for(self.cola.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+@contextmanager
+def suscribir(uid: int):
+    """Registra una Suscripcion en el loop actual mientras dura el bloque."""
+    sub = Suscripcion(uid)
+    with _lock:
+        _subs.setdefault(uid, set()).add(sub)
+    try:
+        yield sub
+    finally:
+        with _lock:
+            subs = _subs.get(uid)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del _subs[uid]
+
+
+def publicar(uid: int, tipo: str, datos: dict | None = None) -> None:
+    with _lock:
+        subs = tuple(_subs.get(uid, ()))
+    if not subs:
+        return
+    evento = {"id": next(_ids), "tipo": tipo,
+              "data": json.dumps(datos or {}, ensure_ascii=False, default=str)}
+    _STATS["publicados"] += 1
+    for sub in subs:
+        try:
+            sub.loop.call_soon_threadsafe(sub._entregar, evento)
+        except RuntimeError:
+            pass   # loop cerrado: la conexión ya se fue
+
+
+def formato_sse(evento: dict) -> str:
+    return f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {evento['data']}\n\n"
+
+
+def stats() -> dict:
+    with _lock:
+        return {"usuarios": len(_subs),
+                "conexiones": sum(len(s) for s in _subs.values()),
+                **_STATS}
@@ -132,6 +132,16 @@ def get_xp(user_id: int) -> int:
     return int(row["xp_total"]) if row else 0
 
 
+def get_racha_xp(user_id: int) -> tuple[int, int]:
+    """(racha_actual, xp_total) en una sola lectura."""
+    row = db.fetchone(
+        "SELECT racha_actual, xp_total FROM gamificacion WHERE user_id=?", (user_id,)
+    )
+    if not row:
+        return 0, 0
+    return int(row["racha_actual"] or 0), int(row["xp_total"] or 0)
+
+
 # ══════════════════════════════════════════════════════════════════════════════
 # BADGES
 # ══════════════════════════════════════════════════════════════════════════════
@@ -259,12 +269,7 @@ def _contar_sesiones_gluteo(user_id: int) -> int:
 
 
 def _contar_progresiones(user_id: int) -> int:
-    row = db.fetchone(
-        "SELECT COUNT(*) as n FROM progreso "
-        "WHERE user_id=? AND progreso_reportado='si'",
-        (user_id,)
-    )
-    return int(row["n"]) if row else 0
+    return db.contar_progresiones(user_id)
 
 
 # ══════════════════════════════════════════════════════════════════════════════
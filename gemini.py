@@ -19,6 +19,7 @@ from google import genai
 from google.genai import types
 
 import catalog as cat
+import metricas
 from catalog import ROTACION_ONDULATORIO, SESION_GLUTEO
 from science import validar_y_corregir_dia
 
@@ -443,24 +444,25 @@ async def generar_semana(
 
     for intento in range(1, reintentos + 1):
         try:
-            resp = await asyncio.wait_for(
-                loop.run_in_executor(
-                    None,
-                    lambda p=prompt: client.models.generate_content(
-                        model=MODEL,
-                        contents=p,
-                        config=types.GenerateContentConfig(
-                            system_instruction=(
-                                "Eres un generador JSON puro. NUNCA texto explicativo. "
-                                "NUNCA markdown. SOLO el objeto JSON pedido."
+            with metricas.medir_llm("plan_semana"):
+                resp = await asyncio.wait_for(
+                    loop.run_in_executor(
+                        None,
+                        lambda p=prompt: client.models.generate_content(
+                            model=MODEL,
+                            contents=p,
+                            config=types.GenerateContentConfig(
+                                system_instruction=(
+                                    "Eres un generador JSON puro. NUNCA texto explicativo. "
+                                    "NUNCA markdown. SOLO el objeto JSON pedido."
+                                ),
+                                max_output_tokens=MAX_TOKENS,
+                                temperature=TEMPERATURE,
                             ),
-                            max_output_tokens=MAX_TOKENS,
-                            temperature=TEMPERATURE,
                         ),
                     ),
-                ),
-                timeout=TIMEOUT,
-            )
+                    timeout=TIMEOUT,
+                )
             sem_data, err = parsear_semana(resp.text, num_semana, ambiente=ambiente)
             if sem_data:
                 return sem_data, None
@@ -513,15 +515,16 @@ async def coach_response(
         f"No inventes rutinas — dile que use el menú."
     )
     loop = asyncio.get_event_loop()
-    resp = await asyncio.wait_for(
-        loop.run_in_executor(
-            None,
-            lambda: client.models.generate_content(
-                model=MODEL,
-                contents=texto,
-                config=types.GenerateContentConfig(system_instruction=system),
+    with metricas.medir_llm("coach"):
+        resp = await asyncio.wait_for(
+            loop.run_in_executor(
+                None,
+                lambda: client.models.generate_content(
+                    model=MODEL,
+                    contents=texto,
+                    config=types.GenerateContentConfig(system_instruction=system),
+                ),
             ),
-        ),
-        timeout=20,
-    )
+            timeout=20,
+        )
     return resp.text
@@ -2,10 +2,16 @@ const BASE = import.meta.env.VITE_API_URL || 'http://localhost:8000'
 
 function getToken() { return localStorage.getItem('gc_token') }
 
+// GET con ETag: path → { etag, data }. Si el server responde 304 se reusa
+// la última respuesta sin bajar ni parsear el JSON otra vez.
+const etags = new Map()
+
 async function request(method, path, body) {
   const headers = { 'Content-Type': 'application/json' }
   const token   = getToken()
   if (token) headers['Authorization'] = `Bearer ${token}`
+  const cached  = method === 'GET' ? etags.get(path) : undefined
+  if (cached) headers['If-None-Match'] = cached.etag
   const res = await fetch(`${BASE}${path}`, {
     method,
     headers,
@@ -13,14 +19,30 @@ async function request(method, path, body) {
   })
   if (res.status === 401) {
     localStorage.removeItem('gc_token')
+    etags.clear()
     window.location.href = '/login'
     return
   }
+  if (res.status === 304 && cached) return cached.data
   const data = await res.json()
   if (!res.ok) throw new Error(data.detail || 'Error del servidor')
+  const etag = res.headers.get('ETag')
+  if (method === 'GET' && etag) etags.set(path, { etag, data })
   return data
 }
 
+// { from, to, limit, cursor, campos } → '?from=…&campos=…' (omite vacíos).
+// /progreso/{eid} filtra por semana: { semana_desde, semana_hasta, … }
+function qs(params = {}) {
+  const q = new URLSearchParams()
+  for (const [k, v] of Object.entries(params)) {
+    if (v == null || v === '') continue
+    q.set(k, Array.isArray(v) ? v.join(',') : v)
+  }
+  const s = q.toString()
+  return s ? `?${s}` : ''
+}
+
 export const api = {
   // Auth
   login:              (user_id, pin)  => request('POST', '/auth/login', { user_id: Number(user_id), pin }),
@@ -28,6 +50,7 @@ export const api = {
   authToken:          (token)         => request('GET',  `/auth/token?token=${token}`),
 
   // Gym
+  dashboard:          ()              => request('GET',  '/dashboard'),
   rutina:             ()              => request('GET',  '/rutina/hoy'),
   plan:               ()              => request('GET',  '/plan'),
   guardarPeso:        (body)          => request('POST', '/pesos', body),
@@ -40,17 +63,17 @@ export const api = {
 
   // Fuerza (progreso)
   progreso:           ()              => request('GET',  '/progreso'),
-  progresoEj:         (eid)           => request('GET',  `/progreso/${eid}`),
+  progresoEj:         (eid, params)   => request('GET',  `/progreso/${eid}${qs(params)}`),
 
   // Stats
   stats:              ()              => request('GET',  '/stats'),
   resumen:            ()              => request('GET',  '/resumen'),
   analisisIA:         ()              => request('GET',  '/analisis'),
-  analisisHistorial:  ()              => request('GET',  '/analisis/historial'),
+  analisisHistorial:  (params)        => request('GET',  `/analisis/historial${qs(params)}`),
 
   // Cuerpo
   cuerpo:             ()              => request('GET',  '/cuerpo'),
-  cuerpoHistorial:    ()              => request('GET',  '/cuerpo/historial'),
+  cuerpoHistorial:    (params)        => request('GET',  `/cuerpo/historial${qs(params)}`),
 
   // Nutrición
   nutricionPlan:      ()              => request('GET',  '/nutricion/plan'),
@@ -58,5 +81,14 @@ export const api = {
 }
 
 export function setToken(t)  { localStorage.setItem('gc_token', t) }
-export function clearToken() { localStorage.removeItem('gc_token') }
+export function clearToken() { localStorage.removeItem('gc_token'); etags.clear() }
 export function isLoggedIn() { return !!getToken() }
+
+// EventSource no manda headers: el token va en la query
+// /events lleva el token en la query (EventSource no manda headers): se pide
+// uno de vida corta por conexión, nunca el de login.
+export async function eventsUrl() {
+  if (!getToken()) return null
+  const { token } = await request('POST', '/events/token')
+  return `${BASE}/events?token=${encodeURIComponent(token)}`
+}
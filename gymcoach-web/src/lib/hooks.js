@@ -1,5 +1,5 @@
-import { useState, useEffect, useCallback } from 'react'
-import { api } from './api'
+import { useState, useEffect, useCallback, useRef } from 'react'
+import { api, eventsUrl } from './api'
 
 export function useFetch(fn, deps = []) {
   const [data,    setData]    = useState(null)
@@ -14,9 +14,10 @@ export function useFetch(fn, deps = []) {
   }, deps)
 
   useEffect(() => { load() }, [load])
-  return { data, loading, error, refetch: load }
+  return { data, loading, error, refetch: load, setData }
 }
 
+export const useDashboard = () => useFetch(api.dashboard)
 export const useRutina    = () => useFetch(api.rutina)
 export const usePlan      = () => useFetch(api.plan)
 export const useProgreso  = () => useFetch(api.progreso)
@@ -29,3 +30,37 @@ export const useMacros    = () => useFetch(api.nutricionMacros)
 export function useProgresoEj(eid) {
   return useFetch(() => api.progresoEj(eid), [eid])
 }
+
+// Cambios en vivo del server (/events): handlers = { peso: (datos) => …, … }.
+// Tipos: peso, sesion, dia_completado, estado, plan, resync, error_guardado.
+// Si se cae la conexión se reconecta con un token nuevo y dispara resync.
+export function useEventos(handlers) {
+  const ref = useRef(handlers)
+  ref.current = handlers
+
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return
+    const tipos = ['peso', 'sesion', 'dia_completado', 'estado', 'plan', 'resync', 'error_guardado']
+    let es = null, timer = null, cerrado = false, reconexion = false
+
+    async function conectar() {
+      let url
+      try { url = await eventsUrl() } catch {   // red caída: reintentar
+        if (!cerrado) timer = setTimeout(conectar, 10000)
+        return
+      }
+      if (cerrado || !url) return   // sin login no hay stream
+      es = new EventSource(url)
+      tipos.forEach(tipo =>
+        es.addEventListener(tipo, e => ref.current[tipo]?.(JSON.parse(e.data || '{}'))))
+      // Lo que pasó mientras no había conexión se pierde: releer todo
+      es.onopen = () => { if (reconexion) ref.current.resync?.({}); reconexion = true }
+      // El token del stream vence enseguida: en vez del reintento de
+      // EventSource (mismo URL) se cierra y se pide uno nuevo
+      es.onerror = () => { es.close(); if (!cerrado) timer = setTimeout(conectar, 3000) }
+    }
+
+    conectar()
+    return () => { cerrado = true; clearTimeout(timer); es?.close() }
+  }, [])
+}
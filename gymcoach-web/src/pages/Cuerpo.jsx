@@ -76,7 +76,7 @@ export default function Cuerpo() {
   const [metric, setMetric] = useState('Peso_kg')
 
   useEffect(() => {
-    api.cuerpoHistorial()
+    api.cuerpoHistorial({ campos: ['Fecha', 'Peso_kg', 'Grasa_Porcentaje', 'Musculo_Pct'] })
       .then(d => setHistorial(d.historial || []))
       .catch(() => setHistorial([]))
       .finally(() => setLoadingHist(false))
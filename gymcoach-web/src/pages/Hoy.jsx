@@ -1,6 +1,6 @@
 import { useState } from 'react'
 import { RefreshCw, ChevronRight, Check, Zap } from 'lucide-react'
-import { useRutina, useMacros } from '../lib/hooks'
+import { useDashboard, useEventos } from '../lib/hooks'
 import { api } from '../lib/api'
 
 const GRUPO_COLOR = {
@@ -13,8 +13,9 @@ const GRUPO_ICON = {
 }
 
 export default function Hoy() {
-  const { data, loading, error, refetch } = useRutina()
-  const { data: macros } = useMacros()
+  const { data: dash, loading, error, refetch, setData } = useDashboard()
+  const data   = dash?.rutina
+  const macros = dash?.macros
   const [swapOpen,    setSwapOpen]    = useState(null)
   const [alts,        setAlts]        = useState([])
   const [sesionModal, setSesionModal] = useState(false)
@@ -23,6 +24,36 @@ export default function Hoy() {
   const [saving,      setSaving]      = useState(false)
   const [pesos,       setPesos]       = useState({})
   const [done,        setDone]        = useState(false)
+  const [errorSesion, setErrorSesion] = useState(null)
+
+  // Progreso hecho desde el bot: parchear la rutina en vez de volver a pedirla
+  function parchearEjercicios(fn) {
+    setData(d => d?.rutina?.ejercicios
+      ? { ...d, rutina: { ...d.rutina, ejercicios: d.rutina.ejercicios.map(fn) } }
+      : d)
+  }
+  // ej_idx del bot cuenta solo ejercicios de fuerza (el cardio va al final)
+  function marcarHechos(ejIdx) {
+    setData(d => {
+      if (!d?.rutina?.ejercicios) return d
+      const hechos = new Set(d.rutina.ejercicios.filter(e => !e.es_cardio)
+        .slice(0, ejIdx).map(e => e.ejercicio_id))
+      return { ...d, rutina: { ...d.rutina, ejercicios: d.rutina.ejercicios.map(e =>
+        hechos.has(e.ejercicio_id) ? { ...e, completado: true } : e) } }
+    })
+  }
+  const esHoy = ev => ev.semana === dash?.rutina?.semana && ev.dia === dash?.rutina?.dia
+  useEventos({
+    peso: ev => esHoy(ev) && parchearEjercicios(e =>
+      e.ejercicio_id === ev.ejercicio_id ? { ...e, ultimo_peso: ev.peso_lbs } : e),
+    sesion: ev => esHoy(ev) && ev.ej_idx != null && marcarHechos(ev.ej_idx),
+    dia_completado: ev => esHoy(ev) && parchearEjercicios(e => ({ ...e, completado: true })),
+    estado: ev => !esHoy(ev) && refetch(),
+    plan:   () => refetch(),
+    resync: () => refetch(),
+    // Un peso que el server no pudo guardar: volver a leer lo que quedó
+    error_guardado: () => refetch(),
+  })
 
   if (loading) return <Spinner />
   if (error)   return <ErrorScreen msg={error} onRetry={refetch} />
@@ -33,6 +64,7 @@ export default function Hoy() {
   const fuerza = ejercicios.filter(e => !e.es_cardio)
   const cardio = ejercicios.find(e => e.es_cardio)
   const color  = GRUPO_COLOR[grupo] || '#0A84FF'
+  const diaHecho = ejercicios.length > 0 && ejercicios.every(e => e.completado)
 
   async function openSwap(eid) {
     setSwapOpen(eid)
@@ -48,18 +80,23 @@ export default function Hoy() {
 
   async function completar() {
     setSaving(true)
-    for (const [eid, peso] of Object.entries(pesos)) {
-      if (peso) {
+    setErrorSesion(null)
+    // Pesos + cierre de sesión en un solo request (una transacción en el server)
+    const pesosSesion = Object.entries(pesos)
+      .filter(([, peso]) => peso)
+      .map(([eid, peso]) => {
         const ej = ejercicios.find(e => e.ejercicio_id === eid)
-        await api.guardarPeso({
-          ejercicio_id: eid, peso_lbs: parseFloat(peso),
-          semana, dia, series: ej?.series, reps: ej?.reps,
-        })
-      }
+        return { ejercicio_id: eid, peso_lbs: parseFloat(peso), series: ej?.series, reps: ej?.reps }
+      })
+    try {
+      await api.completarSesion({ semana, dia, rir, fatiga, pesos: pesosSesion })
+      setDone(true)
+    } catch (e) {
+      // El server deshizo todo: la sesión sigue abierta y se puede reintentar
+      setErrorSesion(e.message)
+    } finally {
+      setSaving(false)
     }
-    await api.completarSesion({ semana, dia, rir, fatiga })
-    setSaving(false)
-    setDone(true)
   }
 
   if (done) return <DoneScreen racha={racha + 1} onNext={refetch} />
@@ -130,7 +167,7 @@ export default function Hoy() {
           const sug  = ej.peso_sugerido
           const prev = ej.ultimo_peso
           return (
-            <div key={ej.ejercicio_id} className="card">
+            <div key={ej.ejercicio_id} className={`card ${ej.completado ? 'opacity-60' : ''}`}>
               <div className="px-4 pt-4 pb-3">
                 <div className="flex items-start justify-between gap-2 mb-2">
                   <div className="flex-1">
@@ -140,6 +177,11 @@ export default function Hoy() {
                         {i + 1}
                       </span>
                       <p className="text-white font-semibold text-sm">{ej.nombre}</p>
+                      {ej.completado && (
+                        <span className="flex items-center gap-1 text-xs font-medium text-green-400">
+                          <Check size={12} strokeWidth={3} /> Hecho
+                        </span>
+                      )}
                     </div>
                     <p className="text-zinc-500 text-xs mt-1 ml-7">
                       {ej.series} series × {ej.reps} reps
@@ -201,7 +243,9 @@ export default function Hoy() {
         {/* Cardio */}
         {cardio && (
           <div className="card px-4 py-4" style={{ borderLeft: '3px solid #30D158' }}>
-            <p className="text-xs text-zinc-500 font-medium uppercase tracking-wider mb-1">Cardio final</p>
+            <p className="text-xs text-zinc-500 font-medium uppercase tracking-wider mb-1">
+              Cardio final{cardio.completado && <span className="text-green-400 normal-case"> · Hecho</span>}
+            </p>
             <p className="text-white font-semibold">🏃 {cardio.nombre}</p>
             <p className="text-zinc-500 text-sm mt-0.5">{cardio.reps} · Zona 2 · 120-135 bpm</p>
           </div>
@@ -210,11 +254,12 @@ export default function Hoy() {
         {/* Finish button */}
         <button
           onClick={() => setSesionModal(true)}
-          className="w-full py-4 rounded-2xl text-base font-bold text-black flex items-center justify-center gap-2 active:scale-95 transition-transform"
+          disabled={diaHecho}
+          className="w-full py-4 rounded-2xl text-base font-bold text-black flex items-center justify-center gap-2 active:scale-95 transition-transform disabled:opacity-50"
           style={{ background: color }}
         >
           <Check size={20} strokeWidth={3} />
-          Terminé la rutina
+          {diaHecho ? 'Día completado' : 'Terminé la rutina'}
         </button>
       </div>
 
@@ -271,6 +316,7 @@ export default function Hoy() {
               )
             })}
           </div>
+          {errorSesion && <p className="text-red-400 text-sm text-center mb-3">{errorSesion}</p>}
           <button
             onClick={completar}
             disabled={saving}
@@ -5,11 +5,13 @@ Reglas de diseño:
 - Comandos (/start, /reset_plan, etc) usan reply_text (crean mensaje nuevo)
 - Callbacks de menú usan edit_message_text (editan el mensaje donde está el botón)
 - Onboarding: SIEMPRE delete+send_message para evitar "Message not modified"
-- Todos los :back handlers van ANTES de su startswith() correspondiente
+- Callbacks: un handler por ruta (@callback("ruta")); cada uno resuelve
+  sus subacciones (:back, etc.)
 """
 from __future__ import annotations
 import logging
 import os
+import time
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
@@ -17,9 +19,12 @@ from telegram.ext import (
     ContextTypes, MessageHandler, filters,
 )
 
+import adb
 import catalog as cat
 import database as db
 import gamification as gam
+import limitador
+import metricas
 import renderer as ren
 
 logger   = logging.getLogger(__name__)
@@ -47,7 +52,7 @@ DIETAS = {
 
 async def check_auth(update: Update) -> bool:
     uid = update.effective_user.id if update.effective_user else None
-    if uid in db.get_allowed_users():
+    if db.is_allowed(uid):
         return True
     msg = update.message or (update.callback_query.message if update.callback_query else None)
     if msg:
@@ -61,13 +66,13 @@ def _grupo_del_dia(uid, semana, dia):
 
 
 async def _menu_texto(uid, nombre=""):
-    racha      = gam.get_racha(uid)
-    semana, dia = db.get_estado(uid)
-    grupo      = _grupo_del_dia(uid, semana, dia)
+    racha      = await adb.run(gam.get_racha, uid)
+    semana, dia = await adb.get_estado(uid)
+    grupo      = await adb.run(_grupo_del_dia, uid, semana, dia)
     ICON = {"empuje":"💪","tiron":"🏋️","pierna":"🦵","gluteo":"🍑","core":"🎯","cardio":"🏃"}
     racha_str = f"🔥 {racha} días de racha  ·  " if racha >= 3 else ""
     hoy_str   = f"{ICON.get(grupo,'💪')} Hoy: {grupo.upper()}" if grupo else "🌿 Hoy: Descanso"
-    pesaje    = db.get_ultimo_pesaje()
+    pesaje    = await adb.get_ultimo_pesaje()
     cuerpo_str = ""
     if pesaje:
         try:
@@ -155,7 +160,7 @@ async def _generar_plan_gym(uid, query, context):
         parse_mode="HTML",
     )
     try:
-        perfil = db.get_perfil(uid)
+        perfil = await adb.get_perfil(uid)
         import planner as pl
         plan = pl.generar_plan(
             nivel      = perfil.get("nivel", "intermedio"),
@@ -164,10 +169,10 @@ async def _generar_plan_gym(uid, query, context):
             ambiente   = perfil.get("ambiente_preferido", "gym"),
             limitacion = perfil.get("limitaciones", "ninguna"),
         )
-        n_ej = db.insert_plan(uid, plan, db.get_swaps(uid))
+        n_ej = await adb.insert_plan(uid, plan, await adb.get_swaps(uid))
         primera_sem = plan[0]["semana"]
         primer_dia  = plan[0]["dias"][0]["dia"]
-        db.upsert_estado(uid, primera_sem, primer_dia)
+        await adb.upsert_estado(uid, primera_sem, primer_dia)
         logger.info("Plan generado uid=%s: %d ejercicios, dia=%s", uid, n_ej, primer_dia)
 
         peso  = float(perfil.get("peso_kg_estimado") or 90)
@@ -208,9 +213,9 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
     uid    = update.effective_user.id
     nombre = update.effective_user.first_name or ""
-    db.clear_sesion_activa(uid)
+    await adb.clear_sesion_activa(uid)
 
-    if not db.has_plan(uid):
+    if not await adb.has_plan(uid):
         n = nombre.split()[0] if nombre else "ahí"
         await update.message.reply_text(
             f"Hola {n} 👋  Bienvenido a <b>Coach</b>\n\n"
@@ -253,7 +258,7 @@ async def cmd_login(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await check_auth(update):
         return
     uid   = update.effective_user.id
-    token = db.create_login_token(uid)
+    token = await adb.create_login_token(uid)
     url   = f"{ren.WEB_URL}/auth?token={token}"
     await update.message.reply_text(
         "Toca para entrar a la web 👇\n<i>Válido 5 minutos.</i>",
@@ -291,7 +296,7 @@ async def cmd_adduser(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     if not context.args:
         await update.message.reply_text("Uso: /adduser <id>")
         return
-    db.add_allowed_user(int(context.args[0]))
+    await adb.add_allowed_user(int(context.args[0]))
     await update.message.reply_text(f"✅ {context.args[0]} agregado.")
 
 
@@ -314,19 +319,19 @@ async def handler_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
     if texto in BOTONES:
         accion  = BOTONES[texto]
-        semana, dia = db.get_estado(uid)
+        semana, dia = await adb.get_estado(uid)
 
         if accion == "hoy":
-            sesion = db.get_sesion_activa(uid)
+            sesion = await adb.get_sesion_activa(uid)
             if sesion and sesion["semana"] == semana and sesion["dia"] == dia:
-                txt, kb = ren.render_ejercicio(uid, semana, dia, sesion["ej_idx"])
+                txt, kb = await adb.run(ren.render_ejercicio, uid, semana, dia, sesion["ej_idx"])
             else:
-                txt, kb = ren.rutina_preview(uid, semana, dia)
+                txt, kb = await adb.run(ren.rutina_preview, uid, semana, dia)
             await update.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
 
         elif accion == "cuerpo":
             import cuerpo as corp
-            resumen = corp.get_resumen_cuerpo()
+            resumen = await adb.run(corp.get_resumen_cuerpo)
             if not resumen:
                 await update.message.reply_text(
                     "⚖️ Sin pesajes aún.\nPésate en ayunas (6-9am).",
@@ -352,7 +357,7 @@ async def handler_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
         elif accion == "dieta":
             import nutricion as nut
-            macros = nut.get_macros_hoy(user_id=uid)
+            macros = await adb.run(nut.get_macros_hoy, user_id=uid)
             if not macros:
                 await update.message.reply_text("🥗 Pésate para calcular tus macros.")
             else:
@@ -379,7 +384,7 @@ async def handler_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         return
 
     # Sesión activa esperando peso
-    sesion = db.get_sesion_activa(uid)
+    sesion = await adb.get_sesion_activa(uid)
     if sesion and sesion.get("fase") == "peso":
         try:
             peso = float(texto.replace(",", "."))
@@ -388,14 +393,14 @@ async def handler_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             return
         semana, dia = sesion["semana"], sesion["dia"]
         idx = sesion["ej_idx"]
-        rows = [r for r in db.get_ejercicios_dia(uid, semana, dia) if not r.get("es_cardio")]
+        rows = [r for r in await adb.get_snapshot_sesion(uid, semana, dia) if not r.get("es_cardio")]
         if idx < len(rows) and peso > 0:
             ej = rows[idx]
-            db.save_peso(uid, ej["ejercicio_id"], semana, dia, peso,
-                        ej.get("series"), ej.get("reps"))
+            await adb.save_peso(uid, ej["ejercicio_id"], semana, dia, peso,
+                                ej.get("series"), ej.get("reps"))
         siguiente = idx + 1
-        db.save_sesion_activa(uid, semana, dia, siguiente, "ejercicio")
-        txt, kb = ren.render_ejercicio(uid, semana, dia, siguiente)
+        await adb.save_sesion_activa(uid, semana, dia, siguiente, "ejercicio")
+        txt, kb = await adb.run(ren.render_ejercicio, uid, semana, dia, siguiente)
         await update.message.reply_text(txt, reply_markup=kb, parse_mode="HTML")
         return
 
@@ -410,7 +415,7 @@ async def handler_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         except ValueError:
             await update.message.reply_text("Escribe solo el número de años. Ej: 28")
             return
-        db.upsert_perfil(uid, edad=edad)
+        await adb.upsert_perfil(uid, edad=edad)
         # Pedir peso
         context.user_data["onboard_step"] = "peso"
         await update.message.reply_text(
@@ -453,15 +458,15 @@ async def handler_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
                 parse_mode="HTML"
             )
             return
-        db.upsert_perfil(uid, peso_kg_estimado=peso)
-        perfil = db.get_perfil(uid)
+        await adb.upsert_perfil(uid, peso_kg_estimado=peso)
+        perfil = await adb.get_perfil(uid)
         edad   = int(perfil.get("edad") or 30)
         sexo   = perfil.get("sexo", "hombre")
         altura = 175 if sexo == "hombre" else 163
         bmr    = round(10*peso + 6.25*altura - 5*edad + (5 if sexo=="hombre" else -161))
         tdee   = round(bmr * {"sedentario":1.2,"moderado":1.375,"activo":1.55}.get(
                     perfil.get("actividad_nivel","sedentario"), 1.2))
-        db.upsert_perfil(uid, bmr_estimado=bmr, tdee_estimado=tdee)
+        await adb.upsert_perfil(uid, bmr_estimado=bmr, tdee_estimado=tdee)
         context.user_data["onboard_step"] = None
         await update.message.reply_text(
             f"<b>Peso: {peso} kg ✅</b>\n\nTu gasto estimado: <b>{tdee} kcal/día</b>\n\n"
@@ -482,722 +487,779 @@ async def handler_texto(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 # ══════════════════════════════════════════════════════════════════════════════
 # CALLBACK HANDLER
 # ══════════════════════════════════════════════════════════════════════════════
+# callback_data = "<ruta>:<arg>:<arg>...". callback_router busca la ruta (lo
+# que va antes del primer ':') en _RUTAS con un solo dict lookup y llama a su
+# handler; los :back y demás subacciones los resuelve cada handler. Cada
+# llamada queda en metricas (cuenta + latencia por ruta).
+
+class Callback:
+    """Lo que recibe cada handler de callback."""
+    __slots__ = ("query", "context", "data", "partes", "uid", "nombre", "chat_id", "_estado")
+
+    def __init__(self, query, context):
+        self.query   = query
+        self.context = context
+        self.data    = query.data or ""
+        self.partes  = self.data.split(":")
+        self.uid     = query.from_user.id
+        self.nombre  = query.from_user.first_name or ""
+        self.chat_id = query.message.chat_id
+        self._estado = None
+
+    @property
+    def arg(self) -> str:
+        """Primer argumento después de la ruta ('' si no hay)."""
+        return self.partes[1] if len(self.partes) > 1 else ""
+
+    async def estado(self) -> tuple[int, str]:
+        if self._estado is None:
+            try:
+                self._estado = await adb.get_estado(self.uid)
+            except Exception:
+                self._estado = (1, "lunes")
+        return self._estado
+
+    async def edit(self, text, kb=None, **kw):
+        await self.query.edit_message_text(text, reply_markup=kb,
+                                           parse_mode="HTML",
+                                           disable_web_page_preview=True, **kw)
+
+    async def onboard(self, text, kb):
+        """Edit en el mismo mensaje — rápido e instantáneo."""
+        await self.query.edit_message_text(
+            text, reply_markup=kb, parse_mode="HTML",
+            disable_web_page_preview=True,
+        )
 
-async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    query  = update.callback_query
-    data   = query.data or ""
-    uid    = query.from_user.id
-    nombre = query.from_user.first_name or ""
-
-    if uid not in db.get_allowed_users():
-        await query.answer("Sin acceso.")
-        return
-
-    try:
-        await query.answer()
-    except Exception:
-        pass
-
-    try:
-        semana, dia = db.get_estado(uid)
-    except Exception:
-        semana, dia = 1, "lunes"
-
-    chat_id = query.message.chat_id
-
-    try:
-        # ── HELPERS LOCALES ───────────────────────────────────────────────────
-        async def edit(text, kb=None, **kw):
-            await query.edit_message_text(text, reply_markup=kb,
-                                          parse_mode="HTML",
-                                          disable_web_page_preview=True, **kw)
-
-        async def onboard(text, kb):
-            """Edit en el mismo mensaje — rápido e instantáneo."""
-            await query.edit_message_text(
-                text, reply_markup=kb, parse_mode="HTML",
-                disable_web_page_preview=True,
-            )
-
-        # ── MENÚ PRINCIPAL ────────────────────────────────────────────────────
-        if data.startswith("menu:"):
-            accion = data.split(":")[1]
-
-            if accion == "main":
-                texto = await _menu_texto(uid, nombre)
-                await edit(texto, ren.MENU_PRINCIPAL)
-
-            elif accion == "hoy":
-                sesion = db.get_sesion_activa(uid)
-                if sesion and sesion["semana"] == semana and sesion["dia"] == dia:
-                    txt, kb = ren.render_ejercicio(uid, semana, dia, sesion["ej_idx"])
-                else:
-                    txt, kb = ren.rutina_preview(uid, semana, dia)
-                await edit(txt, kb)
-
-            elif accion == "cuerpo":
-                import cuerpo as corp
-                resumen = corp.get_resumen_cuerpo()
-                if not resumen:
-                    await edit("⚖️ Sin pesajes aún.\nPésate en ayunas (6-9am).", ren.BTN_MENU)
-                else:
-                    mimo  = resumen.get("estado_mimo") or "—"
-                    emoji = {"RECOMPOSICION":"🟣","CUTTING_LIMPIO":"🟢","CATABOLISMO":"🔴","ESTANCAMIENTO":"🟡"}.get(mimo,"⚪")
-                    kg_f  = resumen.get("kg_a_perder", 0)
-                    eta   = resumen.get("semanas_eta", 0)
-                    meta  = f"\nMeta 22%: faltan <b>{kg_f} kg</b> (~{eta} sem)" if kg_f and kg_f > 0 else ""
-                    await edit(
-                        f"⚖️ <b>{resumen['fecha']}</b>  Score: {resumen['score']}/100\n"
-                        f"{emoji} {mimo.replace('_',' ')}\n\n"
-                        f"Peso: {resumen['peso_kg']} kg  |  Grasa: {resumen['grasa_pct']}%\n"
-                        f"Músculo: {resumen['musculo_pct']}%  |  BMR: {resumen['bmr']} kcal{meta}",
-                        InlineKeyboardMarkup([
-                            [InlineKeyboardButton("🌐 Ver tendencia →", url=f"{ren.WEB_URL}/cuerpo")],
-                            [InlineKeyboardButton("🏠 Menú", callback_data="menu:main")],
-                        ])
-                    )
-
-            elif accion == "dieta":
-                import nutricion as nut
-                macros = nut.get_macros_hoy(user_id=uid)
-                if not macros:
-                    await edit("🥗 Pésate para calcular tus macros.", ren.BTN_MENU)
-                else:
-                    nota = f"\n<i>{macros['nota']}</i>" if macros.get("nota") else ""
-                    await edit(
-                        f"🥗 <b>Hoy</b>\n🔥 {macros['calorias']} kcal\n"
-                        f"🥩 {macros['proteina']}g  🍞 {macros['carbs']}g  🥑 {macros['grasas']}g{nota}",
-                        InlineKeyboardMarkup([
-                            [InlineKeyboardButton("🌐 Ver plan →", url=f"{ren.WEB_URL}/nutricion")],
-                            [InlineKeyboardButton("🔄 Regenerar", callback_data="dieta:regenerar")],
-                            [InlineKeyboardButton("🏠 Menú",      callback_data="menu:main")],
-                        ])
-                    )
-
-            elif accion == "nuevo":
-                await edit(
-                    "¿Qué quieres cambiar?",
-                    InlineKeyboardMarkup([
-                        [InlineKeyboardButton("💪 Nueva rutina de gym",  callback_data="reset:gym")],
-                        [InlineKeyboardButton("🥗 Nuevo plan de dieta",  callback_data="reset:dieta")],
-                        [InlineKeyboardButton("🔄 Los dos",              callback_data="reset:todo")],
-                        [InlineKeyboardButton("❌ Cancelar",             callback_data="menu:main")],
-                    ])
-                )
-            return
-
-        # ── RESET ─────────────────────────────────────────────────────────────
-        if data.startswith("reset:"):
-            tipo = data.split(":")[1]
-            if tipo in ("gym", "todo"):
-                db.clear_plan(uid)
-                db.clear_sesion_activa(uid)
-                await onboard(
-                    "<b>Paso 1/8 — ¿Cuál es tu objetivo?</b>\n\nEl plan se ajusta completamente a esto:",
-                    _kb_objetivos()
-                )
-            elif tipo == "dieta":
-                await onboard("🥗 <b>¿Cómo describes tu alimentación?</b>", _kb_dieta())
-            return
-
-        # ── ONBOARDING — NOTA: todos usan onboard() que hace delete+send ──────
-
-        # vida:back ANTES de vida:
-        if data == "vida:back":
-            await onboard(
-                "<b>Paso 1/8 — ¿Cuál es tu objetivo?</b>\n\nEl plan se ajusta completamente a esto:",
-                _kb_objetivos()
-            )
-            return
-
-        if data.startswith("vida:"):
-            objetivo_vida = data.split(":")[1]
-            _, objetivo_gym = OBJETIVOS.get(objetivo_vida, ("", "general"))
-            db.upsert_perfil(uid, objetivo=objetivo_gym, objetivo_vida=objetivo_vida)
-            desc = OBJETIVOS.get(objetivo_vida, ("",))[0]
-            await onboard(
-                f"<b>Paso 2/8</b> — Objetivo: {desc} ✅\n\n<b>¿Cuánto tiempo llevas entrenando con pesas?</b>",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🌱 Menos de 1 año — soy nuevo",     callback_data="niv:principiante")],
-                    [InlineKeyboardButton("💪 1 a 3 años entrenando",          callback_data="niv:intermedio")],
-                    [InlineKeyboardButton("🔥 Más de 3 años — nivel avanzado", callback_data="niv:avanzado")],
-                    [InlineKeyboardButton("← Atrás",                            callback_data="vida:back")],
-                ])
-            )
-            return
+    async def enviar(self, text, kb=None, **kw):
+        await self.context.bot.send_message(chat_id=self.chat_id, text=text,
+                                            reply_markup=kb, **kw)
 
-        # niv:back ANTES de niv:
-        if data == "niv:back":
-            perfil   = db.get_perfil(uid)
-            obj_vida = perfil.get("objetivo_vida", "")
-            desc     = OBJETIVOS.get(obj_vida, ("tu objetivo",))[0]
-            await onboard(
-                f"<b>Paso 2/8</b> — Objetivo: {desc} ✅\n\n<b>¿Cuánto tiempo llevas entrenando?</b>",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🌱 Menos de 1 año — soy nuevo",     callback_data="niv:principiante")],
-                    [InlineKeyboardButton("💪 1 a 3 años entrenando",          callback_data="niv:intermedio")],
-                    [InlineKeyboardButton("🔥 Más de 3 años — nivel avanzado", callback_data="niv:avanzado")],
-                    [InlineKeyboardButton("← Atrás",                            callback_data="vida:back")],
-                ])
-            )
-            return
 
-        if data.startswith("niv:"):
-            nivel = data.split(":")[1]
-            db.upsert_perfil(uid, nivel=nivel)
-            await onboard(
-                "<b>Paso 3/8 — ¿Tienes alguna lesión o limitación?</b>\n\n<i>El plan evita esos ejercicios.</i>",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("✅ Ninguna",                              callback_data="lim:ninguna")],
-                    [InlineKeyboardButton("🦵 Rodilla — evitar sentadilla profunda", callback_data="lim:rodilla")],
-                    [InlineKeyboardButton("🔙 Espalda baja — evitar peso muerto",   callback_data="lim:espalda")],
-                    [InlineKeyboardButton("💪 Hombro — evitar press militar",       callback_data="lim:hombro")],
-                    [InlineKeyboardButton("← Atrás",                                 callback_data="niv:back")],
-                ])
-            )
-            return
+class Ruta:
+    __slots__ = ("handler", "limite", "libres")
 
-        if data.startswith("lim:"):
-            lim = data.split(":")[1]
-            db.upsert_perfil(uid, limitaciones=lim)
-            await onboard(
-                "<b>Paso 4/8 — ¿Dónde entrenas?</b>",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🏋️ Gimnasio — máquinas y barras", callback_data="amb:gym")],
-                    [InlineKeyboardButton("🏠 Casa — peso corporal",          callback_data="amb:home")],
-                    [InlineKeyboardButton("🦺 Casa con banda elástica",       callback_data="amb:band")],
-                    [InlineKeyboardButton("← Atrás",                          callback_data="niv:back")],
-                ])
-            )
-            return
+    def __init__(self, handler, limite=None, libres=()):
+        self.handler = handler
+        self.limite  = limite            # regla de limitador, o None
+        self.libres  = frozenset(libres)  # subacciones (cb.arg) que no gastan límite
 
-        if data.startswith("amb:"):
-            ambiente = data.split(":")[1]
-            db.upsert_perfil(uid, ambiente_preferido=ambiente)
-            await onboard(
-                "<b>Paso 5/8 — ¿Cuántos días a la semana?</b>\n\n<i>4 días es el punto óptimo para la mayoría.</i>",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("3 días", callback_data="dias:3"),
-                     InlineKeyboardButton("4 días", callback_data="dias:4")],
-                    [InlineKeyboardButton("5 días", callback_data="dias:5"),
-                     InlineKeyboardButton("6 días", callback_data="dias:6")],
-                    [InlineKeyboardButton("← Atrás", callback_data="lim:back")],
-                ])
-            )
-            return
 
-        if data.startswith("dias:"):
-            dias_s = data.split(":")[1]
-            if dias_s == "back":
-                perfil = db.get_perfil(uid)
-                lim    = perfil.get("limitaciones", "ninguna")
-                await onboard(
-                    "<b>Paso 4/8 — ¿Dónde entrenas?</b>",
-                    InlineKeyboardMarkup([
-                        [InlineKeyboardButton("🏋️ Gimnasio", callback_data="amb:gym")],
-                        [InlineKeyboardButton("🏠 Casa",      callback_data="amb:home")],
-                        [InlineKeyboardButton("🦺 Banda",     callback_data="amb:band")],
-                        [InlineKeyboardButton("← Atrás",      callback_data="niv:back")],
-                    ])
-                )
-                return
-            db.upsert_perfil(uid, dias=int(dias_s))
-            await onboard(
-                f"<b>Paso 6/8</b> — {dias_s} días ✅\n\n<b>⏰ ¿A qué hora quieres tu recordatorio?</b>",
-                _kb_horario(back_cb="dias:back")
-            )
-            return
+_RUTAS: dict[str, Ruta] = {}
 
-        if data.startswith("horario:"):
-            hora_val = data.split(":")[1]
-            hora     = None if hora_val == "none" else ":".join(data.split(":")[1:])
-            db.upsert_perfil(uid, hora_recordatorio=hora)
-            # Pedir edad exacta — el usuario escribe el número
-            context.user_data["onboard_step"] = "edad"
-            await onboard(
-                "<b>Paso 7/9 — ¿Cuántos años tienes?</b>\n\n"
-                "Escribe tu edad (ej: 28):",
-                InlineKeyboardMarkup([[InlineKeyboardButton("← Atrás", callback_data="horario:back")]])
-            )
-            return
 
-        if data.startswith("peso_est:"):
-            peso = float(data.split(":")[1])
-            db.upsert_perfil(uid, peso_kg_estimado=peso)
-            perfil = db.get_perfil(uid)
-            sexo   = perfil.get("sexo", "hombre")
-            edad   = int(perfil.get("edad") or 30)
-            altura = 175 if sexo == "hombre" else 163
-            bmr    = round(10*peso + 6.25*altura - 5*edad + (5 if sexo=="hombre" else -161))
-            act    = perfil.get("actividad_nivel", "sedentario")
-            factor = {"sedentario":1.2,"moderado":1.375,"activo":1.55}.get(act, 1.2)
-            tdee   = round(bmr * factor)
-            db.upsert_perfil(uid, bmr_estimado=bmr, tdee_estimado=tdee)
-            context.user_data["onboard_step"] = None
-            await onboard(
-                f"<b>Paso 9/9 — Casi listo</b>\n\nTu gasto estimado: <b>{tdee} kcal/día</b>\n\n"
-                "<b>¿Cómo describes tu alimentación?</b>",
-                _kb_dieta(back_cb=None)
-            )
-            return
+def callback(ruta: str, limite: str | None = None, libres=()):
+    """Registra el handler de los callback_data '<ruta>' y '<ruta>:...'."""
+    def registrar(fn):
+        if ruta in _RUTAS:
+            raise ValueError(f"Ruta de callback duplicada: {ruta}")
+        _RUTAS[ruta] = Ruta(fn, limite, libres)
+        return fn
+    return registrar
 
-        # nut:back ANTES de nut:
-        if data == "nut:back":
-            perfil = db.get_perfil(uid)
-            peso   = float(perfil.get("peso_kg_estimado") or 90)
-            await onboard(
-                f"<b>Paso 8/8</b> — Peso: ~{peso}kg ✅\n\n<b>¿Cómo describes tu alimentación?</b>",
-                _kb_dieta(back_cb=None)
-            )
-            return
 
-        if data.startswith("nut:"):
-            tipo = data.split(":")[1]
-            desc = DIETAS.get(tipo, tipo)
-            db.upsert_perfil(uid, tipo_dieta=tipo)
-            context.user_data["alerg_sel"] = set()
-            await onboard(
-                f"<b>Dieta: {desc} ✅</b>\n\n"
-                "<b>¿Hay algo que no puedas comer?</b>\n"
-                "<i>Selecciona todo lo que aplique:</i>",
-                _kb_restricciones(set())
-            )
-            return
+async def callback_router(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    query = update.callback_query
+    data  = query.data or ""
+    uid   = query.from_user.id
 
-        if data.startswith("rtoggle:"):
-            item = data.split(":")[1]
-            sel  = context.user_data.get("alerg_sel", set())
-            if item in sel:
-                sel.discard(item)
-            else:
-                sel.add(item)
-            context.user_data["alerg_sel"] = sel
-            await onboard(
-                "<b>¿Hay algo que no puedas comer?</b>\n"
-                "<i>Selecciona todo lo que aplique:</i>",
-                _kb_restricciones(sel)
-            )
-            return
+    if not db.is_allowed(uid):
+        await query.answer("Sin acceso.")
+        return
 
-        if data == "alerg:otra":
-            context.user_data["onboard_step"] = "alerg_otra"
-            await onboard(
-                "✏️ <b>Escribe tu restricción</b>\n\nEj: sin azúcar, sin soya, diabético",
-                InlineKeyboardMarkup([[InlineKeyboardButton("← Atrás", callback_data="alerg:volver")]])
-            )
-            return
+    clave, _, resto = data.partition(":")
+    ruta = _RUTAS.get(clave)
 
-        if data == "alerg:volver":
-            sel = context.user_data.get("alerg_sel", set())
-            context.user_data["onboard_step"] = None
-            await onboard(
-                "<b>¿Hay algo que no puedas comer?</b>\n<i>Selecciona todo lo que aplique:</i>",
-                _kb_restricciones(sel)
-            )
+    if ruta and ruta.limite and resto.partition(":")[0] not in ruta.libres:
+        espera = limitador.consumir(ruta.limite, uid)
+        if espera:
+            await query.answer(
+                f"⏳ Demasiados intentos. Espera {limitador.texto_espera(espera)}.", show_alert=True)
             return
 
-        if data == "alerg:confirmar":
-            sel   = context.user_data.get("alerg_sel", set())
-            extra = context.user_data.get("alerg_extra", "")
-            todas = list(sel) + ([extra] if extra else [])
-            alerg = ",".join(sorted(todas)) if todas else "ninguna"
-            db.upsert_perfil(uid, alergias=alerg)
-            await onboard(
-                "Cuantame sobre tu alimentacion\n\n"
-                "Cuantas comidas haces al dia?",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("1-2 comidas — ayuno intermitente", callback_data="comidas:ayuno")],
-                    [InlineKeyboardButton("3 comidas normales",               callback_data="comidas:3")],
-                    [InlineKeyboardButton("4-5 comidas pequenas",             callback_data="comidas:5")],
-                    [InlineKeyboardButton("Sin horario fijo",                  callback_data="comidas:flexible")],
-                ])
-            )
-            return
+    try:
+        await query.answer()
+    except Exception:
+        pass
 
-        if data.startswith("comidas:"):
-            patron = data.split(":")[1]
-            if patron == "back":
-                sel = context.user_data.get("alerg_sel", set())
-                await onboard(
-                    "Hay algo que no puedas comer?",
-                    _kb_restricciones(sel)
-                )
-                return
-            db.upsert_perfil(uid, patron_comidas=patron)
-            if patron == "ayuno":
-                await onboard(
-                    "Cual es tu ventana de comida?\n\nEl plan respeta tu protocolo.",
-                    InlineKeyboardMarkup([
-                        [InlineKeyboardButton("12pm-8pm (16:8)", callback_data="ventana:16-8")],
-                        [InlineKeyboardButton("1pm-7pm (18:6)",  callback_data="ventana:18-6")],
-                        [InlineKeyboardButton("2pm-8pm",         callback_data="ventana:18-6b")],
-                        [InlineKeyboardButton("<- Atras",         callback_data="comidas:back")],
-                    ])
-                )
-            else:
-                await onboard(
-                    "A que hora es tu primera comida del dia?",
-                    InlineKeyboardMarkup([
-                        [InlineKeyboardButton("Antes de las 8am",    callback_data="ventana:7am")],
-                        [InlineKeyboardButton("8am - 10am",          callback_data="ventana:9am")],
-                        [InlineKeyboardButton("10am - 12pm",         callback_data="ventana:11am")],
-                        [InlineKeyboardButton("Despues del mediodia", callback_data="ventana:1pm")],
-                        [InlineKeyboardButton("<- Atras",             callback_data="comidas:back")],
-                    ])
-                )
-            return
+    if ruta is None:
+        logger.debug("Callback no manejado: %s", data)
+        metricas.registrar_callback("<sin_ruta>", 0.0)
+        return
 
-        if data.startswith("ventana:"):
-            val = data.split(":")[1]
-            db.upsert_perfil(uid, primera_comida=val)
-            await onboard(
-                "Donde comes la mayoria de tus comidas?",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Cocino en casa casi siempre",   callback_data="donde:casa")],
-                    [InlineKeyboardButton("Mitad en casa, mitad fuera",    callback_data="donde:mixto")],
-                    [InlineKeyboardButton("Como fuera o pido a domicilio", callback_data="donde:fuera")],
-                    [InlineKeyboardButton("<- Atras",                       callback_data="comidas:back")],
-                ])
+    cb = Callback(query, context)
+    t0 = time.perf_counter()
+    ok = True
+    try:
+        await ruta.handler(cb)
+    except Exception as e:
+        err = str(e)
+        if "Message is not modified" in err:
+            return  # silencioso — contenido ya correcto
+        ok = False
+        logger.error("callback error [%s] uid=%s: %s", data, uid, e, exc_info=True)
+        try:
+            await context.bot.send_message(
+                chat_id = cb.chat_id,
+                text    = f"❌ Error. Escribe /start para continuar.\n<code>{err[:100]}</code>",
+                parse_mode = "HTML",
             )
-            return
-
-        if data.startswith("donde:"):
-            donde = data.split(":")[1]
-            if donde == "back":
-                await onboard(
-                    "A que hora es tu primera comida?",
-                    InlineKeyboardMarkup([
-                        [InlineKeyboardButton("Antes de las 8am",    callback_data="ventana:7am")],
-                        [InlineKeyboardButton("8am - 10am",          callback_data="ventana:9am")],
-                        [InlineKeyboardButton("10am - 12pm",         callback_data="ventana:11am")],
-                        [InlineKeyboardButton("Despues del mediodia", callback_data="ventana:1pm")],
-                        [InlineKeyboardButton("<- Atras",             callback_data="comidas:back")],
-                    ])
-                )
-                return
-            db.upsert_perfil(uid, donde_come=donde)
-            await onboard(
-                "Que tipo de cocina disfrutas mas?\n\n"
-                "El plan usara recetas de tu cocina favorita.",
+        except Exception:
+            pass
+    finally:
+        metricas.registrar_callback(clave, time.perf_counter() - t0, ok)
+
+
+# ── MENÚ PRINCIPAL ────────────────────────────────────────────────────────────
+
+@callback("menu")
+async def _cb_menu(cb: Callback) -> None:
+    uid, accion = cb.uid, cb.arg
+
+    if accion == "main":
+        texto = await _menu_texto(uid, cb.nombre)
+        await cb.edit(texto, ren.MENU_PRINCIPAL)
+
+    elif accion == "hoy":
+        semana, dia = await cb.estado()
+        sesion = await adb.get_sesion_activa(uid)
+        if sesion and sesion["semana"] == semana and sesion["dia"] == dia:
+            txt, kb = await adb.run(ren.render_ejercicio, uid, semana, dia, sesion["ej_idx"])
+        else:
+            txt, kb = await adb.run(ren.rutina_preview, uid, semana, dia)
+        await cb.edit(txt, kb)
+
+    elif accion == "cuerpo":
+        import cuerpo as corp
+        resumen = await adb.run(corp.get_resumen_cuerpo)
+        if not resumen:
+            await cb.edit("⚖️ Sin pesajes aún.\nPésate en ayunas (6-9am).", ren.BTN_MENU)
+        else:
+            mimo  = resumen.get("estado_mimo") or "—"
+            emoji = {"RECOMPOSICION":"🟣","CUTTING_LIMPIO":"🟢","CATABOLISMO":"🔴","ESTANCAMIENTO":"🟡"}.get(mimo,"⚪")
+            kg_f  = resumen.get("kg_a_perder", 0)
+            eta   = resumen.get("semanas_eta", 0)
+            meta  = f"\nMeta 22%: faltan <b>{kg_f} kg</b> (~{eta} sem)" if kg_f and kg_f > 0 else ""
+            await cb.edit(
+                f"⚖️ <b>{resumen['fecha']}</b>  Score: {resumen['score']}/100\n"
+                f"{emoji} {mimo.replace('_',' ')}\n\n"
+                f"Peso: {resumen['peso_kg']} kg  |  Grasa: {resumen['grasa_pct']}%\n"
+                f"Músculo: {resumen['musculo_pct']}%  |  BMR: {resumen['bmr']} kcal{meta}",
                 InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Mexicana / Latina",         callback_data="cocina:mexicana")],
-                    [InlineKeyboardButton("Italiana / Mediterranea",   callback_data="cocina:mediterranea")],
-                    [InlineKeyboardButton("Asiatica",                  callback_data="cocina:asiatica")],
-                    [InlineKeyboardButton("Americana / Parrilla",      callback_data="cocina:americana")],
-                    [InlineKeyboardButton("Variada — me gusta de todo",callback_data="cocina:variada")],
-                    [InlineKeyboardButton("<- Atras",                   callback_data="donde:back")],
+                    [InlineKeyboardButton("🌐 Ver tendencia →", url=f"{ren.WEB_URL}/cuerpo")],
+                    [InlineKeyboardButton("🏠 Menú", callback_data="menu:main")],
                 ])
             )
-            return
 
-        if data == "cocina:back":
-            await onboard(
-                "Donde comes la mayoria de tus comidas?",
+    elif accion == "dieta":
+        import nutricion as nut
+        macros = await adb.run(nut.get_macros_hoy, user_id=uid)
+        if not macros:
+            await cb.edit("🥗 Pésate para calcular tus macros.", ren.BTN_MENU)
+        else:
+            nota = f"\n<i>{macros['nota']}</i>" if macros.get("nota") else ""
+            await cb.edit(
+                f"🥗 <b>Hoy</b>\n🔥 {macros['calorias']} kcal\n"
+                f"🥩 {macros['proteina']}g  🍞 {macros['carbs']}g  🥑 {macros['grasas']}g{nota}",
                 InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Cocino en casa casi siempre",   callback_data="donde:casa")],
-                    [InlineKeyboardButton("Mitad en casa, mitad fuera",    callback_data="donde:mixto")],
-                    [InlineKeyboardButton("Como fuera o pido a domicilio", callback_data="donde:fuera")],
+                    [InlineKeyboardButton("🌐 Ver plan →", url=f"{ren.WEB_URL}/nutricion")],
+                    [InlineKeyboardButton("🔄 Regenerar", callback_data="dieta:regenerar")],
+                    [InlineKeyboardButton("🏠 Menú",      callback_data="menu:main")],
                 ])
             )
-            return
 
+    elif accion == "nuevo":
+        await cb.edit(
+            "¿Qué quieres cambiar?",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("💪 Nueva rutina de gym",  callback_data="reset:gym")],
+                [InlineKeyboardButton("🥗 Nuevo plan de dieta",  callback_data="reset:dieta")],
+                [InlineKeyboardButton("🔄 Los dos",              callback_data="reset:todo")],
+                [InlineKeyboardButton("❌ Cancelar",             callback_data="menu:main")],
+            ])
+        )
 
-        if data.startswith("cocina:"):
-            cocina = data.split(":")[1]
-            db.upsert_perfil(uid, cocina_preferida=cocina)
-            await onboard(
-                "Tomas algun suplemento actualmente?\n\n"
-                "Gemini lo considera en el plan nutricional.",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Ninguno",              callback_data="suple:ninguno")],
-                    [InlineKeyboardButton("Proteina whey",        callback_data="suple:whey")],
-                    [InlineKeyboardButton("Creatina",             callback_data="suple:creatina")],
-                    [InlineKeyboardButton("Proteina + Creatina",  callback_data="suple:whey_creatina")],
-                    [InlineKeyboardButton("Multivitaminico",      callback_data="suple:multi")],
-                    [InlineKeyboardButton("Otros suplementos",    callback_data="suple:otros")],
-                    [InlineKeyboardButton("<- Atras",              callback_data="cocina:back")],
-                ])
-            )
-            return
+# ── RESET ─────────────────────────────────────────────────────────────────────
+
+@callback("reset")
+async def _cb_reset(cb: Callback) -> None:
+    tipo = cb.arg
+    if tipo in ("gym", "todo"):
+        await adb.clear_plan(cb.uid)
+        await adb.clear_sesion_activa(cb.uid)
+        await cb.onboard(
+            "<b>Paso 1/8 — ¿Cuál es tu objetivo?</b>\n\nEl plan se ajusta completamente a esto:",
+            _kb_objetivos()
+        )
+    elif tipo == "dieta":
+        await cb.onboard("🥗 <b>¿Cómo describes tu alimentación?</b>", _kb_dieta())
 
+# ── ONBOARDING ────────────────────────────────────────────────────────────────
 
-        if data.startswith("suple:"):
-            suple = data.split(":")[1]
-            if suple == "back":
-                await onboard(
-                    "Que tipo de cocina disfrutas mas?",
-                    InlineKeyboardMarkup([
-                        [InlineKeyboardButton("Mexicana / Latina",         callback_data="cocina:mexicana")],
-                        [InlineKeyboardButton("Italiana / Mediterranea",   callback_data="cocina:mediterranea")],
-                        [InlineKeyboardButton("Asiatica",                  callback_data="cocina:asiatica")],
-                        [InlineKeyboardButton("Americana / Parrilla",      callback_data="cocina:americana")],
-                        [InlineKeyboardButton("Variada",                   callback_data="cocina:variada")],
-                    ])
-                )
-                return
-            db.upsert_perfil(uid, suplementos=suple)
-            await onboard(
-                "Consumes alcohol?\n\n"
-                "El alcohol tiene calorias que afectan la composicion corporal.",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("No consumo alcohol",             callback_data="alcohol:no")],
-                    [InlineKeyboardButton("Ocasional — 1-2 veces al mes",  callback_data="alcohol:ocasional")],
-                    [InlineKeyboardButton("Moderado — fines de semana",    callback_data="alcohol:moderado")],
-                    [InlineKeyboardButton("Frecuente — varias veces/sem",  callback_data="alcohol:frecuente")],
-                    [InlineKeyboardButton("<- Atras",                        callback_data="suple:back")],
-                ])
-            )
-            return
+@callback("vida")
+async def _cb_vida(cb: Callback) -> None:
+    if cb.arg == "back":
+        await cb.onboard(
+            "<b>Paso 1/8 — ¿Cuál es tu objetivo?</b>\n\nEl plan se ajusta completamente a esto:",
+            _kb_objetivos()
+        )
+        return
+    objetivo_vida = cb.arg
+    _, objetivo_gym = OBJETIVOS.get(objetivo_vida, ("", "general"))
+    await adb.upsert_perfil(cb.uid, objetivo=objetivo_gym, objetivo_vida=objetivo_vida)
+    desc = OBJETIVOS.get(objetivo_vida, ("",))[0]
+    await cb.onboard(
+        f"<b>Paso 2/8</b> — Objetivo: {desc} ✅\n\n<b>¿Cuánto tiempo llevas entrenando con pesas?</b>",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("🌱 Menos de 1 año — soy nuevo",     callback_data="niv:principiante")],
+            [InlineKeyboardButton("💪 1 a 3 años entrenando",          callback_data="niv:intermedio")],
+            [InlineKeyboardButton("🔥 Más de 3 años — nivel avanzado", callback_data="niv:avanzado")],
+            [InlineKeyboardButton("← Atrás",                            callback_data="vida:back")],
+        ])
+    )
 
-        if data.startswith("alcohol:"):
-            nivel = data.split(":")[1]
-            db.upsert_perfil(uid, alcohol=nivel)
-            await _generar_plan_gym(uid, query, context)
-            return
+@callback("niv")
+async def _cb_niv(cb: Callback) -> None:
+    if cb.arg == "back":
+        perfil   = await adb.get_perfil(cb.uid)
+        obj_vida = perfil.get("objetivo_vida", "")
+        desc     = OBJETIVOS.get(obj_vida, ("tu objetivo",))[0]
+        await cb.onboard(
+            f"<b>Paso 2/8</b> — Objetivo: {desc} ✅\n\n<b>¿Cuánto tiempo llevas entrenando?</b>",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("🌱 Menos de 1 año — soy nuevo",     callback_data="niv:principiante")],
+                [InlineKeyboardButton("💪 1 a 3 años entrenando",          callback_data="niv:intermedio")],
+                [InlineKeyboardButton("🔥 Más de 3 años — nivel avanzado", callback_data="niv:avanzado")],
+                [InlineKeyboardButton("← Atrás",                            callback_data="vida:back")],
+            ])
+        )
+        return
+    await adb.upsert_perfil(cb.uid, nivel=cb.arg)
+    await cb.onboard(
+        "<b>Paso 3/8 — ¿Tienes alguna lesión o limitación?</b>\n\n<i>El plan evita esos ejercicios.</i>",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Ninguna",                              callback_data="lim:ninguna")],
+            [InlineKeyboardButton("🦵 Rodilla — evitar sentadilla profunda", callback_data="lim:rodilla")],
+            [InlineKeyboardButton("🔙 Espalda baja — evitar peso muerto",   callback_data="lim:espalda")],
+            [InlineKeyboardButton("💪 Hombro — evitar press militar",       callback_data="lim:hombro")],
+            [InlineKeyboardButton("← Atrás",                                 callback_data="niv:back")],
+        ])
+    )
 
-        if data.startswith("alerg:"):
-            alerg = data.split(":")[1]
-            db.upsert_perfil(uid, alergias=alerg)
-            # Generar plan directamente
-            await _generar_plan_gym(uid, query, context)
-            return
+@callback("lim")
+async def _cb_lim(cb: Callback) -> None:
+    await adb.upsert_perfil(cb.uid, limitaciones=cb.arg)
+    await cb.onboard(
+        "<b>Paso 4/8 — ¿Dónde entrenas?</b>",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("🏋️ Gimnasio — máquinas y barras", callback_data="amb:gym")],
+            [InlineKeyboardButton("🏠 Casa — peso corporal",          callback_data="amb:home")],
+            [InlineKeyboardButton("🦺 Casa con banda elástica",       callback_data="amb:band")],
+            [InlineKeyboardButton("← Atrás",                          callback_data="niv:back")],
+        ])
+    )
 
-        # ── DIETA REGENERAR ───────────────────────────────────────────────────
-        if data == "dieta:regenerar":
-            await onboard("🥗 <b>¿Cómo describes tu alimentación?</b>", _kb_dieta())
-            return
+@callback("amb")
+async def _cb_amb(cb: Callback) -> None:
+    await adb.upsert_perfil(cb.uid, ambiente_preferido=cb.arg)
+    await cb.onboard(
+        "<b>Paso 5/8 — ¿Cuántos días a la semana?</b>\n\n<i>4 días es el punto óptimo para la mayoría.</i>",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("3 días", callback_data="dias:3"),
+             InlineKeyboardButton("4 días", callback_data="dias:4")],
+            [InlineKeyboardButton("5 días", callback_data="dias:5"),
+             InlineKeyboardButton("6 días", callback_data="dias:6")],
+            [InlineKeyboardButton("← Atrás", callback_data="lim:back")],
+        ])
+    )
 
-        # ── EJERCICIO POR EJERCICIO ───────────────────────────────────────────
-        if data.startswith("ej_start:"):
-            _, sem_s, dia_s = data.split(":")
-            sem = int(sem_s)
-            db.save_sesion_activa(uid, sem, dia_s, 0, "ejercicio")
-            txt, kb = ren.render_ejercicio(uid, sem, dia_s, 0)
-            await edit(txt, kb)
-            return
+@callback("dias")
+async def _cb_dias(cb: Callback) -> None:
+    dias_s = cb.arg
+    if dias_s == "back":
+        await cb.onboard(
+            "<b>Paso 4/8 — ¿Dónde entrenas?</b>",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("🏋️ Gimnasio", callback_data="amb:gym")],
+                [InlineKeyboardButton("🏠 Casa",      callback_data="amb:home")],
+                [InlineKeyboardButton("🦺 Banda",     callback_data="amb:band")],
+                [InlineKeyboardButton("← Atrás",      callback_data="niv:back")],
+            ])
+        )
+        return
+    await adb.upsert_perfil(cb.uid, dias=int(dias_s))
+    await cb.onboard(
+        f"<b>Paso 6/8</b> — {dias_s} días ✅\n\n<b>⏰ ¿A qué hora quieres tu recordatorio?</b>",
+        _kb_horario(back_cb="dias:back")
+    )
 
-        if data.startswith("ej_resume:"):
-            _, sem_s, dia_s, idx_s = data.split(":")
-            txt, kb = ren.render_ejercicio(uid, int(sem_s), dia_s, int(idx_s))
-            await edit(txt, kb)
-            return
+@callback("horario")
+async def _cb_horario(cb: Callback) -> None:
+    hora = None if cb.arg == "none" else ":".join(cb.partes[1:])
+    await adb.upsert_perfil(cb.uid, hora_recordatorio=hora)
+    # Pedir edad exacta — el usuario escribe el número
+    cb.context.user_data["onboard_step"] = "edad"
+    await cb.onboard(
+        "<b>Paso 7/9 — ¿Cuántos años tienes?</b>\n\n"
+        "Escribe tu edad (ej: 28):",
+        InlineKeyboardMarkup([[InlineKeyboardButton("← Atrás", callback_data="horario:back")]])
+    )
 
-        if data.startswith("ej_hecho:"):
-            _, sem_s, dia_s, idx_s = data.split(":")
-            sem = int(sem_s); idx = int(idx_s)
-            db.save_sesion_activa(uid, sem, dia_s, idx+1, "ejercicio")
-            txt, kb = ren.render_ejercicio(uid, sem, dia_s, idx+1)
-            await edit(txt, kb)
-            return
+@callback("peso_est")
+async def _cb_peso_est(cb: Callback) -> None:
+    uid  = cb.uid
+    peso = float(cb.arg)
+    await adb.upsert_perfil(uid, peso_kg_estimado=peso)
+    perfil = await adb.get_perfil(uid)
+    sexo   = perfil.get("sexo", "hombre")
+    edad   = int(perfil.get("edad") or 30)
+    altura = 175 if sexo == "hombre" else 163
+    bmr    = round(10*peso + 6.25*altura - 5*edad + (5 if sexo=="hombre" else -161))
+    act    = perfil.get("actividad_nivel", "sedentario")
+    factor = {"sedentario":1.2,"moderado":1.375,"activo":1.55}.get(act, 1.2)
+    tdee   = round(bmr * factor)
+    await adb.upsert_perfil(uid, bmr_estimado=bmr, tdee_estimado=tdee)
+    cb.context.user_data["onboard_step"] = None
+    await cb.onboard(
+        f"<b>Paso 9/9 — Casi listo</b>\n\nTu gasto estimado: <b>{tdee} kcal/día</b>\n\n"
+        "<b>¿Cómo describes tu alimentación?</b>",
+        _kb_dieta(back_cb=None)
+    )
 
-        if data.startswith("ej_done:"):
-            _, sem_s, dia_s = data.split(":")
-            sem = int(sem_s)
-            db.clear_sesion_activa(uid)
-            with db.get_db() as conn:
-                conn.execute("UPDATE rutinas SET completado=1 WHERE user_id=? AND semana=? AND dia=?",
-                             (uid, sem, dia_s))
-            resultado = gam.procesar_fin_sesion(uid, sem, dia_s, "si", _grupo_del_dia(uid, sem, dia_s))
-            msg_wow   = ren.msg_fin_sesion(resultado)
-            kb_feed   = InlineKeyboardMarkup([
-                [InlineKeyboardButton("🔥 Sin reserva",    callback_data=f"sesion:{sem}:{dia_s}:0:5")],
-                [InlineKeyboardButton("💪 Bien",           callback_data=f"sesion:{sem}:{dia_s}:2:3")],
-                [InlineKeyboardButton("😌 Fácil",          callback_data=f"sesion:{sem}:{dia_s}:3:2")],
-                [InlineKeyboardButton("😓 Muy cansado",    callback_data=f"sesion:{sem}:{dia_s}:2:4")],
-            ])
-            try:
-                await edit(msg_wow + "\n\n<b>¿Cómo estuvo?</b>", kb_feed)
-            except Exception:
-                await context.bot.send_message(chat_id=chat_id,
-                    text=msg_wow + "\n\n<b>¿Cómo estuvo?</b>",
-                    reply_markup=kb_feed, parse_mode="HTML")
-            return
+@callback("nut")
+async def _cb_nut(cb: Callback) -> None:
+    if cb.arg == "back":
+        perfil = await adb.get_perfil(cb.uid)
+        peso   = float(perfil.get("peso_kg_estimado") or 90)
+        await cb.onboard(
+            f"<b>Paso 8/8</b> — Peso: ~{peso}kg ✅\n\n<b>¿Cómo describes tu alimentación?</b>",
+            _kb_dieta(back_cb=None)
+        )
+        return
+    tipo = cb.arg
+    desc = DIETAS.get(tipo, tipo)
+    await adb.upsert_perfil(cb.uid, tipo_dieta=tipo)
+    cb.context.user_data["alerg_sel"] = set()
+    await cb.onboard(
+        f"<b>Dieta: {desc} ✅</b>\n\n"
+        "<b>¿Hay algo que no puedas comer?</b>\n"
+        "<i>Selecciona todo lo que aplique:</i>",
+        _kb_restricciones(set())
+    )
 
-        if data.startswith("sesion:"):
-            parts  = data.split(":")
-            sem, dia_s, rir, fatiga = int(parts[1]), parts[2], int(parts[3]), int(parts[4])
-            db.save_progreso_sesion(uid, sem, dia_s, rir=rir, fatiga=fatiga)
-            nueva_sem, nuevo_dia = db.avanzar_dia(uid, sem, dia_s)
-            db.upsert_estado(uid, nueva_sem, nuevo_dia)
-            racha = gam.get_racha(uid)
-            kb_fin = InlineKeyboardMarkup([
-                [InlineKeyboardButton("💪 Siguiente sesión", callback_data="menu:hoy")],
-                [InlineKeyboardButton("🌐 Ver progreso →",   url=ren.WEB_URL)],
-                [InlineKeyboardButton("🏠 Menú",            callback_data="menu:main")],
-            ])
-            fin_txt = f"💾 Guardado.{'  🔥 ' + str(racha) + ' días de racha' if racha >= 3 else ''}"
-            try:
-                await edit(fin_txt, kb_fin)
-            except Exception:
-                await context.bot.send_message(chat_id=chat_id, text=fin_txt, reply_markup=kb_fin)
-            return
+@callback("rtoggle")
+async def _cb_rtoggle(cb: Callback) -> None:
+    item = cb.arg
+    sel  = cb.context.user_data.get("alerg_sel", set())
+    if item in sel:
+        sel.discard(item)
+    else:
+        sel.add(item)
+    cb.context.user_data["alerg_sel"] = sel
+    await cb.onboard(
+        "<b>¿Hay algo que no puedas comer?</b>\n"
+        "<i>Selecciona todo lo que aplique:</i>",
+        _kb_restricciones(sel)
+    )
 
-        if data.startswith("sueño:"):
-            _, sem_s, dia_s, horas_s = data.split(":")
-            horas = float(horas_s)
-            if horas > 0:
-                db.upsert_perfil(uid, sueño_horas=horas)
-            aviso = ""
-            if horas and horas < 6:
-                aviso = "\n\n⚠️ Menos de 6h afecta tu recuperación. Prioriza dormir hoy."
-            racha = gam.get_racha(uid)
-            try:
-                await edit(
-                    f"✅ Registrado.{aviso}\n\n"
-                    f"{'🔥 ' + str(racha) + ' días — ' if racha >= 3 else ''}"
-                    "El análisis llega esta noche 🧠",
-                    InlineKeyboardMarkup([
-                        [InlineKeyboardButton("💪 Siguiente", callback_data="menu:hoy")],
-                        [InlineKeyboardButton("🏠 Menú",      callback_data="menu:main")],
-                    ])
-                )
-            except Exception:
-                pass
-            return
+# alerg:<alergia> genera el plan; otra/volver/confirmar solo navegan
+@callback("alerg", limite="plan", libres=("otra", "volver", "confirmar"))
+async def _cb_alerg(cb: Callback) -> None:
+    user_data = cb.context.user_data
+    if cb.arg == "otra":
+        user_data["onboard_step"] = "alerg_otra"
+        await cb.onboard(
+            "✏️ <b>Escribe tu restricción</b>\n\nEj: sin azúcar, sin soya, diabético",
+            InlineKeyboardMarkup([[InlineKeyboardButton("← Atrás", callback_data="alerg:volver")]])
+        )
+        return
 
-        # ── SWAP ─────────────────────────────────────────────────────────────
-        if data.startswith("swp_ask:"):
-            parts  = data.split(":")
-            eid, sem_s, dia_s = parts[1], parts[2], parts[3]
-            pagina = int(parts[4]) if len(parts) > 4 else 0
-            perfil = db.get_perfil(uid)
-            ej_row = db.fetchone("SELECT grupo, rol FROM rutinas WHERE user_id=? AND ejercicio_id=?", (uid, eid))
-            if not ej_row:
-                return
-            alts = [
-                {"id": e.id, "nombre": e.nombre, "emg_score": e.emg_score}
-                for e in cat.CATALOG
-                if e.grupo == ej_row["grupo"] and e.rol == ej_row["rol"]
-                and e.id != eid and perfil.get("ambiente_preferido","gym") in e.ambiente
-            ]
-            txt, kb = ren.render_swap(eid, int(sem_s), dia_s, alts, pagina)
-            await edit(txt, kb)
-            return
+    if cb.arg == "volver":
+        sel = user_data.get("alerg_sel", set())
+        user_data["onboard_step"] = None
+        await cb.onboard(
+            "<b>¿Hay algo que no puedas comer?</b>\n<i>Selecciona todo lo que aplique:</i>",
+            _kb_restricciones(sel)
+        )
+        return
 
-        if data.startswith("swp_do:"):
-            _, id_orig, id_nuevo, sem_s, dia_s = data.split(":")
-            ej_new  = cat.BY_ID.get(id_nuevo)
-            ej_orig = cat.BY_ID.get(id_orig)
-            if ej_new and ej_orig:
-                with db.get_db() as conn:
-                    conn.execute(
-                        "UPDATE rutinas SET ejercicio_id=?, ejercicio=?, patron=? WHERE user_id=? AND ejercicio_id=?",
-                        (id_nuevo, ej_new.nombre, ej_new.patron, uid, id_orig)
-                    )
-                db.save_swap(uid, id_orig, id_nuevo, ej_orig.grupo, ej_orig.rol)
-                sesion = db.get_sesion_activa(uid)
-                if sesion:
-                    txt, kb = ren.render_ejercicio(uid, int(sem_s), dia_s, sesion["ej_idx"])
-                else:
-                    txt, kb = ren.rutina_preview(uid, int(sem_s), dia_s)
-                await edit(f"✅ {ej_new.nombre} reemplaza a {ej_orig.nombre}\n\n{txt}", kb)
-            return
+    if cb.arg == "confirmar":
+        sel   = user_data.get("alerg_sel", set())
+        extra = user_data.get("alerg_extra", "")
+        todas = list(sel) + ([extra] if extra else [])
+        alerg = ",".join(sorted(todas)) if todas else "ninguna"
+        await adb.upsert_perfil(cb.uid, alergias=alerg)
+        await cb.onboard(
+            "Cuantame sobre tu alimentacion\n\n"
+            "Cuantas comidas haces al dia?",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("1-2 comidas — ayuno intermitente", callback_data="comidas:ayuno")],
+                [InlineKeyboardButton("3 comidas normales",               callback_data="comidas:3")],
+                [InlineKeyboardButton("4-5 comidas pequenas",             callback_data="comidas:5")],
+                [InlineKeyboardButton("Sin horario fijo",                  callback_data="comidas:flexible")],
+            ])
+        )
+        return
 
-        if data.startswith("swp_cancel:"):
-            _, sem_s, dia_s = data.split(":")
-            sesion = db.get_sesion_activa(uid)
-            if sesion:
-                txt, kb = ren.render_ejercicio(uid, int(sem_s), dia_s, sesion["ej_idx"])
-            else:
-                txt, kb = ren.rutina_preview(uid, int(sem_s), dia_s)
-            await edit(txt, kb)
-            return
+    await adb.upsert_perfil(cb.uid, alergias=cb.arg)
+    # Generar plan directamente
+    await _generar_plan_gym(cb.uid, cb.query, cb.context)
+
+@callback("comidas")
+async def _cb_comidas(cb: Callback) -> None:
+    patron = cb.arg
+    if patron == "back":
+        sel = cb.context.user_data.get("alerg_sel", set())
+        await cb.onboard(
+            "Hay algo que no puedas comer?",
+            _kb_restricciones(sel)
+        )
+        return
+    await adb.upsert_perfil(cb.uid, patron_comidas=patron)
+    if patron == "ayuno":
+        await cb.onboard(
+            "Cual es tu ventana de comida?\n\nEl plan respeta tu protocolo.",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("12pm-8pm (16:8)", callback_data="ventana:16-8")],
+                [InlineKeyboardButton("1pm-7pm (18:6)",  callback_data="ventana:18-6")],
+                [InlineKeyboardButton("2pm-8pm",         callback_data="ventana:18-6b")],
+                [InlineKeyboardButton("<- Atras",         callback_data="comidas:back")],
+            ])
+        )
+    else:
+        await cb.onboard(
+            "A que hora es tu primera comida del dia?",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("Antes de las 8am",    callback_data="ventana:7am")],
+                [InlineKeyboardButton("8am - 10am",          callback_data="ventana:9am")],
+                [InlineKeyboardButton("10am - 12pm",         callback_data="ventana:11am")],
+                [InlineKeyboardButton("Despues del mediodia", callback_data="ventana:1pm")],
+                [InlineKeyboardButton("<- Atras",             callback_data="comidas:back")],
+            ])
+        )
 
-        # ── SKIP DAY ──────────────────────────────────────────────────────────
-        if data.startswith("skip_day:"):
-            _, sem_s, dia_s = data.split(":")
-            db.clear_sesion_activa(uid)
-            nueva_sem, nuevo_dia = db.avanzar_dia(uid, int(sem_s), dia_s)
-            db.upsert_estado(uid, nueva_sem, nuevo_dia)
-            texto_m = await _menu_texto(uid, nombre)
-            await edit(f"Día saltado 👍\n\n{texto_m}", ren.MENU_PRINCIPAL)
-            return
+@callback("ventana")
+async def _cb_ventana(cb: Callback) -> None:
+    await adb.upsert_perfil(cb.uid, primera_comida=cb.arg)
+    await cb.onboard(
+        "Donde comes la mayoria de tus comidas?",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("Cocino en casa casi siempre",   callback_data="donde:casa")],
+            [InlineKeyboardButton("Mitad en casa, mitad fuera",    callback_data="donde:mixto")],
+            [InlineKeyboardButton("Como fuera o pido a domicilio", callback_data="donde:fuera")],
+            [InlineKeyboardButton("<- Atras",                       callback_data="comidas:back")],
+        ])
+    )
 
-        # ── AYUDA ─────────────────────────────────────────────────────────────
-        if data == "ver_ayuda":
-            await edit(
-                "❓ <b>¿Qué necesitas?</b>\n\n"
-                "<code>/start</code> — Menú principal\n"
-                "<code>/login</code> — Entrar a la web\n"
-                "<code>/sethorario</code> — Cambiar recordatorio\n"
-                "<code>/reset_plan</code> — Cambiar rutina o dieta",
-                ren.AYUDA_KB
-            )
-            return
+@callback("donde")
+async def _cb_donde(cb: Callback) -> None:
+    donde = cb.arg
+    if donde == "back":
+        await cb.onboard(
+            "A que hora es tu primera comida?",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("Antes de las 8am",    callback_data="ventana:7am")],
+                [InlineKeyboardButton("8am - 10am",          callback_data="ventana:9am")],
+                [InlineKeyboardButton("10am - 12pm",         callback_data="ventana:11am")],
+                [InlineKeyboardButton("Despues del mediodia", callback_data="ventana:1pm")],
+                [InlineKeyboardButton("<- Atras",             callback_data="comidas:back")],
+            ])
+        )
+        return
+    await adb.upsert_perfil(cb.uid, donde_come=donde)
+    await cb.onboard(
+        "Que tipo de cocina disfrutas mas?\n\n"
+        "El plan usara recetas de tu cocina favorita.",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("Mexicana / Latina",         callback_data="cocina:mexicana")],
+            [InlineKeyboardButton("Italiana / Mediterranea",   callback_data="cocina:mediterranea")],
+            [InlineKeyboardButton("Asiatica",                  callback_data="cocina:asiatica")],
+            [InlineKeyboardButton("Americana / Parrilla",      callback_data="cocina:americana")],
+            [InlineKeyboardButton("Variada — me gusta de todo",callback_data="cocina:variada")],
+            [InlineKeyboardButton("<- Atras",                   callback_data="donde:back")],
+        ])
+    )
 
-        if data == "ayuda:horario":
-            await edit("⏰ ¿A qué hora quieres el recordatorio?", _kb_horario(back_cb="ver_ayuda"))
-            return
+@callback("cocina")
+async def _cb_cocina(cb: Callback) -> None:
+    if cb.arg == "back":
+        await cb.onboard(
+            "Donde comes la mayoria de tus comidas?",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("Cocino en casa casi siempre",   callback_data="donde:casa")],
+                [InlineKeyboardButton("Mitad en casa, mitad fuera",    callback_data="donde:mixto")],
+                [InlineKeyboardButton("Como fuera o pido a domicilio", callback_data="donde:fuera")],
+            ])
+        )
+        return
+    await adb.upsert_perfil(cb.uid, cocina_preferida=cb.arg)
+    await cb.onboard(
+        "Tomas algun suplemento actualmente?\n\n"
+        "Gemini lo considera en el plan nutricional.",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("Ninguno",              callback_data="suple:ninguno")],
+            [InlineKeyboardButton("Proteina whey",        callback_data="suple:whey")],
+            [InlineKeyboardButton("Creatina",             callback_data="suple:creatina")],
+            [InlineKeyboardButton("Proteina + Creatina",  callback_data="suple:whey_creatina")],
+            [InlineKeyboardButton("Multivitaminico",      callback_data="suple:multi")],
+            [InlineKeyboardButton("Otros suplementos",    callback_data="suple:otros")],
+            [InlineKeyboardButton("<- Atras",              callback_data="cocina:back")],
+        ])
+    )
 
-        if data == "ayuda:login":
-            token = db.create_login_token(uid)
-            url   = f"{ren.WEB_URL}/auth?token={token}"
-            await edit(
-                "Toca para entrar 👇\n<i>Válido 5 minutos.</i>",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🌐 Entrar", url=url)],
-                    [InlineKeyboardButton("← Atrás",   callback_data="ver_ayuda")],
-                ])
-            )
-            return
+@callback("suple")
+async def _cb_suple(cb: Callback) -> None:
+    suple = cb.arg
+    if suple == "back":
+        await cb.onboard(
+            "Que tipo de cocina disfrutas mas?",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("Mexicana / Latina",         callback_data="cocina:mexicana")],
+                [InlineKeyboardButton("Italiana / Mediterranea",   callback_data="cocina:mediterranea")],
+                [InlineKeyboardButton("Asiatica",                  callback_data="cocina:asiatica")],
+                [InlineKeyboardButton("Americana / Parrilla",      callback_data="cocina:americana")],
+                [InlineKeyboardButton("Variada",                   callback_data="cocina:variada")],
+            ])
+        )
+        return
+    await adb.upsert_perfil(cb.uid, suplementos=suple)
+    await cb.onboard(
+        "Consumes alcohol?\n\n"
+        "El alcohol tiene calorias que afectan la composicion corporal.",
+        InlineKeyboardMarkup([
+            [InlineKeyboardButton("No consumo alcohol",             callback_data="alcohol:no")],
+            [InlineKeyboardButton("Ocasional — 1-2 veces al mes",  callback_data="alcohol:ocasional")],
+            [InlineKeyboardButton("Moderado — fines de semana",    callback_data="alcohol:moderado")],
+            [InlineKeyboardButton("Frecuente — varias veces/sem",  callback_data="alcohol:frecuente")],
+            [InlineKeyboardButton("<- Atras",                        callback_data="suple:back")],
+        ])
+    )
 
-        if data == "ayuda:pausa":
-            await edit(
-                "✈️ <b>Pausa</b>\n\n¿Cuántos días?",
-                InlineKeyboardMarkup([
-                    [InlineKeyboardButton("3 días",  callback_data="pausa:3"),
-                     InlineKeyboardButton("7 días",  callback_data="pausa:7")],
-                    [InlineKeyboardButton("14 días", callback_data="pausa:14"),
-                     InlineKeyboardButton("30 días", callback_data="pausa:30")],
-                    [InlineKeyboardButton("← Atrás", callback_data="ver_ayuda")],
-                ])
-            )
-            return
+@callback("alcohol", limite="plan")
+async def _cb_alcohol(cb: Callback) -> None:
+    await adb.upsert_perfil(cb.uid, alcohol=cb.arg)
+    await _generar_plan_gym(cb.uid, cb.query, cb.context)
+
+# ── DIETA REGENERAR ───────────────────────────────────────────────────────────
+
+@callback("dieta")
+async def _cb_dieta(cb: Callback) -> None:
+    if cb.arg == "regenerar":
+        await cb.onboard("🥗 <b>¿Cómo describes tu alimentación?</b>", _kb_dieta())
+
+# ── EJERCICIO POR EJERCICIO ───────────────────────────────────────────────────
+
+@callback("ej_start")
+async def _cb_ej_start(cb: Callback) -> None:
+    _, sem_s, dia_s = cb.partes
+    sem = int(sem_s)
+    await adb.save_sesion_activa(cb.uid, sem, dia_s, 0, "ejercicio")
+    await adb.cargar_sesion(cb.uid, sem, dia_s)
+    txt, kb = await adb.run(ren.render_ejercicio, cb.uid, sem, dia_s, 0)
+    await cb.edit(txt, kb)
+
+@callback("ej_resume")
+async def _cb_ej_resume(cb: Callback) -> None:
+    _, sem_s, dia_s, idx_s = cb.partes
+    txt, kb = await adb.run(ren.render_ejercicio, cb.uid, int(sem_s), dia_s, int(idx_s))
+    await cb.edit(txt, kb)
+
+@callback("ej_hecho")
+async def _cb_ej_hecho(cb: Callback) -> None:
+    _, sem_s, dia_s, idx_s = cb.partes
+    sem = int(sem_s); idx = int(idx_s)
+    await adb.save_sesion_activa(cb.uid, sem, dia_s, idx+1, "ejercicio")
+    txt, kb = await adb.run(ren.render_ejercicio, cb.uid, sem, dia_s, idx+1)
+    await cb.edit(txt, kb)
+
+@callback("ej_done")
+async def _cb_ej_done(cb: Callback) -> None:
+    uid = cb.uid
+    _, sem_s, dia_s = cb.partes
+    sem = int(sem_s)
+    await adb.clear_sesion_activa(uid)
+    await adb.marcar_dia_completado(uid, sem, dia_s)
+    grupo     = await adb.run(_grupo_del_dia, uid, sem, dia_s)
+    resultado = await adb.run(gam.procesar_fin_sesion, uid, sem, dia_s, "si", grupo)
+    msg_wow   = ren.msg_fin_sesion(resultado)
+    kb_feed   = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔥 Sin reserva",    callback_data=f"sesion:{sem}:{dia_s}:0:5")],
+        [InlineKeyboardButton("💪 Bien",           callback_data=f"sesion:{sem}:{dia_s}:2:3")],
+        [InlineKeyboardButton("😌 Fácil",          callback_data=f"sesion:{sem}:{dia_s}:3:2")],
+        [InlineKeyboardButton("😓 Muy cansado",    callback_data=f"sesion:{sem}:{dia_s}:2:4")],
+    ])
+    try:
+        await cb.edit(msg_wow + "\n\n<b>¿Cómo estuvo?</b>", kb_feed)
+    except Exception:
+        await cb.enviar(msg_wow + "\n\n<b>¿Cómo estuvo?</b>", kb_feed, parse_mode="HTML")
+
+@callback("sesion")
+async def _cb_sesion(cb: Callback) -> None:
+    uid   = cb.uid
+    parts = cb.partes
+    sem, dia_s, rir, fatiga = int(parts[1]), parts[2], int(parts[3]), int(parts[4])
+    await adb.save_progreso_sesion(uid, sem, dia_s, rir=rir, fatiga=fatiga)
+    nueva_sem, nuevo_dia = await adb.avanzar_dia(uid, sem, dia_s)
+    await adb.upsert_estado(uid, nueva_sem, nuevo_dia)
+    racha = await adb.run(gam.get_racha, uid)
+    kb_fin = InlineKeyboardMarkup([
+        [InlineKeyboardButton("💪 Siguiente sesión", callback_data="menu:hoy")],
+        [InlineKeyboardButton("🌐 Ver progreso →",   url=ren.WEB_URL)],
+        [InlineKeyboardButton("🏠 Menú",            callback_data="menu:main")],
+    ])
+    fin_txt = f"💾 Guardado.{'  🔥 ' + str(racha) + ' días de racha' if racha >= 3 else ''}"
+    try:
+        await cb.edit(fin_txt, kb_fin)
+    except Exception:
+        await cb.enviar(fin_txt, kb_fin)
+
+@callback("sueño")
+async def _cb_sueno(cb: Callback) -> None:
+    _, sem_s, dia_s, horas_s = cb.partes
+    horas = float(horas_s)
+    if horas > 0:
+        await adb.upsert_perfil(cb.uid, sueño_horas=horas)
+    aviso = ""
+    if horas and horas < 6:
+        aviso = "\n\n⚠️ Menos de 6h afecta tu recuperación. Prioriza dormir hoy."
+    racha = await adb.run(gam.get_racha, cb.uid)
+    try:
+        await cb.edit(
+            f"✅ Registrado.{aviso}\n\n"
+            f"{'🔥 ' + str(racha) + ' días — ' if racha >= 3 else ''}"
+            "El análisis llega esta noche 🧠",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("💪 Siguiente", callback_data="menu:hoy")],
+                [InlineKeyboardButton("🏠 Menú",      callback_data="menu:main")],
+            ])
+        )
+    except Exception:
+        pass
 
-        if data.startswith("pausa:"):
-            dias = int(data.split(":")[1])
-            from datetime import datetime, timedelta
-            fecha = (datetime.now() + timedelta(days=dias)).strftime("%d/%m/%Y")
-            db.execute("UPDATE usuarios SET hora_recordatorio=? WHERE user_id=?",
-                       (f"PAUSA:{fecha}", uid))
-            await edit(f"✈️ Pausa {dias} días — hasta {fecha}.\n/sethorario para reactivar.", ren.BTN_MENU)
-            return
+# ── SWAP ──────────────────────────────────────────────────────────────────────
+
+@callback("swp_ask")
+async def _cb_swp_ask(cb: Callback) -> None:
+    uid    = cb.uid
+    parts  = cb.partes
+    eid, sem_s, dia_s = parts[1], parts[2], parts[3]
+    pagina = int(parts[4]) if len(parts) > 4 else 0
+    perfil = await adb.get_perfil(uid)
+    ej_row = await adb.fetchone("SELECT grupo, rol FROM rutinas WHERE user_id=? AND ejercicio_id=?", (uid, eid))
+    if not ej_row:
+        return
+    alts = [
+        {"id": e.id, "nombre": e.nombre, "emg_score": e.emg_score}
+        for e in cat.CATALOG
+        if e.grupo == ej_row["grupo"] and e.rol == ej_row["rol"]
+        and e.id != eid and perfil.get("ambiente_preferido","gym") in e.ambiente
+    ]
+    txt, kb = await adb.run(ren.render_swap, eid, int(sem_s), dia_s, alts, pagina)
+    await cb.edit(txt, kb)
+
+@callback("swp_do")
+async def _cb_swp_do(cb: Callback) -> None:
+    uid = cb.uid
+    _, id_orig, id_nuevo, sem_s, dia_s = cb.partes
+    ej_new  = cat.BY_ID.get(id_nuevo)
+    ej_orig = cat.BY_ID.get(id_orig)
+    if ej_new and ej_orig:
+        await adb.reemplazar_ejercicio(uid, id_orig, id_nuevo, ej_new.nombre, ej_new.patron)
+        await adb.save_swap(uid, id_orig, id_nuevo, ej_orig.grupo, ej_orig.rol)
+        sesion = await adb.get_sesion_activa(uid)
+        if sesion:
+            txt, kb = await adb.run(ren.render_ejercicio, uid, int(sem_s), dia_s, sesion["ej_idx"])
+        else:
+            txt, kb = await adb.run(ren.rutina_preview, uid, int(sem_s), dia_s)
+        await cb.edit(f"✅ {ej_new.nombre} reemplaza a {ej_orig.nombre}\n\n{txt}", kb)
+
+@callback("swp_cancel")
+async def _cb_swp_cancel(cb: Callback) -> None:
+    uid = cb.uid
+    _, sem_s, dia_s = cb.partes
+    sesion = await adb.get_sesion_activa(uid)
+    if sesion:
+        txt, kb = await adb.run(ren.render_ejercicio, uid, int(sem_s), dia_s, sesion["ej_idx"])
+    else:
+        txt, kb = await adb.run(ren.rutina_preview, uid, int(sem_s), dia_s)
+    await cb.edit(txt, kb)
+
+# ── SKIP DAY ──────────────────────────────────────────────────────────────────
+
+@callback("skip_day")
+async def _cb_skip_day(cb: Callback) -> None:
+    uid = cb.uid
+    _, sem_s, dia_s = cb.partes
+    await adb.clear_sesion_activa(uid)
+    nueva_sem, nuevo_dia = await adb.avanzar_dia(uid, int(sem_s), dia_s)
+    await adb.upsert_estado(uid, nueva_sem, nuevo_dia)
+    texto_m = await _menu_texto(uid, cb.nombre)
+    await cb.edit(f"Día saltado 👍\n\n{texto_m}", ren.MENU_PRINCIPAL)
+
+# ── AYUDA ─────────────────────────────────────────────────────────────────────
+
+@callback("ver_ayuda")
+async def _cb_ver_ayuda(cb: Callback) -> None:
+    await cb.edit(
+        "❓ <b>¿Qué necesitas?</b>\n\n"
+        "<code>/start</code> — Menú principal\n"
+        "<code>/login</code> — Entrar a la web\n"
+        "<code>/sethorario</code> — Cambiar recordatorio\n"
+        "<code>/reset_plan</code> — Cambiar rutina o dieta",
+        ren.AYUDA_KB
+    )
 
-        if data.startswith("horario:"):
-            parts = data.split(":")
-            hora  = None if parts[1] == "none" else f"{parts[1]}:{parts[2]}" if len(parts) > 2 else parts[1]
-            db.upsert_perfil(uid, hora_recordatorio=hora)
-            msg = f"⏰ Recordatorio: <b>{hora}</b> ✅" if hora else "❌ Recordatorio desactivado"
-            try:
-                await edit(msg, ren.BTN_MENU)
-            except Exception:
-                await context.bot.send_message(chat_id=chat_id, text=msg, parse_mode="HTML")
-            return
+@callback("ayuda")
+async def _cb_ayuda(cb: Callback) -> None:
+    if cb.arg == "horario":
+        await cb.edit("⏰ ¿A qué hora quieres el recordatorio?", _kb_horario(back_cb="ver_ayuda"))
+
+    elif cb.arg == "login":
+        token = await adb.create_login_token(cb.uid)
+        url   = f"{ren.WEB_URL}/auth?token={token}"
+        await cb.edit(
+            "Toca para entrar 👇\n<i>Válido 5 minutos.</i>",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("🌐 Entrar", url=url)],
+                [InlineKeyboardButton("← Atrás",   callback_data="ver_ayuda")],
+            ])
+        )
 
-        logger.debug("Callback no manejado: %s", data)
+    elif cb.arg == "pausa":
+        await cb.edit(
+            "✈️ <b>Pausa</b>\n\n¿Cuántos días?",
+            InlineKeyboardMarkup([
+                [InlineKeyboardButton("3 días",  callback_data="pausa:3"),
+                 InlineKeyboardButton("7 días",  callback_data="pausa:7")],
+                [InlineKeyboardButton("14 días", callback_data="pausa:14"),
+                 InlineKeyboardButton("30 días", callback_data="pausa:30")],
+                [InlineKeyboardButton("← Atrás", callback_data="ver_ayuda")],
+            ])
+        )
 
-    except Exception as e:
-        err = str(e)
-        if "Message is not modified" in err:
-            return  # silencioso — contenido ya correcto
-        logger.error("callback error [%s] uid=%s: %s", data, uid, e, exc_info=True)
-        try:
-            await context.bot.send_message(
-                chat_id = chat_id,
-                text    = f"❌ Error. Escribe /start para continuar.\n<code>{err[:100]}</code>",
-                parse_mode = "HTML",
-            )
-        except Exception:
-            pass
+@callback("pausa")
+async def _cb_pausa(cb: Callback) -> None:
+    dias = int(cb.arg)
+    from datetime import datetime, timedelta
+    fecha = (datetime.now() + timedelta(days=dias)).strftime("%d/%m/%Y")
+    await adb.execute("UPDATE usuarios SET hora_recordatorio=? WHERE user_id=?",
+                      (f"PAUSA:{fecha}", cb.uid))
+    db.invalidar_usuario(cb.uid)
+    await cb.edit(f"✈️ Pausa {dias} días — hasta {fecha}.\n/sethorario para reactivar.", ren.BTN_MENU)
 
 
 # ══════════════════════════════════════════════════════════════════════════════
 # REGISTRO
 # ══════════════════════════════════════════════════════════════════════════════
 
+def load_allowed_users() -> frozenset:
+    allowed = db.recargar_allowed_users()
+    logger.info("Usuarios permitidos: %s", set(allowed))
+    return allowed
+
+
 def register(app: Application) -> None:
-    allowed = db.get_allowed_users()
-    logger.info("Usuarios permitidos: %s", allowed)
+    load_allowed_users()
     logger.info("handlers.py version: 2026-06-05-v9")
 
     app.add_handler(CommandHandler("start",      cmd_start))
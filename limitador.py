@@ -0,0 +1,117 @@
+"""
+limitador.py — Token bucket por usuario y por regla, en memoria.
+
+Cada regla tiene una capacidad (ráfaga permitida) y un periodo en el que el
+bucket se vuelve a llenar completo. Lo usan las rutas caras de api.py (vía
+una dependencia que responde 429 + Retry-After), los callbacks del bot y la
+cola de envíos a Telegram (envios.py):
+
+    espera = limitador.consumir("analisis", uid)
+    if espera:
+        ...  # rechazar; reintentar en `espera` segundos
+
+Las reglas se ajustan por entorno sin tocar código:
+LIMITE_ANALISIS="5/600" → 5 llamadas de ráfaga, bucket lleno de nuevo en
+600 s. Es por proceso: con varias réplicas cada una cuenta por su lado.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Regla:
+    capacidad: int
+    periodo:   float   # segundos para recargar el bucket completo
+
+    @property
+    def por_segundo(self) -> float:
+        return self.capacidad / self.periodo
+
+
+# Cada una dispara una llamada a Gemini o un cálculo pesado (pandas/numpy)
+REGLAS: dict[str, Regla] = {
+    "analisis":  Regla(capacidad=6, periodo=600),
+    "nutricion": Regla(capacidad=2, periodo=3600),
+    "plan":      Regla(capacidad=3, periodo=600),
+    # Mensajes salientes del bot (envios.py): Telegram admite ~30/s en
+    # total (clave 0) y ~1/s por chat. Ráfaga chica: en cualquier segundo
+    # salen a lo sumo capacidad + 20 mensajes
+    "telegram":      Regla(capacidad=5, periodo=0.25),
+    "telegram_chat": Regla(capacidad=1, periodo=1),
+}
+
+# Más buckets que esto → se descartan los que ya están llenos (equivalen a
+# no tener bucket) y, si no alcanza, los usados hace más tiempo, hasta
+# quedar en 90%: así la purga no corre en cada llamada.
+_MAX_BUCKETS = 10_000
+
+
+def _regla_de_entorno(nombre: str, defecto: Regla) -> Regla:
+    valor = os.environ.get(f"LIMITE_{nombre.upper()}")
+    if not valor:
+        return defecto
+    try:
+        capacidad, periodo = valor.split("/")
+        return Regla(int(capacidad), float(periodo))
+    except ValueError:
+        logger.warning("LIMITE_%s inválido (%r), uso %s", nombre.upper(), valor, defecto)
+        return defecto
+
+
+REGLAS = {nombre: _regla_de_entorno(nombre, r) for nombre, r in REGLAS.items()}
+
+_buckets: OrderedDict[tuple[str, object], tuple[float, float]] = OrderedDict()   # → (tokens, instante)
+_lock     = threading.Lock()
+_STATS    = {nombre: {"permitidas": 0, "rechazadas": 0} for nombre in REGLAS}
+
+
+def _purgar(ahora: float) -> None:
+    llenos = [k for k, (tokens, t) in _buckets.items()
+              if tokens + (ahora - t) * REGLAS[k[0]].por_segundo >= REGLAS[k[0]].capacidad]
+    for k in llenos:
+        del _buckets[k]
+    while len(_buckets) > _MAX_BUCKETS * 0.9:
+        _buckets.popitem(last=False)
+
+
+def consumir(regla: str, clave, costo: float = 1.0) -> float:
+    """Gasta `costo` tokens de (regla, clave). 0 si pasa; si no, segundos a esperar."""
+    r     = REGLAS[regla]
+    ahora = time.monotonic()
+    with _lock:
+        tokens, t = _buckets.get((regla, clave), (float(r.capacidad), ahora))
+        tokens = min(r.capacidad, tokens + (ahora - t) * r.por_segundo)
+        _buckets.pop((regla, clave), None)   # reinsertar al final: orden LRU
+        if tokens >= costo:
+            _buckets[(regla, clave)] = (tokens - costo, ahora)
+            _STATS[regla]["permitidas"] += 1
+            if len(_buckets) > _MAX_BUCKETS:
+                _purgar(ahora)
+            return 0.0
+        _buckets[(regla, clave)] = (tokens, ahora)
+        _STATS[regla]["rechazadas"] += 1
+        return (costo - tokens) / r.por_segundo
+
+
+def texto_espera(segundos: float) -> str:
+    """'40 s' / '3 min' para mostrarle al usuario."""
+    if segundos < 90:
+        return f"{max(1, round(segundos))} s"
+    return f"{round(segundos / 60)} min"
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            "buckets": len(_buckets),
+            "reglas":  {n: {"capacidad": r.capacidad, "periodo": r.periodo, **_STATS[n]}
+                        for n, r in REGLAS.items()},
+        }
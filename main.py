@@ -9,6 +9,7 @@ from telegram.ext import Application
 
 import database as db
 import handlers
+import procesador
 
 logging.basicConfig(
     level=logging.INFO,
@@ -75,7 +76,7 @@ def main() -> None:
     api_thread.start()
     logger.info("API corriendo en puerto %s", os.environ.get("API_PORT", "8000"))
 
-    app = Application.builder().token(token).build()
+    app = Application.builder().token(token).concurrent_updates(procesador.ProcesadorPorUsuario()).build()
     handlers.register_handlers(app)
 
     job_queue = app.job_queue
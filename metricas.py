@@ -0,0 +1,224 @@
+"""
+metricas.py — Métricas del proceso en formato de texto Prometheus.
+
+Sin dependencias: contadores e histogramas en memoria, protegidos por un
+lock porque los llenan el event loop, el threadpool de FastAPI y los
+executors de adb. api.py las sirve en /metrics; handlers.py suma la
+latencia de cada callback del bot.
+
+    with metricas.peticion() as req:      # middleware HTTP
+        ...                               # database.py suma tiempo de DB,
+                                          # medir_llm() suma tiempo de LLM
+    metricas.registrar_peticion("/plan", "GET", 200, segundos, req)
+
+El acumulador de cada petición viaja en un ContextVar: run_in_threadpool y
+adb.run copian el contexto, así que el tiempo de DB medido en otro thread
+se suma a la petición que lo pidió. Fuera de una petición (bot, jobs) solo
+cuentan los totales globales.
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Segundos. Cubren desde un 304 (~0.1 ms) hasta una llamada a Gemini
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histograma:
+    __slots__ = ("cuentas", "suma", "n")
+
+    def __init__(self):
+        self.cuentas = [0] * (len(BUCKETS) + 1)   # el último es +Inf
+        self.suma    = 0.0
+        self.n       = 0
+
+    def observar(self, valor: float) -> None:
+        self.cuentas[bisect.bisect_left(BUCKETS, valor)] += 1
+        self.suma += valor
+        self.n    += 1
+
+
+class _Peticion:
+    __slots__ = ("db_seg", "db_queries", "llm_seg")
+
+    def __init__(self):
+        self.db_seg     = 0.0
+        self.db_queries = 0
+        self.llm_seg    = 0.0
+
+
+_actual: ContextVar[_Peticion | None] = ContextVar("metricas_peticion", default=None)
+_lock = threading.Lock()
+
+_peticiones: dict[tuple[str, str, int], int] = {}    # (ruta, método, status) → n
+_latencia:   dict[str, Histograma] = {}              # ruta → duración total
+_db_ruta:    dict[str, float] = {}                   # ruta → segundos en DB
+_llm_ruta:   dict[str, float] = {}                   # ruta → segundos en LLM
+_llm:        dict[str, Histograma] = {}              # operación → duración
+_db = {"segundos": 0.0, "queries": 0}
+_llm_errores: dict[str, int] = {}
+_callbacks:  dict[str, Histograma] = {}              # ruta de callback → duración
+_callbacks_err: dict[str, int] = {}
+
+
+# ── CAPTURA ───────────────────────────────────────────────────────────────────
+
+@contextmanager
+def peticion():
+    """Abre el acumulador de DB/LLM de una petición HTTP."""
+    req   = _Peticion()
+    token = _actual.set(req)
+    try:
+        yield req
+    finally:
+        _actual.reset(token)
+
+
+def sumar_db(ms: float) -> None:
+    """Lo llama database._registrar por cada statement medido."""
+    seg = ms / 1000
+    req = _actual.get()
+    if req is not None:
+        req.db_seg     += seg
+        req.db_queries += 1
+    with _lock:
+        _db["segundos"] += seg
+        _db["queries"]  += 1
+
+
+@contextmanager
+def medir_llm(operacion: str):
+    """Cronometra una llamada al LLM (sirve alrededor de un await)."""
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        seg = time.perf_counter() - t0
+        req = _actual.get()
+        if req is not None:
+            req.llm_seg += seg
+        with _lock:
+            _llm.setdefault(operacion, Histograma()).observar(seg)
+            if not ok:
+                _llm_errores[operacion] = _llm_errores.get(operacion, 0) + 1
+
+
+def registrar_callback(ruta: str, seg: float, ok: bool = True) -> None:
+    """Un callback del bot despachado por handlers.callback_router."""
+    with _lock:
+        _callbacks.setdefault(ruta, Histograma()).observar(seg)
+        if not ok:
+            _callbacks_err[ruta] = _callbacks_err.get(ruta, 0) + 1
+
+
+def registrar_peticion(ruta: str, metodo: str, status: int, seg: float,
+                       req: _Peticion | None = None) -> None:
+    with _lock:
+        clave = (ruta, metodo, status)
+        _peticiones[clave] = _peticiones.get(clave, 0) + 1
+        _latencia.setdefault(ruta, Histograma()).observar(seg)
+        if req is not None:
+            _db_ruta[ruta]  = _db_ruta.get(ruta, 0.0) + req.db_seg
+            _llm_ruta[ruta] = _llm_ruta.get(ruta, 0.0) + req.llm_seg
+
+
+# ── EXPOSICIÓN ────────────────────────────────────────────────────────────────
+
+def _etiquetas(**kv) -> str:
+    partes = []
+    for k, v in kv.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{k}="{v}"')
+    return "{" + ",".join(partes) + "}"
+
+
+def _num(v: float) -> str:
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def _histograma(lineas: list[str], nombre: str, h: Histograma, **kv) -> None:
+    acumulado = 0
+    for limite, n in zip((*BUCKETS, "+Inf"), h.cuentas):
+        acumulado += n
+        lineas.append(f"{nombre}_bucket{_etiquetas(**kv, le=limite)} {acumulado}")
+    lineas.append(f"{nombre}_sum{_etiquetas(**kv)} {_num(h.suma)}")
+    lineas.append(f"{nombre}_count{_etiquetas(**kv)} {h.n}")
+
+
+def _cabecera(lineas: list[str], nombre: str, tipo: str, ayuda: str) -> None:
+    lineas.append(f"# HELP {nombre} {ayuda}")
+    lineas.append(f"# TYPE {nombre} {tipo}")
+
+
+def exponer(gauges: dict[str, tuple[str, float]] | None = None) -> str:
+    """Texto Prometheus 0.0.4. gauges: nombre → (ayuda, valor) del caller."""
+    with _lock:
+        peticiones = dict(_peticiones)
+        latencia   = {r: (list(h.cuentas), h.suma, h.n) for r, h in _latencia.items()}
+        db_ruta    = dict(_db_ruta)
+        llm_ruta   = dict(_llm_ruta)
+        llm        = {o: (list(h.cuentas), h.suma, h.n) for o, h in _llm.items()}
+        llm_err    = dict(_llm_errores)
+        callbacks  = {r: (list(h.cuentas), h.suma, h.n) for r, h in _callbacks.items()}
+        cb_err     = dict(_callbacks_err)
+        db_total   = dict(_db)
+
+    def _copia(datos):
+        h = Histograma()
+        h.cuentas, h.suma, h.n = datos
+        return h
+
+    l: list[str] = []
+    _cabecera(l, "gymcoach_http_requests_total", "counter", "Peticiones HTTP por ruta, método y status.")
+    for (ruta, metodo, status), n in sorted(peticiones.items()):
+        l.append(f"gymcoach_http_requests_total{_etiquetas(route=ruta, method=metodo, status=status)} {n}")
+
+    _cabecera(l, "gymcoach_http_request_duration_seconds", "histogram", "Duración de la petición por ruta.")
+    for ruta, datos in sorted(latencia.items()):
+        _histograma(l, "gymcoach_http_request_duration_seconds", _copia(datos), route=ruta)
+
+    # Proporción en DB/LLM por ruta = estos contadores / ..._duration_seconds_sum
+    _cabecera(l, "gymcoach_http_db_seconds_total", "counter", "Tiempo en database.py dentro de peticiones, por ruta.")
+    for ruta, seg in sorted(db_ruta.items()):
+        l.append(f"gymcoach_http_db_seconds_total{_etiquetas(route=ruta)} {_num(seg)}")
+    _cabecera(l, "gymcoach_http_llm_seconds_total", "counter", "Tiempo en llamadas al LLM dentro de peticiones, por ruta.")
+    for ruta, seg in sorted(llm_ruta.items()):
+        l.append(f"gymcoach_http_llm_seconds_total{_etiquetas(route=ruta)} {_num(seg)}")
+
+    _cabecera(l, "gymcoach_db_seconds_total", "counter", "Tiempo total en SQLite (API, bot y jobs).")
+    l.append(f"gymcoach_db_seconds_total {_num(db_total['segundos'])}")
+    _cabecera(l, "gymcoach_db_queries_total", "counter", "Statements SQLite ejecutados.")
+    l.append(f"gymcoach_db_queries_total {db_total['queries']}")
+
+    _cabecera(l, "gymcoach_llm_duration_seconds", "histogram", "Duración de llamadas al LLM por operación.")
+    for op, datos in sorted(llm.items()):
+        _histograma(l, "gymcoach_llm_duration_seconds", _copia(datos), operation=op)
+    _cabecera(l, "gymcoach_llm_errors_total", "counter", "Llamadas al LLM que fallaron o vencieron.")
+    for op, n in sorted(llm_err.items()):
+        l.append(f"gymcoach_llm_errors_total{_etiquetas(operation=op)} {n}")
+
+    _cabecera(l, "gymcoach_bot_callback_duration_seconds", "histogram", "Duración de callbacks del bot por ruta.")
+    for ruta, datos in sorted(callbacks.items()):
+        _histograma(l, "gymcoach_bot_callback_duration_seconds", _copia(datos), route=ruta)
+    _cabecera(l, "gymcoach_bot_callback_errors_total", "counter", "Callbacks del bot que terminaron en error.")
+    for ruta, n in sorted(cb_err.items()):
+        l.append(f"gymcoach_bot_callback_errors_total{_etiquetas(route=ruta)} {n}")
+
+    for nombre, (ayuda, valor) in (gauges or {}).items():
+        _cabecera(l, nombre, "gauge", ayuda)
+        l.append(f"{nombre} {_num(valor)}")
+    return "\n".join(l) + "\n"
+
+
+def reset() -> None:
+    with _lock:
+        for d in (_peticiones, _latencia, _db_ruta, _llm_ruta, _llm, _llm_errores,
+                  _callbacks, _callbacks_err):
+            d.clear()
+        _db.update(segundos=0.0, queries=0)
@@ -13,19 +13,26 @@ Gemini recibe datos reales — no responde preguntas genéricas.
 """
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
 from datetime import datetime, time
 
 import pytz
 
+import adb
 import database as db
 import catalog as cat
+import envios
+import metricas
 
 logger = logging.getLogger(__name__)
 
 TZ      = pytz.timezone("America/Phoenix")
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+# Usuarios preparándose a la vez en check_y_enviar (consultas + Gemini)
+NOTIF_CONCURRENCIA = int(os.environ.get("NOTIF_CONCURRENCIA", "8"))
+NOTIF_GEMINI_TIMEOUT_SEG = float(os.environ.get("NOTIF_GEMINI_TIMEOUT_SEG", "20"))
 
 GRUPO_ICON = {
     "gluteo": "🍑", "pierna": "🦵", "empuje": "💪",
@@ -38,7 +45,7 @@ def msg_recordatorio(user_id: int) -> str:
     """Mensaje corto para la mañana — qué toca hoy."""
     try:
         semana, dia = db.get_estado(user_id)
-        ejs = db.get_ejercicios_dia(user_id, semana, dia)
+        ejs = db.get_day_snapshot(user_id, semana, dia)
     except Exception:
         return ""
 
@@ -55,7 +62,7 @@ def msg_recordatorio(user_id: int) -> str:
 
     # Peso sugerido del ejercicio principal
     primer = fuerza[0] if fuerza else None
-    sug = db.get_peso_sugerido(user_id, primer["ejercicio_id"]) if primer else None
+    sug = primer["peso_sugerido"] if primer else None
     sug_str = f"\n→ {primer['ejercicio'][:20]}: {sug} lbs hoy" if sug else ""
 
     return (
@@ -69,7 +76,7 @@ def msg_recordatorio(user_id: int) -> str:
 
 def _datos_sesion(user_id: int, semana: int, dia: str) -> dict:
     """Recopila datos reales de la sesión para darle a Gemini."""
-    ejs       = db.get_ejercicios_dia(user_id, semana, dia)
+    ejs       = db.get_day_snapshot(user_id, semana, dia)
     fuerza    = [e for e in ejs if not e["ejercicio_id"].startswith("CAR")]
     completado = db.rutina_completa(user_id, semana, dia)
 
@@ -80,7 +87,7 @@ def _datos_sesion(user_id: int, semana: int, dia: str) -> dict:
     for e in fuerza:
         eid    = e["ejercicio_id"]
         hist   = db.get_progresion_ejercicio(user_id, eid)
-        ultimo = db.get_ultimo_peso(user_id, eid)
+        ultimo = e["ultimo"]
 
         if not ultimo or not ultimo.get("peso_lbs"):
             continue
@@ -131,8 +138,6 @@ async def _gemini_analisis(datos: dict, perfil: dict) -> str:
         return _fallback_sin_gemini(datos)
 
     try:
-        from google import genai
-
         # Datos de la sesión
         pesos_str    = "\n".join(datos["pesos"]) or "Sin registros de peso"
         progs_str    = ", ".join(datos["progresiones"]) or "ninguna"
@@ -152,7 +157,7 @@ async def _gemini_analisis(datos: dict, perfil: dict) -> str:
                 sueño_str = f"\nSUEÑO ANOCHE: {sueño_perfil}h — adecuado"
 
         # Datos corporales si existen
-        pesaje = db.get_ultimo_pesaje()
+        pesaje = await adb.get_ultimo_pesaje()
         cuerpo_str = ""
         if pesaje:
             cuerpo_str = (
@@ -167,9 +172,9 @@ async def _gemini_analisis(datos: dict, perfil: dict) -> str:
         uid = datos.get("user_id")
         patron_str = ""
         if uid:
-            historial = db.fetchall("""
+            historial = await adb.fetchall("""
                 SELECT ejercicio_id, semana, MAX(peso_lbs) as peso
-                FROM pesos WHERE user_id=? 
+                FROM pesos_todos WHERE user_id=?
                 GROUP BY ejercicio_id, semana
                 ORDER BY semana DESC LIMIT 20
             """, (uid,))
@@ -228,18 +233,38 @@ INSTRUCCIONES PARA TU RESPUESTA:
 
 Responde SOLO en español. Tono directo de coach, no de motivador."""
 
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        resp   = client.models.generate_content(
-            model    = "gemini-2.0-flash",
-            contents = prompt,
-        )
-        return resp.text.strip()
+        return await _generar(GEMINI_API_KEY, prompt, "resumen_nocturno") or _fallback_sin_gemini(datos)
 
     except Exception as e:
         logger.warning("Gemini analysis error: %s", e)
         return _fallback_sin_gemini(datos)
 
 
+_clientes_gemini: dict = {}
+
+
+def _cliente_gemini(api_key: str):
+    cliente = _clientes_gemini.get(api_key)
+    if cliente is None:
+        from google import genai
+        cliente = _clientes_gemini[api_key] = genai.Client(api_key=api_key)
+    return cliente
+
+
+async def _generar(api_key: str, prompt: str, operacion: str) -> str:
+    """
+    Gemini async (client.aio) con timeout: la llamada sync bloqueaba el
+    loop que comparten el bot y FastAPI, y serializaba check_y_enviar.
+    """
+    with metricas.medir_llm(operacion):
+        resp = await asyncio.wait_for(
+            _cliente_gemini(api_key).aio.models.generate_content(
+                model="gemini-2.0-flash", contents=prompt),
+            timeout=NOTIF_GEMINI_TIMEOUT_SEG,
+        )
+    return resp.text.strip() if resp and resp.text else ""
+
+
 def _fallback_sin_gemini(datos: dict) -> str:
     """Resumen sin Gemini — solo datos."""
     lines = []
@@ -260,8 +285,8 @@ async def msg_resumen_nocturno(user_id: int) -> str:
     Si fue rest day: motivación de recovery.
     """
     try:
-        semana, dia = db.get_estado(user_id)
-        ejs = db.get_ejercicios_dia(user_id, semana, dia)
+        semana, dia = await adb.get_estado(user_id)
+        ejs = await adb.get_ejercicios_dia(user_id, semana, dia)
     except Exception:
         return ""
 
@@ -272,9 +297,9 @@ async def msg_resumen_nocturno(user_id: int) -> str:
             "El músculo crece hoy — sueño y proteína."
         )
 
-    datos   = _datos_sesion(user_id, semana, dia)
+    datos   = await adb.run(_datos_sesion, user_id, semana, dia)
     datos["user_id"] = user_id
-    perfil  = db.get_perfil(user_id)
+    perfil  = await adb.get_perfil(user_id)
     grupo   = datos["grupo"]
     icon    = GRUPO_ICON.get(grupo, "💪")
 
@@ -290,7 +315,7 @@ async def msg_resumen_nocturno(user_id: int) -> str:
     analisis = await _gemini_analisis(datos, perfil)
     if analisis and analisis != _fallback_sin_gemini(datos):
         try:
-            db.save_analisis(user_id, analisis, "nocturno")
+            await adb.save_analisis(user_id, analisis, "nocturno")
         except Exception:
             pass
 
@@ -315,68 +340,88 @@ async def check_y_enviar(bot, hora_actual: str) -> None:
     - Recordatorio mañana a la hora configurada
     - Resumen nocturno a las 9pm
     - Detección de inactividad: si llevas 2+ días sin entrenar
-    """
-    HORA_NOCHE = "21:00"
 
-    rows = db.fetchall(
+    Cada usuario se prepara en paralelo (hasta NOTIF_CONCURRENCIA a la vez:
+    el resumen nocturno espera a Gemini) y los mensajes salen por la cola
+    de envios.py, que respeta los límites de Telegram.
+    """
+    rows = await adb.fetchall(
         "SELECT u.user_id, u.hora_recordatorio, u.nombre "
         "FROM usuarios u JOIN allowed_users a ON a.user_id = u.user_id "
         "WHERE a.activo = 1", (),
     )
 
-    for row in rows:
-        row  = dict(row)
-        uid  = row["user_id"]
-        hora = row.get("hora_recordatorio") or ""
-
-        # ── Recordatorio mañana ───────────────────────────────────────────────
-        # Skip si está en modo pausa
-        if hora and hora.startswith("PAUSA:"):
-            from datetime import datetime, date
-            try:
-                fecha_ret = datetime.strptime(hora.split("PAUSA:")[1], "%d/%m/%Y").date()
-                if date.today() >= fecha_ret:
-                    # Pausa terminada — limpiar
-                    db.execute("UPDATE usuarios SET hora_recordatorio=NULL WHERE user_id=?", (uid,))
-                    logger.info("Pausa terminada para %s", uid)
-            except Exception:
-                pass
-            continue
+    antes = envios.stats()
+    turno = asyncio.Semaphore(NOTIF_CONCURRENCIA)
+
+    async def _con_turno(row) -> None:
+        async with turno:
+            await _notificar_usuario(bot, dict(row), hora_actual)
+
+    await asyncio.gather(*(_con_turno(row) for row in rows))
 
-        if hora and hora == hora_actual:
-            try:
-                # Verificar inactividad antes de mandar recordatorio normal
-                dias_inactivo = _dias_sin_entrenar(uid)
-                if dias_inactivo >= 2:
-                    msg = await _msg_inactividad(uid, dias_inactivo)
-                else:
-                    msg = msg_recordatorio(uid)
-                if msg:
-                    await bot.send_message(chat_id=uid, text=msg, parse_mode="HTML")
-                    logger.info("Recordatorio enviado a %s (inactivo: %d días)", uid, dias_inactivo)
-            except Exception as e:
-                logger.warning("Recordatorio %s: %s", uid, e)
-
-        # ── Resumen nocturno ──────────────────────────────────────────────────
-        if hora_actual == HORA_NOCHE:
-            try:
-                msg = await msg_resumen_nocturno(uid)
-                if msg:
-                    await bot.send_message(chat_id=uid, text=msg, parse_mode="HTML")
-                    logger.info("Resumen nocturno enviado a %s", uid)
-            except Exception as e:
-                logger.warning("Resumen nocturno %s: %s", uid, e)
+    despues = envios.stats()
+    enviados = despues["enviados"] - antes["enviados"]
+    fallidos = despues["fallidos"] - antes["fallidos"]
+    if enviados or fallidos:
+        logger.info("Notificaciones %s: %d enviadas, %d fallidas, %d frenadas, lag máx %.1fs, en cola %d",
+                    hora_actual, enviados, fallidos, despues["frenados"] - antes["frenados"],
+                    despues["lag_max_s"], despues["en_cola"])
+
+
+async def _notificar_usuario(bot, row: dict, hora_actual: str) -> None:
+    HORA_NOCHE = "21:00"
+
+    uid  = row["user_id"]
+    hora = row.get("hora_recordatorio") or ""
+
+    # ── Recordatorio mañana ───────────────────────────────────────────────────
+    # Skip si está en modo pausa
+    if hora and hora.startswith("PAUSA:"):
+        from datetime import datetime, date
+        try:
+            fecha_ret = datetime.strptime(hora.split("PAUSA:")[1], "%d/%m/%Y").date()
+            if date.today() >= fecha_ret:
+                # Pausa terminada — limpiar
+                await adb.execute("UPDATE usuarios SET hora_recordatorio=NULL WHERE user_id=?", (uid,))
+                db.invalidar_usuario(uid)
+                logger.info("Pausa terminada para %s", uid)
+        except Exception:
+            pass
+        return
+
+    if hora and hora == hora_actual:
+        try:
+            # Verificar inactividad antes de mandar recordatorio normal
+            dias_inactivo = await adb.run(_dias_sin_entrenar, uid)
+            if dias_inactivo >= 2:
+                msg = await _msg_inactividad(uid, dias_inactivo)
+            else:
+                msg = await adb.run(msg_recordatorio, uid)
+            if msg:
+                await envios.enviar(bot, uid, msg, parse_mode="HTML")
+                logger.info("Recordatorio enviado a %s (inactivo: %d días)", uid, dias_inactivo)
+        except Exception as e:
+            logger.warning("Recordatorio %s: %s", uid, e)
+
+    # ── Resumen nocturno ──────────────────────────────────────────────────────
+    if hora_actual == HORA_NOCHE:
+        try:
+            msg = await msg_resumen_nocturno(uid)
+            if msg:
+                await envios.enviar(bot, uid, msg, parse_mode="HTML")
+                logger.info("Resumen nocturno enviado a %s", uid)
+        except Exception as e:
+            logger.warning("Resumen nocturno %s: %s", uid, e)
 
 
 def _dias_sin_entrenar(user_id: int) -> int:
     """Cuántos días lleva el usuario sin completar una sesión."""
     from datetime import datetime, date
-    row = db.fetchone("""
-        SELECT MAX(fecha) as ultima FROM progreso WHERE user_id=?
-    """, (user_id,))
-    if not row or not row["ultima"]:
+    ultima = db.get_ultimo_entreno(user_id)
+    if not ultima:
         return 999  # nunca ha entrenado
-    ultima = datetime.strptime(row["ultima"], "%Y-%m-%d").date()
+    ultima = datetime.strptime(ultima, "%Y-%m-%d").date()
     return (date.today() - ultima).days
 
 
@@ -385,14 +430,11 @@ async def _msg_inactividad(user_id: int, dias: int) -> str:
     Mensaje personalizado de reenganche cuando llevas 2+ días sin entrenar.
     Gemini analiza tus datos y da un mensaje específico, no genérico.
     """
-    import os
-    from google import genai
-
-    perfil     = db.get_perfil(user_id)
-    semana, dia = db.get_estado(user_id)
-    ejs        = db.get_ejercicios_dia(user_id, semana, dia)
+    perfil     = await adb.get_perfil(user_id)
+    semana, dia = await adb.get_estado(user_id)
+    ejs        = await adb.get_ejercicios_dia(user_id, semana, dia)
     grupo_hoy  = ejs[0].get("grupo", "") if ejs else ""
-    racha_max  = db.fetchone(
+    racha_max  = await adb.fetchone(
         "SELECT racha_maxima FROM gamificacion WHERE user_id=?", (user_id,)
     )
     racha_max_n = int(racha_max["racha_maxima"]) if racha_max else 0
@@ -405,7 +447,6 @@ async def _msg_inactividad(user_id: int, dias: int) -> str:
         return f"Llevas {dias} días sin entrenar. Tu cuerpo está listo. 🔥"
 
     try:
-        client = genai.Client(api_key=api_key)
         prompt = f"""Eres un coach personal. El usuario lleva {dias} días sin entrenar.
 Escribe UN mensaje corto de reenganche (máx 2 líneas) que sea:
 - Específico a sus datos (no genérico)
@@ -420,10 +461,8 @@ DATOS:
 
 Sin emojis excesivos. Sin "¡" ni drama. Solo motivación real en 1-2 líneas."""
 
-        resp = client.models.generate_content(
-            model="gemini-2.0-flash", contents=prompt
-        )
-        return resp.text.strip() if resp and resp.text else f"Llevas {dias} días. Hoy toca volver. 💪"
+        return (await _generar(api_key, prompt, "inactividad")
+                or f"Llevas {dias} días. Hoy toca volver. 💪")
     except Exception as e:
         logger.warning("Gemini inactividad: %s", e)
         return f"Llevas {dias} días sin entrenar. Hoy toca {grupo_hoy.upper() if grupo_hoy else 'volver'}. 💪"
@@ -0,0 +1,105 @@
+"""
+procesador.py — Updates del bot en paralelo, en orden por usuario.
+
+Por defecto PTB procesa un update a la vez: un coach o una generación de
+plan (varios segundos de LLM) frena los taps de todos los demás. Con este
+procesador hasta BOT_CONCURRENCIA updates corren a la vez, pero los de un
+mismo usuario pasan por un asyncio.Lock propio y se aplican en el orden en
+que llegaron (sesion_activa, user_data y el flujo de onboarding asumen eso):
+
+    app = (Application.builder().token(token)
+           .concurrent_updates(procesador.ProcesadorPorUsuario()).build())
+
+El lock se toma antes del semáforo global: un usuario que manda diez taps
+seguidos ocupa un solo lugar de concurrencia, no diez.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from contextlib import nullcontext
+from typing import Awaitable
+
+from telegram.ext import BaseUpdateProcessor
+
+BOT_CONCURRENCIA = int(os.environ.get("BOT_CONCURRENCIA", "32"))
+
+
+class _Turno:
+    __slots__ = ("lock", "usuarios")
+
+    def __init__(self):
+        self.lock     = asyncio.Lock()
+        self.usuarios = 0   # updates que lo tienen o lo esperan
+
+
+class ProcesadorPorUsuario(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates: int = BOT_CONCURRENCIA):
+        super().__init__(max_concurrent_updates)
+        self._turnos: dict[int, _Turno] = {}
+        self._en_espera  = 0
+        self._en_curso   = 0
+        self._espera_max = 0.0
+        self._procesados = 0
+
+    @staticmethod
+    def _clave(update: object) -> int | None:
+        usuario = getattr(update, "effective_user", None)
+        if usuario is not None:
+            return usuario.id
+        chat = getattr(update, "effective_chat", None)
+        return chat.id if chat is not None else None
+
+    async def process_update(self, update: object, coroutine: Awaitable) -> None:
+        # Nada de await antes de tomar el turno: las tasks arrancan en el
+        # orden de llegada y asyncio.Lock despierta a quien espera en FIFO.
+        clave = self._clave(update)
+        turno = None
+        if clave is not None:
+            turno = self._turnos.get(clave)
+            if turno is None:
+                turno = self._turnos[clave] = _Turno()
+            turno.usuarios += 1
+        t0 = time.monotonic()
+        self._en_espera += 1
+        esperando = True
+        try:
+            async with (turno.lock if turno is not None else nullcontext()):
+                async with self._semaphore:
+                    self._en_espera -= 1
+                    esperando = False
+                    self._espera_max = max(self._espera_max, time.monotonic() - t0)
+                    self._en_curso += 1
+                    try:
+                        await self.do_process_update(update, coroutine)
+                    finally:
+                        self._en_curso   -= 1
+                        self._procesados += 1
+        finally:
+            if esperando:   # cancelado mientras esperaba
+                self._en_espera -= 1
+            if turno is not None:
+                turno.usuarios -= 1
+                if not turno.usuarios:
+                    del self._turnos[clave]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "concurrencia": self.max_concurrent_updates,
+            "en_curso":     self._en_curso,
+            "en_espera":    self._en_espera,
+            "usuarios":     len(self._turnos),
+            "procesados":   self._procesados,
+            "espera_max_s": round(self._espera_max, 3),
+        }
+
@@ -66,7 +66,7 @@ BTN_MENU_Y_WEB = InlineKeyboardMarkup([
 
 def rutina_preview(user_id: int, semana: int, dia: str) -> tuple[str, InlineKeyboardMarkup]:
     """Preview de la rutina del día antes de empezar."""
-    rows = db.get_ejercicios_dia(user_id, semana, dia)
+    rows = db.get_day_snapshot(user_id, semana, dia)
     if not rows:
         return (
             f"No hay rutina para {dia}.\nUsa <b>🆕 Nuevo plan</b> para crear una.",
@@ -95,16 +95,13 @@ def rutina_preview(user_id: int, semana: int, dia: str) -> tuple[str, InlineKeyb
     ]
 
     # Calentamiento
-    cal = db.fetchone(
-        "SELECT notas FROM rutinas WHERE user_id=? AND semana=? AND dia=? AND rol='calentamiento' LIMIT 1",
-        (user_id, semana, dia)
-    )
+    cal = next((r for r in rows if r.get("rol") == "calentamiento"), None)
     if cal and cal["notas"]:
         lines.append(f"🔥 <b>Calentamiento:</b> {cal['notas']}\n")
 
     lines.append("<b>Rutina de hoy:</b>")
     for i, r in enumerate(fuerza, 1):
-        peso_sug = db.get_peso_sugerido(user_id, r["ejercicio_id"])
+        peso_sug = r["peso_sugerido"]
         sug_str = f" → <i>{peso_sug} lbs</i>" if peso_sug else ""
         lines.append(f"{i}. {r['ejercicio']}  {r['series']}×{r['reps']}{sug_str}")
 
@@ -125,9 +122,10 @@ def rutina_preview(user_id: int, semana: int, dia: str) -> tuple[str, InlineKeyb
 
 
 def render_ejercicio(user_id: int, semana: int, dia: str, idx: int) -> tuple[str, InlineKeyboardMarkup]:
-    """Pantalla de un ejercicio durante la sesión."""
-    rows   = [r for r in db.get_ejercicios_dia(user_id, semana, dia) if not r.get("es_cardio")]
-    cardio = next((r for r in db.get_ejercicios_dia(user_id, semana, dia) if r.get("es_cardio")), None)
+    """Pantalla de un ejercicio durante la sesión (snapshot de la cache de sesión)."""
+    dia_rows = db.get_snapshot_sesion(user_id, semana, dia)
+    rows   = [r for r in dia_rows if not r.get("es_cardio")]
+    cardio = next((r for r in dia_rows if r.get("es_cardio")), None)
 
     if idx >= len(rows):
         # Cardio o fin
@@ -141,8 +139,8 @@ def render_ejercicio(user_id: int, semana: int, dia: str, idx: int) -> tuple[str
     if cardio:
         rest.append(f"🏃 {cardio['ejercicio']}")
 
-    peso_ant = db.get_ultimo_peso(user_id, eid)
-    peso_sug = db.get_peso_sugerido(user_id, eid)
+    peso_ant = ej["ultimo"]
+    peso_sug = ej["peso_sugerido"]
 
     prog_line = ""
     if peso_ant and peso_ant.get("peso_lbs"):
@@ -203,29 +203,32 @@ def convertir_sesion_a_casa(user_id: int, semana: int, dia: str) -> int:
     ejercicios = db.get_ejercicios_dia(user_id, semana, dia)
     convertidos = 0
 
-    with db.get_db() as conn:
-        for ex in ejercicios:
-            eid = ex["ejercicio_id"]
-            ej  = BY_ID.get(eid)
-            if not ej or ej.es_home():
-                continue  # ya es de casa o no existe
-
-            equivalente = cat.equivalente_casa(eid)
-            if not equivalente:
-                logger.warning("Sin equivalente casa para %s", eid)
-                continue
-
-            conn.execute(
-                "UPDATE rutinas SET ejercicio_id=?, ejercicio=?, patron=? "
-                "WHERE user_id=? AND semana=? AND dia=? AND ejercicio_id=?",
-                (equivalente.id, equivalente.nombre, equivalente.patron,
-                 user_id, semana, dia, eid),
-            )
-            conn.execute(
-                "DELETE FROM progreso WHERE user_id=? AND semana=? AND dia=? AND ejercicio_id=?",
-                (user_id, semana, dia, eid),
-            )
-            convertidos += 1
+    try:
+        with db.get_db(user_id) as conn:
+            for ex in ejercicios:
+                eid = ex["ejercicio_id"]
+                ej  = BY_ID.get(eid)
+                if not ej or ej.es_home():
+                    continue  # ya es de casa o no existe
+
+                equivalente = cat.equivalente_casa(eid)
+                if not equivalente:
+                    logger.warning("Sin equivalente casa para %s", eid)
+                    continue
+
+                conn.execute(
+                    "UPDATE rutinas SET ejercicio_id=?, ejercicio=?, patron=? "
+                    "WHERE user_id=? AND semana=? AND dia=? AND ejercicio_id=?",
+                    (equivalente.id, equivalente.nombre, equivalente.patron,
+                     user_id, semana, dia, eid),
+                )
+                conn.execute(
+                    "DELETE FROM progreso WHERE user_id=? AND semana=? AND dia=? AND ejercicio_id=?",
+                    (user_id, semana, dia, eid),
+                )
+                convertidos += 1
+    finally:
+        db.invalidar_sesion(user_id)
 
     logger.info("Modo casa: %d ejercicios convertidos user=%s S%s %s",
                 convertidos, user_id, semana, dia)
@@ -240,29 +243,32 @@ def restaurar_sesion_a_gym(user_id: int, semana: int, dia: str) -> int:
     ejercicios = db.get_ejercicios_dia(user_id, semana, dia)
     restaurados = 0
 
-    with db.get_db() as conn:
-        for ex in ejercicios:
-            eid = ex["ejercicio_id"]
-            ej  = BY_ID.get(eid)
-            if not ej or ej.es_gym():
-                continue  # ya es de gym
-
-            # Buscar el mejor gym del mismo grupo y rol
-            candidatos = [
-                e for e in cat.BY_GRUPO.get(ej.grupo, [])
-                if e.es_gym() and e.rol == ej.rol
-            ]
-            if not candidatos:
-                continue
-            mejor = max(candidatos, key=lambda x: x.emg_score)
-
-            conn.execute(
-                "UPDATE rutinas SET ejercicio_id=?, ejercicio=?, patron=? "
-                "WHERE user_id=? AND semana=? AND dia=? AND ejercicio_id=?",
-                (mejor.id, mejor.nombre, mejor.patron,
-                 user_id, semana, dia, eid),
-            )
-            restaurados += 1
+    try:
+        with db.get_db(user_id) as conn:
+            for ex in ejercicios:
+                eid = ex["ejercicio_id"]
+                ej  = BY_ID.get(eid)
+                if not ej or ej.es_gym():
+                    continue  # ya es de gym
+
+                # Buscar el mejor gym del mismo grupo y rol
+                candidatos = [
+                    e for e in cat.BY_GRUPO.get(ej.grupo, [])
+                    if e.es_gym() and e.rol == ej.rol
+                ]
+                if not candidatos:
+                    continue
+                mejor = max(candidatos, key=lambda x: x.emg_score)
+
+                conn.execute(
+                    "UPDATE rutinas SET ejercicio_id=?, ejercicio=?, patron=? "
+                    "WHERE user_id=? AND semana=? AND dia=? AND ejercicio_id=?",
+                    (mejor.id, mejor.nombre, mejor.patron,
+                     user_id, semana, dia, eid),
+                )
+                restaurados += 1
+    finally:
+        db.invalidar_sesion(user_id)
 
     logger.info("Restaurar gym: %d ejercicios restaurados user=%s S%s %s",
                 restaurados, user_id, semana, dia)
@@ -286,14 +292,14 @@ def analizar_sesion(user_id: int, semana: int, dia: str) -> ResultadoSesion:
     grupo_dia = row_grupo["grupo"] if row_grupo else None
 
     actual = db.fetchone("""
-        SELECT rir_reportado, progreso_reportado, fatiga_reportada FROM progreso
+        SELECT rir, progreso_reportado, fatiga_reportada FROM progreso
         WHERE user_id=? AND semana=? AND dia=? AND fatiga_reportada IS NOT NULL LIMIT 1
     """, (user_id, semana, dia))
 
     if not actual:
         return ResultadoSesion("mantener", "sin datos", "")
 
-    rir    = actual["rir_reportado"]      if actual["rir_reportado"]    is not None else 2
+    rir    = actual["rir"]                if actual["rir"]              is not None else 2
     prog   = actual["progreso_reportado"] or "primera"
     fatiga = actual["fatiga_reportada"]   if actual["fatiga_reportada"] is not None else 2
 
@@ -444,36 +450,39 @@ def aplicar_prioridad_muscular(user_id: int, semana_inicio: int) -> dict:
     perdedor = min((g for g in GRUPOS_PRIORIDAD if g != ganador), key=lambda g: scores[g])
 
     series_sumadas = 0
-    with db.get_db() as conn:
-        for sem in range(semana_inicio, semana_inicio + 4):
-            if sem > 4:
-                break
-            rows = conn.execute("""
-                SELECT id, series FROM rutinas
-                WHERE user_id=? AND semana=? AND grupo=? AND ejercicio_id NOT LIKE 'CAR%'
-            """, (user_id, sem, ganador)).fetchall()
-            for row in rows:
-                if series_sumadas >= 4:
+    try:
+        with db.get_db(user_id) as conn:
+            for sem in range(semana_inicio, semana_inicio + 4):
+                if sem > 4:
                     break
-                conn.execute("UPDATE rutinas SET series=? WHERE id=?",
-                             (min(6, int(row["series"] or 3) + 1), row["id"]))
-                series_sumadas += 1
-
-            rows_p = conn.execute("""
-                SELECT id, series FROM rutinas
-                WHERE user_id=? AND semana=? AND grupo=? AND orden > 1
-                AND ejercicio_id NOT LIKE 'CAR%'
-            """, (user_id, sem, perdedor)).fetchall()
-            for row in rows_p:
-                conn.execute("UPDATE rutinas SET series=? WHERE id=?",
-                             (max(2, int(row["series"] or 3) - 1), row["id"]))
-
-        conn.execute("""
-            INSERT INTO prioridad_bloques
-            (user_id, bloque, semana_inicio, grupo_prioritario, grupo_secundario)
-            VALUES (?,
-                    (SELECT COALESCE(MAX(bloque),0)+1 FROM prioridad_bloques WHERE user_id=?),
-                    ?,?,?)
-        """, (user_id, user_id, semana_inicio, ganador, perdedor))
+                rows = conn.execute("""
+                    SELECT id, series FROM rutinas
+                    WHERE user_id=? AND semana=? AND grupo=? AND ejercicio_id NOT LIKE 'CAR%'
+                """, (user_id, sem, ganador)).fetchall()
+                for row in rows:
+                    if series_sumadas >= 4:
+                        break
+                    conn.execute("UPDATE rutinas SET series=? WHERE id=?",
+                                 (min(6, int(row["series"] or 3) + 1), row["id"]))
+                    series_sumadas += 1
+
+                rows_p = conn.execute("""
+                    SELECT id, series FROM rutinas
+                    WHERE user_id=? AND semana=? AND grupo=? AND orden > 1
+                    AND ejercicio_id NOT LIKE 'CAR%'
+                """, (user_id, sem, perdedor)).fetchall()
+                for row in rows_p:
+                    conn.execute("UPDATE rutinas SET series=? WHERE id=?",
+                                 (max(2, int(row["series"] or 3) - 1), row["id"]))
+
+            conn.execute("""
+                INSERT INTO prioridad_bloques
+                (user_id, bloque, semana_inicio, grupo_prioritario, grupo_secundario)
+                VALUES (?,
+                        (SELECT COALESCE(MAX(bloque),0)+1 FROM prioridad_bloques WHERE user_id=?),
+                        ?,?,?)
+            """, (user_id, user_id, semana_inicio, ganador, perdedor))
+    finally:
+        db.invalidar_sesion(user_id)
 
     return {"ganador": ganador, "perdedor": perdedor, "scores": scores, "deload_primero": False}
@@ -0,0 +1,63 @@
+"""
+conftest.py — Fixtures compartidas de los tests.
+
+    python -m pytest -q
+
+Cada test que pide `db` corre contra una DB SQLite nueva en tmp_path (el
+pool descarta sus conexiones cuando cambia DB_PATH). Los tests de la API y
+del bot necesitan fastapi / python-telegram-bot y se saltean si no están.
+"""
+import os
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+# Antes de importar database: nada de tocar coach.db del directorio actual
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(prefix="gymcoach-tests-"), "coach.db"))
+os.environ.setdefault("BOT_JOBS", "0")
+
+import pytest
+
+UID = 7
+
+
+def _limpiar(database) -> None:
+    for cache in (database._cache_perfil, database._cache_estado,
+                  database._cache_dia, database._cache_sesion):
+        cache.limpiar()
+    database._allowed_cargada = False
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    import database
+    database.flush_escrituras()
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "coach.db"))
+    _limpiar(database)
+    database.init_db()
+    yield database
+    database.flush_escrituras()
+    database.close_pool()
+    _limpiar(database)
+
+
+def plan_de_prueba(semanas=2, dias=("lunes", "miercoles")) -> list[dict]:
+    """Plan en el formato de insert_plan: 2 de fuerza + 1 cardio (IDs reales del catálogo) por día."""
+    return [{"semana": s, "dias": [{"dia": d, "grupo": "empuje", "ejercicios": [
+        {"ejercicio_id": "EMP_G01", "ejercicio": "Press de pecho con mancuernas",
+         "series": 3, "reps": "8"},
+        {"ejercicio_id": "EMP_G02", "ejercicio": "Press inclinado con mancuernas",
+         "series": 3, "reps": "10"},
+        {"ejercicio_id": "CAR_G01", "ejercicio": "Caminata inclinada en cinta",
+         "series": 1, "reps": "15 min", "rol": "cardio"},
+    ]} for d in dias]} for s in range(1, semanas + 1)]
+
+
+@pytest.fixture
+def con_plan(db):
+    """Usuario UID habilitado, con plan y parado en S1 lunes."""
+    db.add_allowed_user(UID)
+    db.insert_plan(UID, plan_de_prueba(), [])
+    db.upsert_estado(UID, 1, "lunes")
+    return UID
@@ -0,0 +1,50 @@
+"""adb: las funciones de database.py como corrutinas que no bloquean el loop."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import UID
+
+
+def test_misma_funcion_fuera_del_loop(db, con_plan, monkeypatch):
+    import adb
+    hilos = []
+    original = db.get_estado
+    monkeypatch.setattr(db, "get_estado", lambda uid: hilos.append(threading.current_thread()) or original(uid))
+    assert asyncio.run(adb.get_estado(UID)) == db.get_estado(UID) == (1, "lunes")
+    assert hilos[0] is not threading.main_thread()
+
+
+def test_no_bloquea_el_loop(db, monkeypatch):
+    import adb
+    monkeypatch.setattr(db, "get_estado", lambda uid: time.sleep(0.3) or (1, "lunes"))
+
+    async def principal():
+        ticks = 0
+
+        async def latido():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        tarea = asyncio.create_task(latido())
+        await adb.get_estado(UID)
+        tarea.cancel()
+        return ticks
+
+    assert asyncio.run(principal()) >= 10
+
+
+def test_run_para_logica_sincrona(db):
+    import adb
+    assert asyncio.run(adb.run(lambda a, b=0: a + b, 2, b=3)) == 5
+
+
+def test_no_exporta_privadas_ni_get_db(db):
+    import adb
+    for nombre in ("_checkout", "get_db", "DB_PATH", "no_existe"):
+        with pytest.raises(AttributeError):
+            getattr(adb, nombre)
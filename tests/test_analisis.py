@@ -0,0 +1,62 @@
+"""/analisis: un texto por día y datos (huella), y una sola llamada a Gemini a la vez."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import UID
+
+
+def test_analisis_del_dia_por_tipo_y_huella(db):
+    db.save_analisis(UID, "viejo", "semanal", "h1")
+    db.save_analisis(UID, "nuevo", "semanal", "h1")
+    db.save_analisis(UID, "nocturno", "nocturno", "h1")
+    assert db.get_analisis_del_dia(UID, "semanal", "h1") == "nuevo"
+    assert db.get_analisis_del_dia(UID, "semanal", "h2") is None
+    assert db.get_analisis_del_dia(UID + 1, "semanal", "h1") is None
+    db.execute("UPDATE analisis_historial SET fecha='2000-01-01'")
+    assert db.get_analisis_del_dia(UID, "semanal", "h1") is None
+
+
+class GeminiFalso:
+    def __init__(self):
+        self.prompts: list[str] = []
+        self.aio = SimpleNamespace(models=SimpleNamespace(generate_content=self.generate_content))
+
+    async def generate_content(self, model, contents):
+        self.prompts.append(contents)
+        await asyncio.sleep(0.05)
+        return SimpleNamespace(text=f" análisis {len(self.prompts)} ")
+
+
+class TestRutaAnalisis:
+    @pytest.fixture
+    def api(self, db, con_plan, monkeypatch):
+        pytest.importorskip("fastapi")
+        pytest.importorskip("jose")
+        import api
+        gemini = GeminiFalso()
+        monkeypatch.setenv("GEMINI_API_KEY", "falsa")
+        monkeypatch.setattr(api, "_cliente_gemini", lambda api_key: gemini)
+        monkeypatch.setattr(api, "exigir_cupo", lambda regla, uid: None)
+        db.save_peso(UID, "EMP_G01", 1, "lunes", 100)
+        return api, db, gemini
+
+    def test_reutiliza_el_texto_hasta_que_cambian_los_datos(self, api):
+        api, db, gemini = api
+        primero = asyncio.run(api.get_analisis(uid=UID))
+        segundo = asyncio.run(api.get_analisis(uid=UID))
+        assert primero == segundo == {"texto": "análisis 1", "tiene_datos": True}
+        assert len(gemini.prompts) == 1
+        db.save_peso(UID, "EMP_G01", 2, "lunes", 110)
+        assert asyncio.run(api.get_analisis(uid=UID))["texto"] == "análisis 2"
+
+    def test_pedidos_simultaneos_esperan_la_misma_llamada(self, api):
+        api, _, gemini = api
+
+        async def dos():
+            return await asyncio.gather(api.get_analisis(uid=UID), api.get_analisis(uid=UID))
+
+        a, b = asyncio.run(dos())
+        assert a == b and len(gemini.prompts) == 1
+        assert not api._analisis_en_curso
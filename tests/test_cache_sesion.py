@@ -0,0 +1,82 @@
+"""
+Cache de la sesión activa: después de cada cambio, lo cacheado es igual a
+lo que daría la DB leída de nuevo.
+"""
+import pytest
+
+from conftest import UID, plan_de_prueba
+
+
+@pytest.fixture(params=[False, True], ids=["directo", "write_behind"])
+def sesion(request, db, con_plan, monkeypatch):
+    monkeypatch.setattr(db, "DB_WRITE_BEHIND", request.param)
+    db.cargar_sesion(UID, 1, "lunes")
+    return db
+
+
+def _igual_a_la_db(db, semana=1, dia="lunes"):
+    cacheado = db.get_snapshot_sesion(UID, semana, dia)
+    assert cacheado == db.get_day_snapshot(UID, semana, dia)
+    return cacheado
+
+
+def test_hit_no_consulta(sesion, monkeypatch):
+    monkeypatch.setattr(sesion, "get_day_snapshot", lambda *a: pytest.fail("no usó la cache"))
+    assert len(sesion.get_snapshot_sesion(UID, 1, "lunes")) == 3
+
+
+def test_otro_dia_no_sale_de_la_cache(sesion):
+    assert sesion.get_snapshot_sesion(UID, 1, "miercoles") == sesion.get_day_snapshot(UID, 1, "miercoles")
+
+
+def test_save_peso_parchea_el_ultimo(sesion):
+    sesion.save_peso(UID, "EMP_G01", 1, "lunes", 100, 3, "8")
+    filas = _igual_a_la_db(sesion)
+    assert filas[0]["ultimo"]["peso_lbs"] == 100 and filas[0]["peso_sugerido"] == 105.0
+    # Una semana anterior cargada tarde no pisa a la más alta
+    sesion.save_peso(UID, "EMP_G01", 2, "lunes", 110)
+    sesion.save_peso(UID, "EMP_G01", 1, "lunes", 90)
+    assert _igual_a_la_db(sesion)[0]["ultimo"]["peso_lbs"] == 110
+
+
+@pytest.mark.parametrize("cambio", [
+    lambda db: db.adjust_series(UID, 1, "lunes", delta=1),
+    lambda db: db.marcar_dia_completado(UID, 1, "lunes"),
+    lambda db: db.reemplazar_ejercicio(UID, "EMP_G02", "EMP_G08", "Press Arnold con mancuernas",
+                                       "press_vertical"),
+], ids=["adjust_series", "completado", "reemplazo"])
+def test_cambios_del_dia_invalidan(sesion, cambio):
+    antes = sesion.get_snapshot_sesion(UID, 1, "lunes")
+    cambio(sesion)
+    assert _igual_a_la_db(sesion) != antes
+
+
+def test_clear_sesion_descarta_el_dia(sesion):
+    sesion.clear_sesion_activa(UID)
+    assert sesion._cache_dia.get(UID) is None
+
+
+def test_prioridad_muscular_invalida(sesion):
+    import science as sci
+    # Mismas series en los cuatro grupos: pierna tiene más tolerancia, gana
+    # y suma series el lunes
+    sesion.insert_plan(UID, plan_de_prueba(dias=("lunes", "martes", "miercoles", "jueves")), [])
+    sesion.execute("""UPDATE rutinas SET grupo=CASE dia WHEN 'lunes' THEN 'pierna'
+                      WHEN 'martes' THEN 'pecho' WHEN 'miercoles' THEN 'espalda' ELSE 'hombro' END
+                      WHERE user_id=?""", (UID,))
+    antes = sesion.cargar_sesion(UID, 1, "lunes")
+    assert sci.aplicar_prioridad_muscular(UID, 1)["ganador"] == "pierna"
+    assert _igual_a_la_db(sesion) != antes
+
+
+def test_sesion_activa_escribe_a_traves(sesion):
+    assert sesion.get_sesion_activa(UID) is None
+    sesion.save_sesion_activa(UID, 1, "lunes", 2)
+    sesion.flush_escrituras()
+    cacheada = sesion.get_sesion_activa(UID)
+    sesion._cache_sesion.limpiar()
+    de_la_db = sesion.get_sesion_activa(UID)
+    assert {k: cacheada[k] for k in ("semana", "dia", "ej_idx", "fase")} == \
+           {k: de_la_db[k] for k in ("semana", "dia", "ej_idx", "fase")}
+    sesion.clear_sesion_activa(UID)
+    assert sesion.get_sesion_activa(UID) is None
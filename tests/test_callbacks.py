@@ -0,0 +1,115 @@
+"""
+Registro de callbacks del bot: callback_router despacha por la ruta (lo que
+va antes del primer ':') con su límite, y todo callback_data que arman los
+teclados tiene handler.
+"""
+import asyncio
+import glob
+import os
+import re
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from conftest import RAIZ, UID
+
+
+class QueryFalsa:
+    def __init__(self, data, uid=UID):
+        self.data      = data
+        self.from_user = SimpleNamespace(id=uid, first_name="Ana")
+        self.message   = SimpleNamespace(chat_id=uid)
+        self.respuestas: list[tuple] = []
+
+    async def answer(self, texto=None, show_alert=False):
+        self.respuestas.append((texto, show_alert))
+
+
+class BotFalso:
+    def __init__(self):
+        self.enviados: list[dict] = []
+
+    async def send_message(self, **kw):
+        self.enviados.append(kw)
+
+
+@pytest.fixture
+def router(db, monkeypatch):
+    import handlers
+    import metricas
+    db.add_allowed_user(UID)
+    llamadas, registradas = [], []
+    monkeypatch.setattr(metricas, "registrar_callback",
+                        lambda ruta, seg, ok=True: registradas.append((ruta, ok)))
+    bot = BotFalso()
+
+    def despachar(data, uid=UID):
+        query  = QueryFalsa(data, uid)
+        update = SimpleNamespace(callback_query=query)
+        asyncio.run(handlers.callback_router(update, SimpleNamespace(bot=bot)))
+        return query
+
+    def ruta(nombre, fn=None, **kw):
+        async def anotar(cb):
+            llamadas.append((cb.partes, cb.arg, cb.uid, cb.nombre))
+        monkeypatch.setitem(handlers._RUTAS, nombre, handlers.Ruta(fn or anotar, **kw))
+
+    return SimpleNamespace(handlers=handlers, despachar=despachar, ruta=ruta, bot=bot,
+                           llamadas=llamadas, registradas=registradas)
+
+
+def test_despacha_por_ruta_con_sus_argumentos(router):
+    router.ruta("prueba")
+    query = router.despachar("prueba:a:b")
+    assert router.llamadas == [(["prueba", "a", "b"], "a", UID, "Ana")]
+    assert query.respuestas == [(None, False)]
+    assert router.registradas == [("prueba", True)]
+
+
+def test_ruta_desconocida_no_llama_a_nadie(router):
+    router.ruta("prueba")
+    router.despachar("pruebas:x")
+    assert router.llamadas == []
+    assert router.registradas == [("<sin_ruta>", True)]
+
+
+def test_usuario_no_habilitado(router):
+    router.ruta("prueba")
+    query = router.despachar("prueba", uid=UID + 1)
+    assert router.llamadas == [] and query.respuestas == [("Sin acceso.", False)]
+
+
+def test_limite_por_ruta_y_subacciones_libres(router, monkeypatch):
+    import limitador
+    gastos = []
+    monkeypatch.setattr(limitador, "consumir", lambda regla, clave: gastos.append(regla) or 30.0)
+    router.ruta("prueba", limite="plan", libres=("volver",))
+    query = router.despachar("prueba:otra")
+    assert router.llamadas == [] and gastos == ["plan"]
+    assert query.respuestas[0][1] is True   # alerta de espera
+    router.despachar("prueba:volver")
+    assert len(router.llamadas) == 1 and gastos == ["plan"]
+
+
+def test_error_del_handler_avisa_y_cuenta(router):
+    async def falla(cb):
+        raise RuntimeError("se rompió")
+    router.ruta("prueba", falla)
+    router.despachar("prueba")
+    assert router.registradas == [("prueba", False)]
+    assert "se rompió" in router.bot.enviados[0]["text"]
+
+
+def test_ruta_duplicada(router):
+    with pytest.raises(ValueError):
+        router.handlers.callback("menu")(lambda cb: None)
+
+
+def test_todo_callback_data_tiene_handler(router):
+    prefijos = set()
+    for path in glob.glob(os.path.join(RAIZ, "*.py")):
+        with open(path, encoding="utf-8") as f:
+            prefijos |= set(re.findall(r'callback_data\s*=\s*f?"([a-z_]+)', f.read()))
+    assert prefijos and not prefijos - set(router.handlers._RUTAS)
@@ -0,0 +1,77 @@
+"""
+Cierre de sesión en una transacción: si ciencia o gamificación fallan no
+queda nada guardado (pesos, día completado, progreso ni avance de día).
+"""
+import pytest
+
+from conftest import UID
+
+
+def _foto(db):
+    """Lo que el cierre toca, leído de la DB y de las caches."""
+    n = lambda tabla: db.fetchone(f"SELECT COUNT(*) AS n FROM {tabla} WHERE user_id=?", (UID,))["n"]
+    return {"pesos": n("pesos"), "progreso": n("progreso"),
+            "completados": db.fetchone("SELECT COUNT(*) AS n FROM rutinas WHERE user_id=? AND completado=1",
+                                       (UID,))["n"],
+            "estado": db.get_estado(UID),
+            "ultimo": [f["ultimo"] for f in db.get_snapshot_sesion(UID, 1, "lunes")]}
+
+
+@pytest.fixture(params=[False, True], ids=["directo", "write_behind"])
+def sesion(request, db, con_plan, monkeypatch):
+    monkeypatch.setattr(db, "DB_WRITE_BEHIND", request.param)
+    db.cargar_sesion(UID, 1, "lunes")
+    return db
+
+
+def test_transaccion_deshace_todo_y_limpia_caches(sesion, monkeypatch):
+    import eventos
+    db, avisos = sesion, []
+    monkeypatch.setattr(eventos, "publicar", lambda *a: avisos.append(a))
+    antes = _foto(db)
+    with pytest.raises(RuntimeError):
+        with db.transaccion():
+            db.save_peso(UID, "EMP_G01", 1, "lunes", 100, 3, "8")
+            db.marcar_dia_completado(UID, 1, "lunes")
+            db.save_progreso_sesion(UID, 1, "lunes", rir=2, progresion="si", fatiga=2)
+            db.upsert_estado(UID, 1, "miercoles")
+            raise RuntimeError("gamificación")
+    assert _foto(db) == antes
+    assert avisos == []   # los avisos del bloque deshecho no salen
+
+
+class TestRutaCompletar:
+    @pytest.fixture
+    def cliente(self, sesion):
+        pytest.importorskip("fastapi")
+        pytest.importorskip("jose")
+        pytest.importorskip("httpx")
+        from fastapi.testclient import TestClient
+        import api
+        headers = {"Authorization": f"Bearer {api.create_token(UID)}"}
+        body = {"semana": 1, "dia": "lunes", "rir": 2, "fatiga": 2,
+                "pesos": [{"ejercicio_id": "EMP_G01", "peso_lbs": 100, "series": 3, "reps": "8"}]}
+        with TestClient(api.app, raise_server_exceptions=False) as c:
+            yield lambda: c.post("/sesion/completar", json=body, headers=headers)
+
+    def test_falla_gamificacion_y_no_guarda_nada(self, sesion, cliente, monkeypatch):
+        import gamification as gam
+
+        def falla(**kw):
+            raise RuntimeError("gamificación caída")
+
+        antes = _foto(sesion)
+        monkeypatch.setattr(gam, "procesar_fin_sesion", falla)
+        resp = cliente()
+        assert resp.status_code == 500
+        assert "no se guardó nada" in resp.json()["detail"]
+        assert _foto(sesion) == antes
+
+    def test_cierre_normal_guarda_y_avanza(self, sesion, cliente):
+        resp = cliente()
+        assert resp.status_code == 200
+        assert resp.json()["siguiente_dia"] == {"semana": 1, "dia": "miercoles"}
+        sesion.flush_escrituras()
+        despues = _foto(sesion)
+        assert despues["pesos"] == 1 and despues["completados"] == 3
+        assert despues["estado"] == (1, "miercoles")
@@ -0,0 +1,83 @@
+"""
+Cola de envíos: RetryAfter pausa y reencola, errores de red se reintentan
+con backoff, request inválido falla de una.
+"""
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("telegram")
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+
+class BotFalso:
+    """send_message levanta los errores de `fallas` en orden y después contesta."""
+
+    def __init__(self, *fallas):
+        self.fallas  = list(fallas)
+        self.llamadas: list[float] = []
+
+    async def send_message(self, chat_id, text, **kw):
+        self.llamadas.append(time.monotonic())
+        if self.fallas:
+            raise self.fallas.pop(0)
+        return {"chat_id": chat_id, "text": text}
+
+
+@pytest.fixture
+def envios(monkeypatch):
+    import envios
+    import limitador
+    # Estado nuevo por test: la cola vive en el loop de cada asyncio.run
+    monkeypatch.setattr(envios, "_cola", None)
+    monkeypatch.setattr(envios, "_workers", [])
+    monkeypatch.setattr(envios, "_pausa_hasta", 0.0)
+    monkeypatch.setattr(envios, "_STATS", dict.fromkeys(envios._STATS, 0))
+    monkeypatch.setattr(envios, "ENVIOS_WORKERS", 2)
+    monkeypatch.setattr(limitador, "consumir", lambda regla, clave: 0.0)
+    return envios
+
+
+def _enviar(envios, bot):
+    return asyncio.run(asyncio.wait_for(envios.enviar(bot, 42, "hola"), timeout=10))
+
+
+def test_envio_directo(envios):
+    bot = BotFalso()
+    assert _enviar(envios, bot) == {"chat_id": 42, "text": "hola"}
+    assert envios.stats()["enviados"] == 1 and envios.stats()["reintentos"] == 0
+
+
+def test_retry_after_pausa_y_reencola(envios):
+    bot = BotFalso(RetryAfter(1))
+    assert _enviar(envios, bot)["text"] == "hola"
+    assert len(bot.llamadas) == 2
+    assert bot.llamadas[1] - bot.llamadas[0] >= 0.9   # esperó lo que pidió Telegram
+    st = envios.stats()
+    assert st["reintentos"] == 1 and st["frenados"] >= 1 and st["fallidos"] == 0
+
+
+def test_error_de_red_se_reintenta_con_backoff(envios):
+    bot = BotFalso(NetworkError("conexión cortada"))
+    assert _enviar(envios, bot)["text"] == "hola"
+    assert bot.llamadas[1] - bot.llamadas[0] >= 1.9   # 2 ** 1
+    assert envios.stats()["reintentos"] == 1
+
+
+def test_bad_request_falla_sin_reintentar(envios):
+    bot = BotFalso(BadRequest("Chat not found"))
+    with pytest.raises(BadRequest):
+        _enviar(envios, bot)
+    assert len(bot.llamadas) == 1
+    assert envios.stats()["fallidos"] == 1 and envios.stats()["reintentos"] == 0
+
+
+def test_reintentos_agotados(envios, monkeypatch):
+    monkeypatch.setattr(envios, "ENVIOS_REINTENTOS", 1)
+    bot = BotFalso(RetryAfter(0), RetryAfter(0), RetryAfter(0))
+    with pytest.raises(RetryAfter):
+        _enviar(envios, bot)
+    assert len(bot.llamadas) == 2
+    assert envios.stats()["fallidos"] == 1
@@ -0,0 +1,40 @@
+"""/events solo acepta el token corto de POST /events/token, nunca el de login."""
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("jose")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+
+from conftest import UID
+
+
+@pytest.fixture
+def cliente(db):
+    import api
+    with TestClient(api.app) as c:
+        yield api, c
+
+
+def test_token_de_eventos_es_corto_y_solo_para_events(cliente):
+    api, c = cliente
+    login = api.create_token(UID)
+    resp  = c.post("/events/token", headers={"Authorization": f"Bearer {login}"})
+    assert resp.status_code == 200
+    token = resp.json()["token"]
+    assert resp.json()["expira_en"] == api.SSE_TOKEN_SEG
+    assert api._uid_de_token(token, uso="events") == UID
+    # No sirve como Bearer en el resto de la API
+    assert c.get("/stats", headers={"Authorization": f"Bearer {token}"}).status_code == 401
+
+
+def test_events_rechaza_el_jwt_de_login(cliente):
+    api, c = cliente
+    assert c.get("/events", params={"token": api.create_token(UID)}).status_code == 401
+
+
+def test_events_rechaza_token_vencido(cliente):
+    api, c = cliente
+    vencido = api.create_token(UID, uso="events", segundos=-1)
+    assert c.get("/events", params={"token": vencido}).status_code == 401
@@ -0,0 +1,37 @@
+"""/metrics cerrado por defecto: token, localhost o METRICS_PUBLICO=1."""
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def api(db, monkeypatch):
+    import api
+    monkeypatch.setattr(api, "METRICS_TOKEN", "")
+    monkeypatch.setattr(api, "METRICS_PUBLICO", False)
+    return api
+
+
+def test_sin_token_rechaza_clientes_remotos(api):
+    # TestClient se presenta como host "testclient", no localhost
+    with TestClient(api.app) as c:
+        assert c.get("/metrics").status_code == 403
+
+
+def test_publico_es_opt_in(api, monkeypatch):
+    monkeypatch.setattr(api, "METRICS_PUBLICO", True)
+    with TestClient(api.app) as c:
+        resp = c.get("/metrics")
+    assert resp.status_code == 200
+    assert "gymcoach_db_pool_idle" in resp.text
+
+
+def test_con_token(api, monkeypatch):
+    monkeypatch.setattr(api, "METRICS_TOKEN", "s3creto")
+    with TestClient(api.app) as c:
+        assert c.get("/metrics").status_code == 401
+        assert c.get("/metrics", headers={"Authorization": "Bearer otro"}).status_code == 401
+        assert c.get("/metrics", headers={"Authorization": "Bearer s3creto"}).status_code == 200
@@ -0,0 +1,74 @@
+"""Paginación por cursor de los historiales (/progreso/{eid}, /analisis/historial)."""
+import pytest
+
+from conftest import UID
+
+
+@pytest.fixture
+def con_pesos(db):
+    # Semana 1 con dos registros: cuenta el mejor
+    for semana, peso in ((1, 100), (1, 90), (2, 110), (3, 105), (4, 120), (5, 125)):
+        db.save_peso(UID, "EMP_G01", semana, "lunes", peso)
+    return db
+
+
+def _recorrer(db, **kw):
+    paginas, cursor = [], None
+    while True:
+        filas, cursor = db.get_progresion_pagina(UID, "EMP_G01", cursor=cursor, **kw)
+        paginas.append([f["semana"] for f in filas])
+        if cursor is None:
+            return paginas
+
+
+def test_progresion_por_cursor_recorre_cada_semana_una_vez(con_pesos):
+    assert _recorrer(con_pesos, limite=2) == [[1, 2], [3, 4], [5]]
+    assert _recorrer(con_pesos, limite=10) == [[1, 2, 3, 4, 5]]
+    completa = con_pesos.get_progresion_ejercicio(UID, "EMP_G01")
+    pagina, siguiente = con_pesos.get_progresion_pagina(UID, "EMP_G01")
+    assert pagina == completa and siguiente is None
+
+
+def test_progresion_filtra_por_semana(con_pesos):
+    assert _recorrer(con_pesos, desde=2, hasta=4, limite=2) == [[2, 3], [4]]
+
+
+def test_ganancia_es_sobre_todo_el_historial(con_pesos):
+    assert con_pesos.get_ganancia_ejercicio(UID, "EMP_G01") == 25.0
+    assert con_pesos.get_ganancia_ejercicio(UID, "OTRO") == 0.0
+
+
+def test_analisis_por_cursor_mas_nuevos_primero(db):
+    for i in range(5):
+        db.save_analisis(UID, f"texto {i}", "semanal")
+    vistos, cursor = [], None
+    while True:
+        filas, cursor = db.get_analisis_pagina(UID, limite=2, cursor=cursor)
+        vistos += [f["texto"] for f in filas]
+        if cursor is None:
+            break
+    assert vistos == [f"texto {i}" for i in reversed(range(5))]
+    with pytest.raises(ValueError):
+        db.get_analisis_pagina(UID, cursor="basura")
+
+
+class TestRutaProgreso:
+    @pytest.fixture
+    def cliente(self, con_pesos):
+        pytest.importorskip("fastapi")
+        pytest.importorskip("httpx")
+        from fastapi.testclient import TestClient
+        import api
+        headers = {"Authorization": f"Bearer {api.create_token(UID)}"}
+        with TestClient(api.app) as c:
+            yield lambda params=None: c.get("/progreso/EMP_G01", params=params, headers=headers)
+
+    def test_ganancia_total_no_depende_de_la_pagina(self, cliente):
+        resp = cliente({"semana_desde": 2, "semana_hasta": 3}).json()
+        assert [h["semana"] for h in resp["historial"]] == [2, 3]
+        assert resp["ganancia_pagina"] == -5.0
+        assert resp["ganancia_total"] == 25.0
+        assert resp["tendencia"] == "up"
+
+    def test_from_to_con_fechas_da_400(self, cliente):
+        assert cliente({"from": "2026-01-01"}).status_code == 400
@@ -0,0 +1,61 @@
+"""Pool de conexiones: checkout/checkin reutilizan y DB_PATH nuevo descarta el pool."""
+import pytest
+
+
+@pytest.fixture
+def pool(db):
+    db.close_pool()
+    return db
+
+
+def test_checkin_devuelve_y_checkout_reutiliza(pool):
+    antes = pool.pool_stats()
+    conn  = pool._checkout()
+    pool._checkin(conn)
+    assert pool.pool_stats()["ociosas"] == 1
+    assert pool._checkout() is conn
+    pool._checkin(conn)
+    despues = pool.pool_stats()
+    assert despues["creadas"] - antes["creadas"] == 1
+    assert despues["reutilizadas"] - antes["reutilizadas"] == 1
+
+
+def test_lecturas_seguidas_usan_una_sola_conexion(pool):
+    antes = pool.pool_stats()["creadas"]
+    for _ in range(5):
+        pool.fetchone("SELECT 1")
+    assert pool.pool_stats()["creadas"] - antes == 1
+
+
+def test_checkouts_anidados_abren_otra_en_vez_de_esperar(pool):
+    with pool.get_db() as a, pool.get_db() as b:
+        assert a is not b
+    assert pool.pool_stats()["ociosas"] == 2
+
+
+def test_no_guarda_conexiones_con_transaccion_abierta(pool):
+    conn = pool._checkout()
+    conn.execute("BEGIN")
+    pool._checkin(conn)
+    assert pool.pool_stats()["ociosas"] == 0
+
+
+def test_respeta_el_maximo_de_ociosas(pool, monkeypatch):
+    monkeypatch.setattr(pool, "DB_POOL_SIZE", 1)
+    a, b = pool._checkout(), pool._checkout()
+    pool._checkin(a)
+    pool._checkin(b)
+    assert pool.pool_stats()["ociosas"] == 1
+
+
+def test_cambiar_db_path_descarta_el_pool(pool, tmp_path, monkeypatch):
+    pool.fetchone("SELECT 1")
+    vieja = pool._checkout()
+    pool._checkin(vieja)
+    monkeypatch.setattr(pool, "DB_PATH", str(tmp_path / "otra" / "coach.db"))
+    nueva = pool._checkout()
+    try:
+        assert nueva is not vieja
+        assert nueva.execute("PRAGMA database_list").fetchone()["file"].endswith("otra/coach.db")
+    finally:
+        pool._checkin(nueva)
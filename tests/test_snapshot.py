@@ -0,0 +1,44 @@
+"""get_day_snapshot da lo mismo que las lecturas por ejercicio que reemplazó."""
+from conftest import UID
+
+
+def _por_ejercicio(db, semana, dia):
+    """El camino viejo: get_ejercicios_dia + get_ultimo_peso/get_peso_sugerido por fila."""
+    return [(e, db.get_ultimo_peso(UID, e["ejercicio_id"]), db.get_peso_sugerido(UID, e["ejercicio_id"]))
+            for e in db.get_ejercicios_dia(UID, semana, dia)]
+
+
+def _comparar(db, semana, dia):
+    snapshot = db.get_day_snapshot(UID, semana, dia)
+    viejo    = _por_ejercicio(db, semana, dia)
+    assert len(snapshot) == len(viejo) > 0
+    for fila, (ej, ultimo, sugerido) in zip(snapshot, viejo):
+        assert {k: fila[k] for k in ej} == ej
+        if ultimo is None:
+            assert fila["ultimo"] is None
+        else:
+            assert {k: fila["ultimo"][k] for k in ultimo} == ultimo
+        assert fila["peso_sugerido"] == sugerido
+        assert fila["es_cardio"] == ej["ejercicio_id"].startswith("CAR")
+
+
+def test_sin_historial(db, con_plan):
+    _comparar(db, 1, "lunes")
+
+
+def test_con_historial(db, con_plan):
+    db.save_peso(UID, "EMP_G01", 1, "lunes", 100, 3, "8")
+    db.save_peso(UID, "EMP_G01", 1, "miercoles", 105, 3, "8")
+    db.save_peso(UID, "EMP_G02", 2, "lunes", 60, 3, "10")
+    # Una carga tardía de una semana anterior no le gana a la semana más alta
+    db.save_peso(UID, "EMP_G02", 1, "miercoles", 55, 3, "10")
+    _comparar(db, 1, "lunes")
+    _comparar(db, 2, "miercoles")
+    fila = {f["ejercicio_id"]: f for f in db.get_day_snapshot(UID, 2, "lunes")}
+    assert fila["EMP_G01"]["ultimo"]["peso_lbs"] == 105
+    assert fila["EMP_G02"]["ultimo"]["peso_lbs"] == 60
+    assert fila["CAR_G01"]["ultimo"] is None and fila["CAR_G01"]["es_cardio"]
+
+
+def test_dia_sin_rutina(db, con_plan):
+    assert db.get_day_snapshot(UID, 1, "domingo") == []
@@ -0,0 +1,143 @@
+"""
+Bot en modo webhook contra una Bot API falsa local.
+
+TelegramFalso contesta lo que PTB pide al arrancar (getMe, setWebhook) y
+guarda cada llamada; después hace de Telegram: postea updates a la URL y
+con el secret que el bot registró en setWebhook.
+"""
+import json
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("telegram")
+pytest.importorskip("httpx")
+
+from fastapi.testclient import TestClient
+
+
+class TelegramFalso:
+    def __init__(self):
+        self.llamadas: list[tuple[str, dict]] = []
+        falso = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                largo  = int(self.headers.get("Content-Length") or 0)
+                cuerpo = self.rfile.read(largo).decode()
+                if "json" in self.headers.get("Content-Type", ""):
+                    params = json.loads(cuerpo or "{}")
+                else:
+                    params = {k: v[0] for k, v in urllib.parse.parse_qs(cuerpo).items()}
+                metodo = self.path.rsplit("/", 1)[-1]
+                falso.llamadas.append((metodo, params))
+                data = json.dumps({"ok": True, "result": falso.resultado(metodo, params)}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url    = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def resultado(self, metodo: str, params: dict):
+        if metodo == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Falso", "username": "falso_bot"}
+        if metodo == "sendMessage":
+            return {"message_id": len(self.llamadas), "date": int(time.time()),
+                    "chat": {"id": int(params["chat_id"]), "type": "private"},
+                    "text": params.get("text", "")}
+        return True
+
+    def esperar(self, metodo: str, timeout: float = 10.0) -> dict:
+        fin = time.monotonic() + timeout
+        while time.monotonic() < fin:
+            for m, params in list(self.llamadas):
+                if m == metodo:
+                    return params
+            time.sleep(0.05)
+        pytest.fail(f"El bot no llamó a {metodo}; llamadas: {[m for m, _ in self.llamadas]}")
+
+    def entregar(self, cliente: TestClient, update: dict):
+        """Lo que hace Telegram: POST a la URL del webhook con el header secreto."""
+        hook = self.esperar("setWebhook")
+        ruta = urllib.parse.urlsplit(hook["url"]).path
+        return cliente.post(ruta, json=update,
+                            headers={"X-Telegram-Bot-Api-Secret-Token": hook["secret_token"]})
+
+
+def _update(uid: int, texto: str, update_id: int = 1) -> dict:
+    mensaje = {"message_id": update_id, "date": int(time.time()), "text": texto,
+               "chat": {"id": uid, "type": "private"},
+               "from": {"id": uid, "is_bot": False, "first_name": "Ana"}}
+    if texto.startswith("/"):
+        mensaje["entities"] = [{"type": "bot_command", "offset": 0, "length": len(texto)}]
+    return {"update_id": update_id, "message": mensaje}
+
+
+@pytest.fixture
+def telegram(db, monkeypatch):
+    import api
+    falso = TelegramFalso()
+    monkeypatch.setenv("TELEGRAM_TOKEN", "123:falso")
+    monkeypatch.setattr(api, "TELEGRAM_API_URL", falso.url)
+    monkeypatch.setattr(api, "TELEGRAM_WEBHOOK_URL", "http://testserver")
+    monkeypatch.setattr(api, "TELEGRAM_WEBHOOK_SECRET", "")
+    monkeypatch.setattr(api, "BOT_JOBS", "0")
+    with TestClient(api.app) as cliente:
+        falso.esperar("setWebhook")
+        yield falso, cliente
+    falso.server.shutdown()
+
+
+def test_set_webhook_registra_url_publica_y_secret(telegram):
+    falso, _ = telegram
+    hook = falso.esperar("setWebhook")
+    assert hook["url"].startswith("http://testserver/telegram/webhook/")
+    assert hook["url"].rsplit("/", 1)[-1] == hook["secret_token"]
+
+
+def test_update_por_webhook_llega_al_bot(telegram):
+    falso, cliente = telegram
+    resp = falso.entregar(cliente, _update(42, "/start"))
+    assert resp.status_code == 200
+    msg = falso.esperar("sendMessage")   # 42 no está habilitado
+    assert int(msg["chat_id"]) == 42
+    assert "Sin acceso" in msg["text"]
+
+
+def test_webhook_rechaza_secret_o_header_incorrectos(telegram):
+    falso, cliente = telegram
+    hook = falso.esperar("setWebhook")
+    ruta = urllib.parse.urlsplit(hook["url"]).path
+    assert cliente.post("/telegram/webhook/otro", json=_update(42, "/start")).status_code == 404
+    assert cliente.post(ruta, json=_update(42, "/start"),
+                        headers={"X-Telegram-Bot-Api-Secret-Token": "x"}).status_code == 403
+
+
+def test_un_solo_worker_toma_los_jobs(db, monkeypatch):
+    import fcntl
+    import api
+    monkeypatch.setattr(api, "BOT_JOBS", "auto")
+    monkeypatch.setattr(api, "_jobs_lock_fd", None)
+    assert api._tomar_jobs()
+    # Otro worker (otra descripción de archivo) no puede tomar el lock
+    fd = os.open(f"{db.DB_PATH}.jobs.lock", os.O_RDWR)
+    try:
+        with pytest.raises(BlockingIOError):
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    finally:
+        os.close(fd)
+        os.close(api._jobs_lock_fd)
@@ -0,0 +1,81 @@
+"""
+Write-behind (DB_WRITE_BEHIND=1): leer lo propio, reintentos y escrituras
+que no se pudieron guardar.
+"""
+import sqlite3
+import threading
+
+import pytest
+
+from conftest import UID
+
+
+@pytest.fixture
+def wb(db, monkeypatch):
+    monkeypatch.setattr(db, "DB_WRITE_BEHIND", True)
+    monkeypatch.setattr(db, "DB_WRITE_BEHIND_MS", 200)
+    db._wb_fallidas.clear()
+    return db
+
+
+def _pesos(db, uid=UID):
+    return db.fetchone("SELECT COUNT(*) AS n FROM pesos WHERE user_id=?", (uid,))["n"]
+
+
+def test_get_db_con_user_id_lee_lo_encolado(wb):
+    wb.save_peso(UID, "EMP_G01", 1, "lunes", 100)
+    assert UID in wb._wb_pendientes
+    with wb.get_db(UID) as conn:
+        n = conn.execute("SELECT COUNT(*) FROM pesos WHERE user_id=?", (UID,)).fetchone()[0]
+    assert n == 1
+
+
+def test_get_db_de_otro_usuario_no_espera(wb, monkeypatch):
+    evento   = threading.Event()
+    original = wb._escribir_lote
+
+    def lento(lote):
+        evento.wait(5)
+        return original(lote)
+
+    monkeypatch.setattr(wb, "_escribir_lote", lento)
+    try:
+        wb.save_peso(UID, "EMP_G01", 1, "lunes", 100)
+        with wb.get_db(UID + 1) as conn:   # no espera la cola de UID
+            conn.execute("SELECT 1").fetchone()
+        assert UID in wb._wb_pendientes
+    finally:
+        evento.set()
+    assert wb.esperar_escrituras(UID, timeout=5)
+
+
+def test_error_transitorio_se_reintenta_sin_perder_el_peso(wb, monkeypatch):
+    original = wb._conexion
+    fallos = {"n": 3}   # el lote y los dos primeros reintentos
+
+    def conexion():
+        if fallos["n"]:
+            fallos["n"] -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return original()
+
+    monkeypatch.setattr(wb, "_conexion", conexion)
+    wb.save_peso(UID, "EMP_G01", 1, "lunes", 100)
+    assert wb.esperar_escrituras(UID, timeout=10)
+    monkeypatch.setattr(wb, "_conexion", original)
+    assert _pesos(wb) == 1
+    assert wb.write_behind_stats()["reintentos"] >= 1
+    assert not wb.write_behind_stats()["fallidas"]
+
+
+def test_error_permanente_queda_registrado_y_avisa(wb, monkeypatch):
+    import eventos
+    avisos = []
+    monkeypatch.setattr(eventos, "publicar", lambda uid, tipo, datos=None: avisos.append((uid, tipo, datos)))
+    wb.execute("""CREATE TRIGGER rechazar BEFORE INSERT ON pesos
+                  BEGIN SELECT RAISE(ABORT, 'rechazado'); END""")
+    wb.save_peso(UID, "EMP_G01", 1, "lunes", 100)
+    assert wb.esperar_escrituras(UID, timeout=10)
+    fallidas = wb.write_behind_stats()["fallidas"]
+    assert len(fallidas) == 1 and fallidas[0]["params"][0] == UID
+    assert (UID, "error_guardado", {"tabla": "pesos"}) in avisos